@@ -13,8 +13,10 @@ and its chapters required by publish.output to produce its output.
 
 
 import logging
+import os
 from datetime import date
-from typing import List
+from fnmatch import fnmatch
+from typing import Iterable, List, Optional, Union
 
 LOG = logging.getLogger(__name__)
 LOG.addHandler(logging.NullHandler())
@@ -134,14 +136,88 @@ class Chapter:
             in the resulting output or not.
 
             Default: True
+        tags (List[str]): The tags of the chapter, used to select the chapters a substitution
+            applies to.
     """
 
     # pylint: disable=too-few-public-methods
 
     def __init__(self,
                  src: str,
-                 publish: bool = True):
+                 publish: bool = True,
+                 tags: Optional[Union[str, Iterable[str]]] = None):
         """Initializes a new instance of the :class:`Chapter` class.
         """
         self.src = src
         self.publish = publish
+        self.tags = _to_list(tags)
+
+
+class ChapterSelector:
+    """The ChapterSelector selects chapters by their source path or their tags, for example to
+    limit a substitution to the chapters it is meant for.
+
+    A chapter is selected if its source path matches any of the paths or if it has any of the
+    tags. Paths may be glob patterns, in which `*` also matches path separators.
+
+    Args:
+        paths: The source paths or glob patterns of the chapters to select.
+        tags: The tags of the chapters to select.
+
+    Attributes:
+        paths (List[str]): The source paths or glob patterns of the chapters to select.
+        tags (List[str]): The tags of the chapters to select.
+    """
+
+    def __init__(self,
+                 paths: Optional[Union[str, Iterable[str]]] = None,
+                 tags: Optional[Union[str, Iterable[str]]] = None):
+        """Initializes a new instance of the :class:`ChapterSelector` class.
+        """
+        self.paths = _to_list(paths)
+        self.tags = _to_list(tags)
+        self.__patterns = [os.path.normpath(path) for path in self.paths]
+
+    def matches(self, chapter: Chapter) -> bool:
+        """Tells whether the chapter is selected.
+
+        Args:
+            chapter: The chapter.
+
+        Returns:
+            True if the chapter is selected, otherwise False.
+        """
+        if any(tag in self.tags for tag in chapter.tags):
+            return True
+
+        src = os.path.normpath(chapter.src)
+
+        return any(fnmatch(src, pattern) for pattern in self.__patterns)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ChapterSelector) and \
+            (self.paths, self.tags) == (other.paths, other.tags)
+
+    def __hash__(self) -> int:
+        return hash((tuple(self.paths), tuple(self.tags)))
+
+    def __repr__(self) -> str:
+        return f'ChapterSelector(paths={self.paths!r}, tags={self.tags!r})'
+
+
+def _to_list(values: Optional[Union[str, Iterable[str]]]) -> List[str]:
+    """Turns a single string, an iterable of strings or None into a list of strings.
+
+    Args:
+        values: The string, strings or None.
+
+    Returns:
+        The list of strings.
+    """
+    if values is None:
+        return []
+
+    if isinstance(values, str):
+        return [values]
+
+    return [str(value) for value in values]
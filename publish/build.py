@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""This module defines the build context and the build function used to make several outputs
+of the same book in one go.
+
+Each output defined by a project renders the book into an html document before writing it to
+disk or passing it on to ebook-convert. Within a single build, most outputs render the very
+same document, so the build context renders each distinct document only once and hands it to
+every output that needs it.
+
+Independent outputs can be made concurrently by a bounded pool of worker threads. Most of the
+time of an ebook output is spent waiting for ebook-convert, so threads are sufficient to keep
+several conversions running at once.
+
+Optionally, the build records a fingerprint of everything each output depends on in a build
+manifest, and skips outputs whose fingerprint is unchanged since the last build.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import (TYPE_CHECKING, Any, Callable, Dict, Hashable, Iterable, Iterator, List,
+                    Optional)
+
+from publish import __version__
+from publish.book import Book
+from publish.cache import (CACHE_DIRECTORY, ArtifactStore, RenderCache, fingerprint_substitutions,
+                           hash_file, hash_key, write_text_atomically)
+from publish.changes import ChangeDetector
+from publish.substitution import Substitution
+
+if TYPE_CHECKING:  # pragma: no cover
+    from publish.output import HtmlOutput  # noqa: F401 pylint: disable=cyclic-import
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(logging.NullHandler())
+
+MANIFEST_VERSION = 2
+"""The version of the format of the manifest file. Manifests of other versions are ignored."""
+
+_TRANSIENT_ATTRIBUTES = ('jobs', 'processes', 'streaming', 'memory_map', 'timeout',
+                         'stream_output', 'conversion_result', 'images')
+"""The output attributes that don't affect the content of the output. Whether `jobs` and
+`streaming` make the output render its chapters separately does, so that is part of the
+fingerprint on its own."""
+
+
+class BuildContext:
+    """The BuildContext holds the state shared by all outputs made during a single build.
+
+    Outputs ask the build context for their html document instead of rendering it themselves.
+    The document is rendered by the first output asking for it and reused by every following
+    output with the same render key. See `HtmlOutput.get_render_key` for what makes up the key.
+
+    The build context is thread-safe. Outputs made concurrently that ask for the same document
+    wait for the first of them to render it.
+
+    Args:
+        cache: The optional render cache used to skip substituting and rendering chapters that
+            have not changed since the last build.
+        artifacts: The optional artifact store used to skip ebook-convert calls whose result
+            is already known.
+
+    Attributes:
+        cache (RenderCache): The render cache or None.
+        artifacts (ArtifactStore): The artifact store or None.
+        hits (int): The number of times a document was reused.
+        misses (int): The number of times a document had to be rendered.
+    """
+
+    def __init__(self,
+                 cache: Optional[RenderCache] = None,
+                 artifacts: Optional[ArtifactStore] = None):
+        """Initializes a new instance of the :class:`BuildContext` class.
+        """
+        self.__documents: Dict[Hashable, str] = {}
+        self.__locks: Dict[Hashable, threading.Lock] = {}
+        self.__lock = threading.Lock()
+        self.cache = cache
+        self.artifacts = artifacts
+        self.hits = 0
+        self.misses = 0
+
+    def get_document(self,
+                     key: Hashable,
+                     render: Callable[[], str]) -> str:
+        """Gets the document for the render key, rendering it only if no document has been
+        rendered for the same key before.
+
+        Args:
+            key: The render key.
+            render: The function rendering the document if it is not known yet.
+
+        Returns:
+            The document.
+        """
+        with self.__lock:
+            key_lock = self.__locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            if key in self.__documents:
+                self.hits += 1
+                LOG.info('Reusing the html document rendered for a previous output ...')
+                return self.__documents[key]
+
+            self.misses += 1
+            document = render()
+            self.__documents[key] = document
+
+        return document
+
+
+class BuildManifest:
+    """The BuildManifest records the fingerprint of each output made by the previous builds.
+
+    Outputs packing local images referred to by the chapters, such as
+    :class:`publish.epub.EpubOutput`, only know these images once they are made. The manifest
+    records them along with the fingerprint, so that they are part of the fingerprint of the
+    next build as well. See :meth:`restore_images`.
+
+    The manifest is read when it is created and written back by :meth:`save`.
+
+    Args:
+        path: The path of the manifest file.
+
+            Defaults to `.publish-cache/manifest.json`.
+        project: The content of the project file. It is part of the fingerprint of every output.
+        detector: The optional change detector used to tell the content hashes of the files
+            the outputs depend on. If omitted, every file is hashed.
+
+    Attributes:
+        path (str): The path of the manifest file.
+        project (str): The content of the project file.
+        detector (ChangeDetector): The change detector or None.
+    """
+
+    def __init__(self,
+                 path: str = os.path.join(CACHE_DIRECTORY, 'manifest.json'),
+                 project: str = '',
+                 detector: Optional[ChangeDetector] = None):
+        """Initializes a new instance of the :class:`BuildManifest` class.
+        """
+        self.path = path
+        self.project = project
+        self.detector = detector
+        self.__fingerprints: Dict[str, str] = {}
+        self.__images: Dict[str, List[str]] = {}
+        self._load()
+        self.__lock = threading.Lock()
+
+    def get_fingerprint(self,
+                        book: Book,
+                        substitutions: List[Substitution],
+                        output: 'HtmlOutput') -> Optional[str]:
+        """Gets the fingerprint of everything the output depends on.
+
+        That is the project file, the metadata and chapter files of the book, the substitutions,
+        the stylesheet, cover and template files, the images packed into the output, the
+        settings of the output, whether it renders its chapters separately and the version of
+        this package.
+
+        Args:
+            book: The book.
+            substitutions: The list of substitutions.
+            output: The output.
+
+        Returns:
+            The fingerprint or None if the output can't be fingerprinted, because some of the
+            substitutions can't.
+        """
+        substitutions_fingerprint = fingerprint_substitutions(substitutions)
+
+        if substitutions_fingerprint is None:
+            return None
+
+        chapters = tuple((chapter.src, chapter.publish, tuple(chapter.tags))
+                         for chapter in book.chapters)
+        files = tuple(self._hash_file(path) for path in get_dependencies(book, output))
+
+        return hash_key(__version__,
+                        self.project,
+                        _get_settings(book),
+                        chapters,
+                        substitutions_fingerprint,
+                        type(output).__name__,
+                        _get_settings(output, _TRANSIENT_ATTRIBUTES),
+                        getattr(output, 'renders_by_chapter', False),
+                        files)
+
+    def is_up_to_date(self, path: str, fingerprint: Optional[str]) -> bool:
+        """Determines whether the output at path was made from the inputs with the fingerprint
+        and still exists.
+
+        Args:
+            path: The path of the output.
+            fingerprint: The fingerprint of the inputs of the output.
+
+        Returns:
+            True if the output doesn't have to be made again, otherwise False.
+        """
+        with self.__lock:
+            recorded = self.__fingerprints.get(path)
+
+        return fingerprint is not None and recorded == fingerprint and os.path.isfile(path)
+
+    def restore_images(self, output: 'HtmlOutput'):
+        """Sets the images of an output that packs local images, but wasn't made by this
+        process yet, to the images recorded for it.
+
+        Args:
+            output: The output.
+        """
+        if getattr(output, 'images', False) is None:
+            with self.__lock:
+                output.images = list(self.__images.get(output.path, []))
+
+    def update(self,
+               path: str,
+               fingerprint: Optional[str],
+               images: Optional[List[str]] = None):
+        """Records that the output at path was made from the inputs with the fingerprint.
+
+        Args:
+            path: The path of the output.
+            fingerprint: The fingerprint of the inputs of the output. If None, the output is
+                removed from the manifest instead.
+            images: The local images packed into the output, if any.
+        """
+        with self.__lock:
+            self.__images.pop(path, None)
+
+            if fingerprint is None:
+                self.__fingerprints.pop(path, None)
+            else:
+                self.__fingerprints[path] = fingerprint
+
+                if images:
+                    self.__images[path] = list(images)
+
+    def save(self):
+        """Writes the manifest to its file.
+
+        The manifest is written atomically.
+        """
+        with self.__lock:
+            content = json.dumps({'version': MANIFEST_VERSION,
+                                  'fingerprints': self.__fingerprints,
+                                  'images': self.__images}, indent=2, sort_keys=True)
+
+        write_text_atomically(self.path, content)
+
+    def _hash_file(self, path: Optional[str]) -> Optional[str]:
+        """Gets the content hash of the file at path, asking the change detector if present.
+
+        Args:
+            path: The path of the file.
+
+        Returns:
+            The content hash or None if path is None or there is no file at path.
+        """
+        if not path:
+            return None
+
+        if self.detector:
+            return self.detector.get_hash(path)
+
+        return hash_file(path)
+
+    def _load(self):
+        """Reads the fingerprints and images by output path from the manifest file, unless it
+        doesn't exist or is invalid.
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                manifest = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return
+
+        if not isinstance(manifest, dict) or manifest.get('version') != MANIFEST_VERSION:
+            return
+
+        fingerprints = manifest.get('fingerprints')
+        images = manifest.get('images')
+
+        if isinstance(fingerprints, dict) and isinstance(images, dict):
+            self.__fingerprints = fingerprints
+            self.__images = images
+
+
+class OutputResult:
+    """The OutputResult describes how making a single output went.
+
+    Args:
+        path: The path of the output.
+        seconds: The wall time spent making the output in seconds.
+        skipped: Determines whether the output was skipped because it was up to date.
+
+    Attributes:
+        path (str): The path of the output.
+        seconds (float): The wall time spent making the output in seconds.
+        skipped (bool): Determines whether the output was skipped because it was up to date.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, path: str, seconds: float, skipped: bool = False):
+        """Initializes a new instance of the :class:`OutputResult` class.
+        """
+        self.path = path
+        self.seconds = seconds
+        self.skipped = skipped
+
+
+def divide_jobs(outputs: Iterable['HtmlOutput'], jobs: int):
+    """Divides the jobs between the outputs made at once and the processes rendering the
+    chapters of each output.
+
+    Every output renders its chapters separately if `jobs` is greater than 1, no matter how
+    many other outputs there are, so adding or removing an output never changes the html of
+    the others. Up to `jobs` outputs are made at once by :func:`build`, so each of them gets an
+    equal share of the processes to render its chapters with, and no more than `jobs` processes
+    render at the same time. A single output gets all of them.
+
+    Args:
+        outputs: The outputs.
+        jobs: The number of jobs.
+    """
+    outputs = list(outputs)
+    concurrent = max(1, min(jobs, len(outputs)))
+
+    for output in outputs:
+        output.jobs = jobs
+        output.processes = max(1, jobs // concurrent)
+
+
+def get_dependencies(book: Book, output: 'HtmlOutput') -> List[Optional[str]]:
+    """Gets the paths of the files the output depends on.
+
+    Args:
+        book: The book.
+        output: The output.
+
+    Returns:
+        The paths of the chapters the output publishes, followed by the paths of the cover, the
+        stylesheet and the template, each of which is None if not set, and the paths of the
+        local images the output packed the last time it was made, if it packs any.
+    """
+    chapters = output.get_chapters_to_be_published(book.chapters)
+
+    return [chapter.src for chapter in chapters] + [
+        book.cover,
+        getattr(output, 'stylesheet', None),
+        getattr(output, 'template', None),
+    ] + list(getattr(output, 'images', None) or [])
+
+
+def build(book: Book,  # pylint: disable=too-many-arguments
+          substitutions: Optional[Iterable[Substitution]] = None,
+          outputs: Optional[Iterable['HtmlOutput']] = None,
+          context: Optional[BuildContext] = None,
+          jobs: int = 1,
+          manifest: Optional[BuildManifest] = None) -> List[OutputResult]:
+    """Makes each of the outputs for the book and substitutions, sharing a single build context
+    between all of them.
+
+    Up to `jobs` outputs are made concurrently. Each log message emitted while making an output
+    is prefixed with the path of the output, and a summary of the wall time spent on each
+    output is logged at the end.
+
+    If making any output fails, the remaining outputs are still made before the first error is
+    raised.
+
+    If a manifest is passed, outputs whose inputs haven't changed since the last build and whose
+    file still exists are skipped, and the manifest is saved once all outputs are made.
+
+    Args:
+        book: The book.
+        substitutions: The list of substitutions.
+        outputs: The list of outputs.
+        context: The build context. If omitted, a new build context is created.
+        jobs: The maximum number of outputs made concurrently.
+
+            Defaults to 1, which makes one output after another.
+        manifest: The optional build manifest.
+
+    Returns:
+        The results of the outputs, in the same order as the outputs.
+    """
+    if not context:
+        context = BuildContext()
+
+    substitutions = list(substitutions) if substitutions else []
+    outputs = list(outputs) if outputs else []
+
+    def make(output: 'HtmlOutput') -> OutputResult:
+        start = time.perf_counter()
+        with _log_prefix(output.path):
+            fingerprint = None
+
+            if manifest:
+                manifest.restore_images(output)
+                fingerprint = manifest.get_fingerprint(book, substitutions, output)
+
+                if manifest.is_up_to_date(output.path, fingerprint):
+                    LOG.info('Up to date, skipping')
+                    return OutputResult(output.path, time.perf_counter() - start, skipped=True)
+
+                # Forget the previous fingerprint first, so that a failed build is never
+                # mistaken for an up to date output.
+                manifest.update(output.path, None)
+
+            images = getattr(output, 'images', None)
+            output.make(book, substitutions, context)
+
+            if manifest:
+                if getattr(output, 'images', None) != images:
+                    # The next build fingerprints the images packed by this one.
+                    fingerprint = manifest.get_fingerprint(book, substitutions, output)
+                manifest.update(output.path, fingerprint, getattr(output, 'images', None))
+        return OutputResult(output.path, time.perf_counter() - start)
+
+    with _prefixed_log_records():
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            futures = [executor.submit(make, output) for output in outputs]
+
+    if manifest:
+        manifest.save()
+
+    results = [future.result() for future in futures]
+
+    if context.cache:
+        context.cache.evict()
+
+    if context.artifacts:
+        context.artifacts.evict()
+
+    _log_summary(results)
+
+    return results
+
+
+def _log_summary(results: List[OutputResult]):
+    """Logs the wall time spent on each output.
+
+    Args:
+        results: The results of the outputs.
+    """
+    if not results:
+        return
+
+    width = max(len(result.path) for result in results)
+
+    LOG.info('Summary:')
+    for result in results:
+        suffix = '  (up to date)' if result.skipped else ''
+        LOG.info(f'  {result.path:<{width}}  {result.seconds:8.2f} s{suffix}')
+
+
+def _get_settings(obj: Any, excluded: Iterable[str] = ()) -> str:
+    """Gets a stable representation of the public attributes of obj holding plain values.
+
+    Args:
+        obj: The object.
+        excluded: The names of attributes to leave out.
+
+    Returns:
+        The representation.
+    """
+    plain_types = (str, int, float, bool, type(None), list, tuple, dict)
+
+    return repr(sorted((name, value) for name, value in vars(obj).items()
+                       if not name.startswith('_')
+                       and name not in excluded
+                       and isinstance(value, plain_types)))
+
+
+_LOG_PREFIX = threading.local()
+
+
+@contextmanager
+def _log_prefix(path: str) -> Iterator[None]:
+    """Prefixes all log messages emitted by the current thread with the path while the context
+    is active.
+
+    Only takes effect inside :func:`_prefixed_log_records`.
+
+    Args:
+        path: The path of the output being made.
+    """
+    _LOG_PREFIX.path = path
+    try:
+        yield
+    finally:
+        _LOG_PREFIX.path = None
+
+
+@contextmanager
+def _prefixed_log_records() -> Iterator[None]:
+    """Installs a log record factory prefixing the messages of all log records with the path
+    of the output made by the thread emitting them while the context is active.
+    """
+    previous_factory = logging.getLogRecordFactory()
+
+    def factory(*args, **kwargs) -> logging.LogRecord:
+        record = previous_factory(*args, **kwargs)
+        path = getattr(_LOG_PREFIX, 'path', None)
+
+        if path is not None:
+            # The message is only formatted with % if there are args, so only then must a %
+            # in the path be escaped.
+            prefix = path.replace('%', '%%') if record.args else path
+            record.msg = f'[{prefix}] {record.msg}'
+
+        return record
+
+    logging.setLogRecordFactory(factory)
+    try:
+        yield
+    finally:
+        logging.setLogRecordFactory(previous_factory)
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""This module offers the persistent caches used to skip substituting and rendering chapters
+that have not changed since the last build, and to skip ebook-convert calls whose result is
+already known.
+
+Cache entries are plain files below the cache directory, named after the hash of everything
+that went into producing them. The least recently used entries are evicted once the cache
+grows beyond its maximum size. A render cache without a directory keeps its entries in memory
+instead, for as long as the process lives.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Optional
+
+from publish.substitution import (Substitution, SimpleSubstitution, SimpleSubstitutionSet,
+                                  RegexSubstitution, TranslateSubstitution)
+
+if TYPE_CHECKING:  # pragma: no cover
+    from publish.changes import ChangeDetector  # noqa: F401 pylint: disable=cyclic-import
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(logging.NullHandler())
+
+CACHE_DIRECTORY = '.publish-cache'
+"""The directory all caches of a project are stored in, relative to the project."""
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+"""The default maximum size of the render cache in bytes."""
+
+DEFAULT_MAX_ARTIFACTS_SIZE = 1024 * 1024 * 1024
+"""The default maximum size of the artifact store in bytes."""
+
+_SUBSTITUTION_FINGERPRINTS: Dict[type, Callable[[Any], tuple]] = {
+    SimpleSubstitution: lambda s: ('simple', s.old, s.new),
+    SimpleSubstitutionSet: lambda s: ('simple-set',
+                                      tuple((item.old, item.new) for item in s.substitutions)),
+    RegexSubstitution: lambda s: ('regex', s.pattern, s.flags, s.replace_with),
+    TranslateSubstitution: lambda s: ('translate', tuple(sorted(s.mapping.items()))),
+}
+
+
+def hash_key(*parts: Any) -> str:
+    """Hashes the parts into a cache key.
+
+    Each part is hashed by its repr, so parts should be strings, bytes, numbers or tuples
+    thereof.
+
+    Args:
+        *parts: The parts making up the key.
+
+    Returns:
+        The key as a hex string.
+    """
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+
+def hash_file(path: Optional[str]) -> Optional[str]:
+    """Hashes the content of the file at path.
+
+    Args:
+        path: The path of the file.
+
+    Returns:
+        The hash as a hex string or None if path is None or there is no file at path.
+    """
+    if not path:
+        return None
+
+    digest = hashlib.sha256()
+
+    try:
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(block)
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        return None
+
+    return digest.hexdigest()
+
+
+def write_text_atomically(path: str, text: str):
+    """Writes the text to the file at path, encoded as utf-8.
+
+    See :func:`write_bytes_atomically`.
+
+    Args:
+        path: The path of the file. Missing parent directories are created.
+        text: The text.
+    """
+    write_bytes_atomically(path, text.encode('utf-8'))
+
+
+def write_bytes_atomically(path: str, data: bytes):
+    """Writes the data to the file at path.
+
+    The data is written to a temporary file next to path first and then moved into place, so
+    concurrent readers never see a partially written file.
+
+    Args:
+        path: The path of the file. Missing parent directories are created.
+        data: The data.
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with open(file_descriptor, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def fingerprint_substitutions(substitutions: Iterable[Substitution]) -> Optional[str]:
+    """Gets a fingerprint of the ordered list of substitution definitions.
+
+    Only substitution types whose definition is fully known can be fingerprinted. If the list
+    contains any other substitution, None is returned and results depending on the
+    substitutions must not be cached.
+
+    The selector of a substitution is part of its definition.
+
+    Args:
+        substitutions: The list of substitutions.
+
+    Returns:
+        The fingerprint or None.
+    """
+    definitions = []
+
+    for substitution in substitutions:
+        fingerprint = _SUBSTITUTION_FINGERPRINTS.get(type(substitution))
+
+        if not fingerprint:
+            return None
+
+        definition = fingerprint(substitution)
+        selector = getattr(substitution, 'selector', None)
+
+        if selector is not None:
+            definition += ('selector', tuple(selector.paths), tuple(selector.tags))
+
+        definitions.append(definition)
+
+    return hash_key(*definitions)
+
+
+class RenderCache:
+    """The RenderCache stores the substituted markdown and the rendered html of chapters on
+    disk, keyed by the hash of everything they depend on.
+
+    Args:
+        directory: The directory the cache entries are stored in. If None, the entries are
+            kept in memory only, and their length counts towards the maximum size.
+
+            Defaults to `.publish-cache/render`.
+        max_size: The maximum size of all cache entries in bytes. The least recently used
+            entries are removed by :meth:`evict` until the cache fits into this size.
+
+            Defaults to 256 MiB.
+        detector: The optional change detector used to tell the content hashes of the chapter
+            files. If present, chapters whose substituted markdown is cached are not read at
+            all.
+
+    Attributes:
+        directory (str): The directory the cache entries are stored in or None.
+        max_size (int): The maximum size of all cache entries in bytes.
+        detector (ChangeDetector): The change detector or None.
+        hits (int): The number of entries found in the cache.
+        misses (int): The number of entries not found in the cache.
+    """
+
+    def __init__(self,
+                 directory: Optional[str] = os.path.join(CACHE_DIRECTORY, 'render'),
+                 max_size: int = DEFAULT_MAX_SIZE,
+                 detector: Optional['ChangeDetector'] = None):
+        """Initializes a new instance of the :class:`RenderCache` class.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.detector = detector
+        self.hits = 0
+        self.misses = 0
+        self.__entries: 'OrderedDict[str, str]' = OrderedDict()
+        self.__size = 0
+        self.__lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        """Gets the cache entry for the key and marks it as recently used.
+
+        Args:
+            key: The key.
+
+        Returns:
+            The cached text or None, if there is no entry for the key.
+        """
+        if self.directory is None:
+            with self.__lock:
+                text = self.__entries.get(key)
+
+                if text is None:
+                    self.misses += 1
+                    return None
+
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return text
+
+        path = self._get_path(key)
+
+        try:
+            with open(path, 'r', encoding='utf-8', newline='') as file:
+                text = file.read()
+            os.utime(path)
+        except (FileNotFoundError, UnicodeDecodeError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return text
+
+    def put(self, key: str, text: str):
+        """Stores the text in the cache.
+
+        The entry is written atomically, so concurrent builds never read a partially written
+        entry.
+
+        Args:
+            key: The key.
+            text: The text.
+        """
+        if self.directory is None:
+            with self.__lock:
+                self.__size += len(text) - len(self.__entries.pop(key, ''))
+                self.__entries[key] = text
+            return
+
+        write_text_atomically(self._get_path(key), text)
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits into its maximum size.
+        """
+        if self.directory is None:
+            evicted = 0
+
+            with self.__lock:
+                while self.__size > self.max_size:
+                    _, text = self.__entries.popitem(last=False)
+                    self.__size -= len(text)
+                    evicted += 1
+        else:
+            evicted = _evict(self.directory, self.max_size)
+
+        if evicted:
+            LOG.info(f'Evicted {evicted} entries from the render cache')
+
+    def _get_path(self, key: str) -> str:
+        """Gets the path of the cache entry for the key.
+
+        Args:
+            key: The key.
+
+        Returns:
+            The path.
+        """
+        return os.path.join(self.directory, key[:2], key)
+
+
+class ArtifactStore:
+    """The ArtifactStore keeps the files made by ebook-convert, keyed by the hash of everything
+    the conversion depends on, so the same conversion never runs twice.
+
+    Files are copied into and out of the store, so an output changed in place never changes
+    the file stored for it.
+
+    Args:
+        directory: The directory the files are stored in.
+
+            Defaults to `.publish-cache/artifacts`.
+        max_size: The maximum size of all stored files in bytes. The least recently used
+            files are removed by :meth:`evict` until the store fits into this size.
+
+            Defaults to 1 GiB.
+
+    Attributes:
+        directory (str): The directory the files are stored in.
+        max_size (int): The maximum size of all stored files in bytes.
+        hits (int): The number of files found in the store.
+        misses (int): The number of files not found in the store.
+    """
+
+    def __init__(self,
+                 directory: str = os.path.join(CACHE_DIRECTORY, 'artifacts'),
+                 max_size: int = DEFAULT_MAX_ARTIFACTS_SIZE):
+        """Initializes a new instance of the :class:`ArtifactStore` class.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, path: str) -> bool:
+        """Puts the file stored for the key at path and marks it as recently used.
+
+        Args:
+            key: The key.
+            path: The path the file is put at. An existing file at path is replaced.
+
+        Returns:
+            True if a file is stored for the key, otherwise False.
+        """
+        entry_path = self._get_path(key)
+
+        try:
+            os.utime(entry_path)
+            _copy_file(entry_path, path)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+
+        self.hits += 1
+        return True
+
+    def put(self, key: str, path: str):
+        """Stores the file at path for the key.
+
+        Args:
+            key: The key.
+            path: The path of the file.
+        """
+        _copy_file(path, self._get_path(key))
+
+    def evict(self):
+        """Removes the least recently used files until the store fits into its maximum size.
+        """
+        evicted = _evict(self.directory, self.max_size)
+
+        if evicted:
+            LOG.info(f'Evicted {evicted} files from the artifact store')
+
+    def _get_path(self, key: str) -> str:
+        """Gets the path of the file stored for the key.
+
+        Args:
+            key: The key.
+
+        Returns:
+            The path.
+        """
+        return os.path.join(self.directory, key[:2], key)
+
+
+def _copy_file(source: str, destination: str):
+    """Copies the file at source to destination.
+
+    The file is copied to a temporary file next to destination first and then moved into
+    place, so an existing file at destination is replaced instead of overwritten.
+
+    Args:
+        source: The path of the file.
+        destination: The path of the copy. Missing parent directories are created.
+    """
+    directory = os.path.dirname(destination) or '.'
+    os.makedirs(directory, exist_ok=True)
+
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory)
+    os.close(file_descriptor)
+    os.remove(temp_path)
+
+    try:
+        shutil.copyfile(source, temp_path)
+        os.replace(temp_path, destination)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _evict(directory: str, max_size: int) -> int:
+    """Removes the least recently used files below directory until all files fit into the
+    maximum size.
+
+    Args:
+        directory: The directory.
+        max_size: The maximum size of all files in bytes.
+
+    Returns:
+        The number of files removed.
+    """
+    entries = []
+
+    for parent, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            path = os.path.join(parent, file_name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+    size = sum(entry[1] for entry in entries)
+
+    if size <= max_size:
+        return 0
+
+    entries.sort()
+    evicted = 0
+
+    for _, entry_size, path in entries:
+        if size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        size -= entry_size
+        evicted += 1
+
+    return evicted
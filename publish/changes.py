@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""This module offers the change detector used to find out which files of a project changed
+without reading every one of them.
+
+The change detector keeps an index of the stat results and content hashes of the files it has
+seen, persisted between builds. A file is only read and hashed again if its modification time,
+size or inode differ from the ones recorded in the index.
+
+The change detector also keeps the listings of the directories chapters are found in. A
+directory is only listed again if its modification time changed, which happens whenever an entry
+is added to, removed from or renamed in it.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from stat import S_ISDIR, S_ISREG
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from publish.cache import CACHE_DIRECTORY, hash_file, write_text_atomically
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(logging.NullHandler())
+
+INDEX_VERSION = 1
+"""The version of the format of the stat index file."""
+
+_RACY_NANOSECONDS = 2 * 1000 * 1000 * 1000
+"""Files modified less than this long before they were hashed may be modified again without
+changing their stat result, so their stat result is never trusted."""
+
+Stat = Tuple[int, int, int]
+
+Listing = Tuple[List[str], List[str]]
+
+
+class ChangeDetector:
+    """The ChangeDetector tells the content hashes of files, hashing only those files whose stat
+    result changed since they were last hashed.
+
+    Paths are scanned in bulk with :meth:`scan`, which lists each directory only once. The
+    results of a scan are kept until the same path is scanned again, so any number of queries
+    for a path during one build cost a single stat call at most.
+
+    The change detector is thread-safe.
+
+    Args:
+        path: The path of the stat index file. If None, the stat index is kept in memory only.
+
+            Defaults to `.publish-cache/stat-index.json`.
+
+    Attributes:
+        path (str): The path of the stat index file or None.
+        hashed (int): The number of files hashed by this change detector.
+        listed (int): The number of directories listed by this change detector.
+    """
+
+    def __init__(self, path: Optional[str] = os.path.join(CACHE_DIRECTORY, 'stat-index.json')):
+        """Initializes a new instance of the :class:`ChangeDetector` class.
+        """
+        self.path = path
+        self.hashed = 0
+        self.listed = 0
+        self.__index: Dict[str, Tuple[Optional[Stat], str]] = {}
+        self.__listings: Dict[str, Tuple[Optional[int], List[str], List[str]]] = {}
+        self._load()
+        self.__scanned: Dict[str, Optional[str]] = {}
+        self.__lock = threading.Lock()
+
+    def scan(self, paths: Iterable[str]) -> List[str]:
+        """Brings the stat results and content hashes of the files at paths up to date.
+
+        Paths sharing a directory are stat-ed with a single :func:`os.scandir` of that
+        directory.
+
+        Args:
+            paths: The paths of the files.
+
+        Returns:
+            The paths, in the form passed in, whose content hash changed since they were last
+            scanned or hashed, including files that were created or removed.
+        """
+        directories: Dict[str, Dict[str, List[str]]] = {}
+
+        for path in paths:
+            if not path:
+                continue
+            absolute_path = os.path.abspath(path)
+            directory, name = os.path.split(absolute_path)
+            directories.setdefault(directory, {}).setdefault(name, []).append(path)
+
+        changed = []
+
+        for directory, names in directories.items():
+            stats = _scan_directory(directory, names)
+
+            for name, original_paths in names.items():
+                if self._update(os.path.join(directory, name), stats.get(name)):
+                    changed.extend(original_paths)
+
+        return changed
+
+    def get_hash(self, path: str) -> Optional[str]:
+        """Gets the content hash of the file at path, scanning it first unless it has been
+        scanned before.
+
+        Args:
+            path: The path of the file.
+
+        Returns:
+            The content hash as a hex string or None if there is no file at path.
+        """
+        absolute_path = os.path.abspath(path)
+
+        with self.__lock:
+            if absolute_path in self.__scanned:
+                return self.__scanned[absolute_path]
+
+        self.scan([path])
+
+        with self.__lock:
+            return self.__scanned.get(absolute_path)
+
+    def list_directory(self, directory: str) -> Listing:
+        """Gets the names of the files and of the subdirectories in directory, listing it only
+        if its modification time changed since it was last listed.
+
+        Args:
+            directory: The path of the directory.
+
+        Returns:
+            A tuple of the names of the files and the names of the subdirectories. Both are
+            empty if there is no directory at path.
+        """
+        absolute_path = os.path.abspath(directory)
+
+        try:
+            stat = os.stat(absolute_path)
+        except OSError:
+            return [], []
+
+        if not S_ISDIR(stat.st_mode):
+            return [], []
+
+        with self.__lock:
+            known_mtime, files, directories = self.__listings.get(absolute_path,
+                                                                  (None, [], []))
+
+        if known_mtime is not None and known_mtime == stat.st_mtime_ns:
+            return list(files), list(directories)
+
+        files, directories = list_directory(absolute_path)
+        mtime: Optional[int] = stat.st_mtime_ns
+
+        # Just like files, directories changed just before they were listed may change again
+        # without changing their modification time.
+        if _get_time_ns() - stat.st_mtime_ns < _RACY_NANOSECONDS:
+            mtime = None
+
+        with self.__lock:
+            self.listed += 1
+            self.__listings[absolute_path] = (mtime, files, directories)
+
+        return list(files), list(directories)
+
+    def save(self):
+        """Writes the stat index to its file atomically, unless it is kept in memory only.
+        """
+        if self.path is None:
+            return
+
+        with self.__lock:
+            files = {path: [list(stat) if stat else None, digest]
+                     for path, (stat, digest) in self.__index.items()}
+            directories = {path: [mtime, names, subdirectories]
+                           for path, (mtime, names, subdirectories) in self.__listings.items()
+                           if mtime is not None}
+
+        write_text_atomically(self.path, json.dumps({'version': INDEX_VERSION,
+                                                     'files': files,
+                                                     'directories': directories}))
+
+    def _update(self, path: str, stat: Optional[Stat]) -> bool:
+        """Updates the content hash of the file at path if its stat result changed.
+
+        Args:
+            path: The absolute path of the file.
+            stat: The current stat result of the file or None if there is no file at path.
+
+        Returns:
+            True if the content hash changed, otherwise False.
+        """
+        with self.__lock:
+            known_stat, known_digest = self.__index.get(path, (None, None))
+            previous_digest = self.__scanned.get(path, known_digest)
+
+        if stat is None:
+            digest = None
+        elif known_stat is not None and known_stat == stat:
+            digest = known_digest
+        else:
+            digest = hash_file(path)
+
+            with self.__lock:
+                self.hashed += 1
+
+            # Files modified just before they were hashed may change again within the
+            # resolution of their modification time, so their stat result isn't recorded.
+            if _get_time_ns() - stat[0] < _RACY_NANOSECONDS:
+                stat = None
+
+        with self.__lock:
+            self.__scanned[path] = digest
+
+            if digest is None:
+                self.__index.pop(path, None)
+            else:
+                self.__index[path] = (stat, digest)
+
+        return digest != previous_digest
+
+    def _load(self):
+        """Reads the stat index and the directory listings from the stat index file.
+
+        Both are left empty if the file doesn't exist, is invalid or was written by another
+        version of the change detector.
+        """
+        if self.path is None:
+            return
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                content = json.load(file)
+            if content['version'] != INDEX_VERSION:
+                return
+            index = {path: (tuple(stat) if stat else None, digest)
+                     for path, (stat, digest) in content['files'].items()}
+            listings = {path: (mtime, list(names), list(subdirectories))
+                        for path, (mtime, names, subdirectories)
+                        in content.get('directories', {}).items()}
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            return
+
+        self.__index = index
+        self.__listings = listings
+
+
+def list_directory(directory: str) -> Listing:
+    """Gets the names of the files and of the subdirectories in directory.
+
+    Args:
+        directory: The path of the directory.
+
+    Returns:
+        A tuple of the names of the files and the names of the subdirectories, in the order the
+        file system lists them. Both are empty if there is no directory at path.
+    """
+    files = []
+    directories = []
+
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        files.append(entry.name)
+                    elif entry.is_dir():
+                        directories.append(entry.name)
+                except OSError:
+                    continue
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+
+    return files, directories
+
+
+def _scan_directory(directory: str, names: Iterable[str]) -> Dict[str, Stat]:
+    """Gets the stat results of the files with the names in directory.
+
+    Args:
+        directory: The directory.
+        names: The names of the files.
+
+    Returns:
+        The modification time in nanoseconds, size and inode of each file by name. Names that
+        don't refer to a file are left out.
+    """
+    names = set(names)
+    stats = {}
+
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name not in names:
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                stats[entry.name] = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    except (FileNotFoundError, NotADirectoryError):
+        return stats
+
+    # Names not listed by their exact spelling may still refer to a file on case-insensitive
+    # file systems.
+    for name in names - stats.keys():
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except OSError:
+            continue
+        if S_ISREG(stat.st_mode):
+            stats[name] = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    return stats
+
+
+def _get_time_ns() -> int:
+    """Gets the current time in nanoseconds since the epoch.
+
+    Returns:
+        The current time.
+    """
+    return int(time.time() * 1000 * 1000 * 1000)
@@ -8,31 +8,154 @@
 # (license terms are at http://opensource.org/licenses/MIT).
 
 """CLI entry point for the publish command and the yaml project format.
+
+The modules each command needs are imported only when it runs, so that `publish --help` and
+builds with nothing to do start quickly.
 """
 
+# pylint: disable=import-outside-toplevel
+
+import argparse
 import logging
+import os
+import sys
+from typing import Optional, Sequence
 
-from publish.yaml import load_project
+from publish.cache import CACHE_DIRECTORY
 
 LOG = logging.getLogger(__name__)
 LOG.addHandler(logging.NullHandler())
 
+PROJECT_FILE = '.publish.yml'
+"""The path of the project file, relative to the current working directory."""
+
+
+def parse_args(args: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    """Parses the command line arguments of the publish command.
+
+    Args:
+        args: The command line arguments. Defaults to sys.argv[1:].
+
+    Returns:
+        The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='publish',
+        description='Turns the markdown files described by the .publish.yml in the current '
+                    'working directory into the outputs defined therein.')
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=None,
+                        help='make up to JOBS outputs at once and render the chapters of '
+                             'each output separately across its share of JOBS processes')
+    parser.add_argument('--no-cache',
+                        dest='cache',
+                        action='store_false',
+                        help=f'neither use nor update the caches in {CACHE_DIRECTORY}')
+    parser.add_argument('--watch',
+                        action='store_true',
+                        help='keep running and make the outputs again whenever the files '
+                             'they depend on change')
+    parser.add_argument('--profile-substitutions',
+                        action='store_true',
+                        help='instead of making the outputs, report the time, matches and '
+                             'bytes changed of each substitution, in total and per chapter, '
+                             'and flag regular expressions prone to catastrophic backtracking')
+    parser.add_argument('--explain-substitutions',
+                        action='store_true',
+                        help='instead of making the outputs, show the passes the substitutions '
+                             'are compiled into and the passes saved by fusing them')
 
-def main():
+    return parser.parse_args(args)
+
+
+def main(args: Optional[Sequence[str]] = None):
     """Main CLI entry point for anited. publish.
 
     Looks for a file .publish.yml in the current working directory, calls load_yaml on
-    its content and then runs each output defined in the project file.
+    its content and then runs each output defined in the project file, rendering the
+    html document shared by the outputs only once. Outputs whose inputs haven't changed
+    since the last run are skipped unless the caches are disabled.
+
+    With `--watch`, the outputs are made again whenever the files they depend on change,
+    until interrupted. With `--profile-substitutions` or `--explain-substitutions`, no outputs
+    are made, the substitutions are profiled or their plan is explained instead.
+
+    Args:
+        args: The command line arguments. Defaults to sys.argv[1:].
     """
+    arguments = parse_args(args)
+
     logging.basicConfig(format='%(message)s', level=logging.INFO)
 
-    with open('.publish.yml', 'rt', encoding='utf8') as publish_yaml:
+    from publish.template import REGISTRY
+
+    if arguments.cache:
+        REGISTRY.enable_bytecode_cache(os.path.join(CACHE_DIRECTORY, 'templates'))
+
+    if arguments.watch:
+        from publish.watch import watch
+
+        watch(PROJECT_FILE, jobs=arguments.jobs or 1, cache=arguments.cache)
+        return
+
+    from publish.table import TABLE_CACHE_DIRECTORY
+    from publish.yaml import PROJECT_CACHE_PATH, load_project
+
+    with open(PROJECT_FILE, 'rt', encoding='utf8') as publish_yaml:
         yaml = publish_yaml.read()
 
-    book, substitutions, outputs = load_project(str(yaml))
+    table_cache = TABLE_CACHE_DIRECTORY if arguments.cache else None
+    project_cache = PROJECT_CACHE_PATH if arguments.cache else None
+
+    if arguments.profile_substitutions:
+        from publish.profiling import format_profile, profile_substitutions
+
+        book, substitutions, outputs = load_project(str(yaml), table_cache=table_cache,
+                                                    project_cache=project_cache)
+        for line in format_profile(profile_substitutions(book, substitutions,
+                                                         outputs=outputs)):
+            LOG.info(line)
+        return
+
+    if arguments.explain_substitutions:
+        from publish.profiling import explain_plan
+
+        _, substitutions, _ = load_project(str(yaml), table_cache=table_cache,
+                                           project_cache=project_cache)
+        for line in explain_plan(substitutions):
+            LOG.info(line)
+        return
+
+    from publish.build import BuildContext, BuildManifest, build, divide_jobs
+    from publish.cache import ArtifactStore, RenderCache
+    from publish.changes import ChangeDetector
+    from publish.ebookconvert import EbookConvertError, EbookConvertNotFoundError
+
+    detector = ChangeDetector() if arguments.cache else None
+    book, substitutions, outputs = load_project(str(yaml), detector, table_cache, project_cache)
+
+    if arguments.jobs:
+        divide_jobs(outputs, arguments.jobs)
+
+    cache = None
+    artifacts = None
+    manifest = None
+
+    if arguments.cache:
+        cache = RenderCache(detector=detector)
+        artifacts = ArtifactStore()
+        manifest = BuildManifest(project=yaml, detector=detector)
 
-    for output in outputs:
-        output.make(book, substitutions)
+    try:
+        build(book, substitutions, outputs, BuildContext(cache, artifacts),
+              jobs=arguments.jobs or 1, manifest=manifest)
+    except (EbookConvertError, EbookConvertNotFoundError) as error:
+        LOG.error(str(error))
+        sys.exit(1)
+    finally:
+        if detector:
+            detector.save()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""This module drives calibre's ebook-convert command line tool.
+
+ebook-convert runs as a child process in its own process group. Its output is captured and,
+optionally, logged line by line while it runs. A conversion that exceeds its timeout is killed
+together with any processes it started, and a conversion that fails raises an error instead of
+passing silently. The cpu time and peak memory usage of the conversion are recorded where the
+platform supports it.
+
+asyncio is only imported once ebook-convert is run, as importing it takes longer than anything
+else a build skipping all of its outputs does.
+"""
+
+import logging
+import os
+import signal
+import subprocess  # nosec
+import sys
+import time
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(logging.NullHandler())
+
+
+class ConversionResult:
+    """The ConversionResult holds the outcome of a finished ebook-convert call.
+
+    Attributes:
+        args (List[str]): The command line of the call.
+        returncode (int): The exit code of ebook-convert. Negative if it was killed by a
+            signal.
+        stdout (str): The captured standard output.
+        stderr (str): The captured standard error.
+        seconds (float): The wall time of the call in seconds.
+        cpu_seconds (float): The user and system cpu time of ebook-convert in seconds or None
+            if the platform doesn't report it.
+        max_rss (int): The peak resident set size of ebook-convert in bytes or None if the
+            platform doesn't report it.
+    """
+
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes,too-many-arguments
+
+    def __init__(self,
+                 args: Sequence[str],
+                 returncode: int,
+                 stdout: str,
+                 stderr: str,
+                 seconds: float,
+                 cpu_seconds: Optional[float] = None,
+                 max_rss: Optional[int] = None):
+        """Initializes a new instance of the :class:`ConversionResult` class.
+        """
+        self.args = list(args)
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.seconds = seconds
+        self.cpu_seconds = cpu_seconds
+        self.max_rss = max_rss
+
+
+class EbookConvertError(Exception):
+    """ebook-convert failed.
+
+    Args:
+        message: The error message.
+        result: The result of the failed call.
+
+    Attributes:
+        result (ConversionResult): The result of the failed call.
+    """
+
+    def __init__(self, message: str, result: ConversionResult):
+        super().__init__(message)
+        self.result = result
+
+
+class EbookConvertTimeoutError(EbookConvertError):
+    """ebook-convert did not finish in time and was killed."""
+
+
+class EbookConvertNotFoundError(FileNotFoundError):
+    """ebook-convert could not be found."""
+
+
+@lru_cache(maxsize=None)
+def get_version(executable: str = 'ebook-convert') -> Optional[str]:
+    """Gets the version string ebook-convert prints for `--version`.
+
+    The version is only asked for once per executable and process.
+
+    Args:
+        executable: The ebook-convert executable.
+
+    Returns:
+        The version string or None if ebook-convert could not be run.
+    """
+    try:
+        completed = subprocess.run([executable, '--version'],  # nosec
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL,
+                                   universal_newlines=True,
+                                   timeout=60,
+                                   check=False)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+    if completed.returncode != 0:
+        return None
+
+    return completed.stdout.strip() or None
+
+
+def convert(args: Sequence[str],
+            timeout: Optional[float] = None,
+            stream_output: bool = False) -> ConversionResult:
+    """Runs ebook-convert with the command line args and waits for it to finish.
+
+    This is the blocking counterpart of :func:`run_ebook_convert`, running it in an event loop
+    of its own.
+
+    Args:
+        args: The command line, starting with the ebook-convert executable.
+        timeout: The number of seconds after which ebook-convert is killed. Defaults to no
+            timeout.
+        stream_output: Determines whether each line ebook-convert writes is logged as soon
+            as it is written. The output is captured either way.
+
+    Returns:
+        The result of the call.
+
+    Raises:
+        FileNotFoundError: If ebook-convert could not be found.
+        EbookConvertTimeoutError: If ebook-convert did not finish within the timeout.
+        EbookConvertError: If ebook-convert exited with a non-zero exit code.
+    """
+    import asyncio  # pylint: disable=import-outside-toplevel
+
+    loop = asyncio.new_event_loop()
+
+    try:
+        return loop.run_until_complete(run_ebook_convert(args, timeout, stream_output))
+    finally:
+        loop.close()
+
+
+async def run_ebook_convert(args: Sequence[str],
+                            timeout: Optional[float] = None,
+                            stream_output: bool = False) -> ConversionResult:
+    """Runs ebook-convert with the command line args.
+
+    Args:
+        args: The command line, starting with the ebook-convert executable.
+        timeout: The number of seconds after which ebook-convert is killed. Defaults to no
+            timeout.
+        stream_output: Determines whether each line ebook-convert writes is logged as soon
+            as it is written. The output is captured either way.
+
+    Returns:
+        The result of the call.
+
+    Raises:
+        FileNotFoundError: If ebook-convert could not be found.
+        EbookConvertTimeoutError: If ebook-convert did not finish within the timeout.
+        EbookConvertError: If ebook-convert exited with a non-zero exit code.
+    """
+    import asyncio  # pylint: disable=import-outside-toplevel
+
+    loop = asyncio.get_event_loop()
+    start = time.perf_counter()
+
+    # The process is started with Popen instead of asyncio.create_subprocess_exec, because
+    # asyncio reaps its child processes itself, which would leave no way to collect their
+    # resource usage.
+    process = subprocess.Popen(args,  # nosec
+                               stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               start_new_session=os.name == 'posix')
+    stdout: List[str] = []
+    stderr: List[str] = []
+    tasks = [
+        asyncio.ensure_future(_read_lines(process.stdout, stdout, stream_output)),
+        asyncio.ensure_future(_read_lines(process.stderr, stderr, stream_output)),
+        loop.run_in_executor(None, _wait, process),
+    ]
+
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    timed_out = bool(pending)
+
+    if timed_out:
+        _kill(process)
+
+    await asyncio.gather(*tasks)
+    returncode, cpu_seconds, max_rss = tasks[2].result()
+
+    result = ConversionResult(args=args,
+                              returncode=returncode,
+                              stdout=''.join(stdout),
+                              stderr=''.join(stderr),
+                              seconds=time.perf_counter() - start,
+                              cpu_seconds=cpu_seconds,
+                              max_rss=max_rss)
+
+    if timed_out:
+        raise EbookConvertTimeoutError(
+            f'ebook-convert did not finish within {timeout} seconds and was killed.', result)
+
+    if returncode:
+        raise EbookConvertError(
+            f'ebook-convert exited with exit code {returncode}:\n{result.stderr.strip()}',
+            result)
+
+    return result
+
+
+async def _read_lines(pipe, lines: List[str], stream_output: bool):
+    """Reads the pipe line by line until it is closed, collecting the lines.
+
+    Args:
+        pipe: The pipe.
+        lines: The list the decoded lines are appended to.
+        stream_output: Determines whether each line is logged as soon as it is read.
+    """
+    import asyncio  # pylint: disable=import-outside-toplevel
+
+    loop = asyncio.get_event_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),
+                                                pipe)
+
+    try:
+        while True:
+            line = await reader.readline()
+
+            if not line:
+                break
+
+            line = line.decode('utf-8', errors='replace')
+            lines.append(line)
+
+            if stream_output:
+                LOG.info(line.rstrip())
+    finally:
+        transport.close()
+
+
+def _wait(process: subprocess.Popen) -> Tuple[int, Optional[float], Optional[int]]:
+    """Waits for the process to exit, collecting its resource usage if the platform supports
+    it.
+
+    Args:
+        process: The process.
+
+    Returns:
+        A tuple of the exit code, the cpu time in seconds and the peak resident set size in
+        bytes. The latter two are None if the platform doesn't support collecting them.
+    """
+    if not hasattr(os, 'wait4'):
+        return process.wait(), None, None
+
+    _, status, rusage = os.wait4(process.pid, 0)
+
+    if os.WIFSIGNALED(status):
+        returncode = -os.WTERMSIG(status)
+    else:
+        returncode = os.WEXITSTATUS(status)
+
+    # The process has been reaped, Popen must not try to wait for it again.
+    process.returncode = returncode
+
+    # ru_maxrss is reported in kilobytes on linux but in bytes on macOS.
+    max_rss = rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+    return returncode, rusage.ru_utime + rusage.ru_stime, max_rss
+
+
+def _kill(process: subprocess.Popen):
+    """Kills the process and, on posix systems, every process in its process group.
+
+    Args:
+        process: The process.
+    """
+    try:
+        if os.name == 'posix':
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
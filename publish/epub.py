@@ -0,0 +1,721 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""This module writes books to EPUB3 files without calling ebook-convert.
+
+Each chapter becomes its own XHTML document. The package document, the EPUB3 navigation
+document and an NCX table of contents for older reading systems are generated from the
+:class:`publish.book.Book` metadata, and everything is zipped up using :mod:`zipfile`.
+
+The same files can be staged in a directory instead, for ebook-convert to read the book chapter
+by chapter.
+"""
+
+import itertools
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import time
+import uuid
+from abc import ABCMeta, abstractmethod
+from html import escape
+from html.parser import HTMLParser
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from publish.book import Book, Chapter
+from publish.build import BuildContext
+from publish.output import HtmlOutput
+from publish.substitution import Substitution
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(logging.NullHandler())
+
+EPUB_MIMETYPE = 'application/epub+zip'
+"""The content of the mimetype file of every EPUB."""
+
+PACKAGE_PATH = 'OEBPS/content.opf'
+"""The path of the package document inside the EPUB."""
+
+CORE_IMAGE_TYPES = ('image/gif', 'image/jpeg', 'image/png', 'image/svg+xml', 'image/webp')
+"""The image media types every EPUB3 reading system supports."""
+
+_CONTAINER = f'''<?xml version="1.0" encoding="utf-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="{PACKAGE_PATH}" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+'''
+
+_XHTML = '''<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" \
+lang={language} xml:lang={language}>
+<head>
+<meta charset="utf-8"/>
+<title>{title}</title>
+<link rel="stylesheet" type="text/css" href="style.css"/>
+</head>
+<body>
+{body}
+</body>
+</html>
+'''
+
+_VOID_ELEMENTS = frozenset(('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+                            'meta', 'param', 'source', 'track', 'wbr'))
+_HEADINGS = frozenset(('h1', 'h2', 'h3', 'h4', 'h5', 'h6'))
+_INVALID_CHARACTERS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+_ATTRIBUTE_NAME = re.compile(r'^[A-Za-z_][-A-Za-z0-9_.]*(:[A-Za-z_][-A-Za-z0-9_.]*)?$')
+_URL_SCHEME = re.compile(r'^[A-Za-z][A-Za-z0-9+.-]*:')
+_WHITESPACE = re.compile(r'\s+')
+
+
+class EpubOutput(HtmlOutput):
+    """Turns a Book object and its chapters into an EPUB3 file.
+
+    Unlike :class:`publish.output.EbookConvertOutput`, no installation of calibre is needed.
+    The chapters are rendered to html as for an html output, but each chapter is written to
+    its own XHTML document named after its first heading. The stylesheet, the cover and any
+    local image the chapters refer to are packed into the EPUB as well.
+
+    Args:
+        path: The output path.
+        **kwargs: Any other attribute of this class. (see Attributes below)
+
+
+    Attributes:
+        path (str): The output path.
+        stylesheet (str): The path to the style sheet.
+        force_publish (bool): Determines wether to force publish all chapters.
+
+            If set to true, all chapters of the book will be published
+            no matter how the chapters are configured.
+
+            Defaults to False.
+        jobs (int): The number of processes used to render the chapters.
+
+            Defaults to 1.
+        processes (int): The number of processes used to render the chapters, overriding
+            `jobs`.
+
+            Defaults to None, which uses `jobs` processes.
+        streaming (bool): Determines whether to render and write the chapters one at a time.
+
+            Defaults to False.
+        memory_map (bool): Determines whether chapter files are memory-mapped.
+
+            Defaults to False.
+        images (List[str]): The local images packed into the EPUB the last time it was made,
+            as referred to by the chapters, or None if it wasn't made yet.
+    """
+
+    def __init__(self, path: str, **kwargs):
+        """Initializes a new instance of the :class:`EpubOutput` class.
+        """
+        super().__init__(path, **kwargs)
+        self.images: Optional[List[str]] = None
+
+    @property
+    def renders_by_chapter(self) -> bool:
+        """Always True, the chapters of an EPUB are rendered separately."""
+        return True
+
+    def make(self,
+             book: Book,
+             substitutions: Optional[Iterable[Substitution]] = None,
+             context: Optional[BuildContext] = None):
+        """Makes an EPUB3 file from the provided book object and the markdown chapters
+        specified therein.
+
+        Args:
+            book: The book.
+            substitutions: The list of substitutions.
+            context: The optional build context shared by all outputs of the same build. Only
+                its render cache is used, the html document isn't shared with other outputs.
+        """
+        LOG.info('Making EpubOutput ...')
+        if not book:
+            raise AttributeError("book must not be None")
+
+        substitutions = list(substitutions) if substitutions else []
+        cache = context.cache if context else None
+        chapters = self._get_chapters_to_publish(book.chapters)
+
+        if self.streaming:
+            html_chapters = itertools.islice(
+                self._iter_html_content(chapters, substitutions, cache), 0, None, 2)
+        else:
+            html_chapters = iter(self._get_html_chapters(chapters, substitutions, cache))
+
+        partial_path = f'{self.path}.part'
+
+        try:
+            images = write_epub(partial_path, book, chapters, html_chapters, self._get_css())
+            os.replace(partial_path, self.path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+        self.images = images
+        LOG.info('... EpubOutput finished')
+
+
+def write_epub(path: str,
+               book: Book,
+               chapters: Sequence[Chapter],
+               html_chapters: Iterable[str],
+               css: str = '') -> List[str]:
+    """Writes an EPUB3 file.
+
+    Local images are looked up relative to the current working directory, like the stylesheet.
+
+    Args:
+        path: The path of the EPUB file.
+        book: The book providing the metadata and the cover.
+        chapters: The chapters to be published.
+        html_chapters: The html of each chapter, in the same order as chapters. Each chapter is
+            written as soon as it is taken from the iterable.
+        css: The stylesheet.
+
+    Returns:
+        The local images packed into the EPUB file, including the cover.
+    """
+    import zipfile  # pylint: disable=import-outside-toplevel
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as epub:
+        epub.writestr('mimetype', EPUB_MIMETYPE, compress_type=zipfile.ZIP_STORED)
+        epub.writestr('META-INF/container.xml', _CONTAINER)
+        return _write_publication(_ZipWriter(epub, posixpath.dirname(PACKAGE_PATH)),
+                                  book, chapters, html_chapters, css)
+
+
+def stage_book(directory: str,
+               book: Book,
+               chapters: Sequence[Chapter],
+               html_chapters: Iterable[str],
+               css: str = '') -> str:
+    """Writes the files of an EPUB3 publication to a directory instead of an EPUB file, one
+    XHTML document per chapter.
+
+    The package document written can be passed to ebook-convert, which then reads the book
+    chapter by chapter instead of parsing one large html document. Unlike :func:`write_epub`,
+    no cover page is added, as ebook-convert creates its own, and the modification date of the
+    publication is the one of the newest chapter file, so staging the same book twice writes
+    the same files.
+
+    Args:
+        directory: The directory. It must exist.
+        book: The book providing the metadata and the cover.
+        chapters: The chapters to be published.
+        html_chapters: The html of each chapter, in the same order as chapters. Each chapter is
+            written as soon as it is taken from the iterable.
+        css: The stylesheet.
+
+    Returns:
+        The path of the package document.
+    """
+    modified = max((os.stat(chapter.src).st_mtime for chapter in chapters), default=None)
+
+    _write_publication(_DirectoryWriter(directory), book, chapters, html_chapters, css,
+                       cover_page=False, modified=modified)
+
+    return os.path.join(directory, posixpath.basename(PACKAGE_PATH))
+
+
+def _write_publication(writer: '_Writer',  # pylint: disable=too-many-arguments,too-many-locals
+                       book: Book,
+                       chapters: Sequence[Chapter],
+                       html_chapters: Iterable[str],
+                       css: str,
+                       cover_page: bool = True,
+                       modified: Optional[float] = None) -> List[str]:
+    """Writes the package document, the navigation documents, the stylesheet, the images and
+    the XHTML documents of the chapters.
+
+    See :func:`write_epub`.
+
+    Args:
+        writer: The writer the files are written with.
+        book: The book providing the metadata and the cover.
+        chapters: The chapters to be published.
+        html_chapters: The html of each chapter, in the same order as chapters.
+        css: The stylesheet.
+        cover_page: Determines whether a page showing the cover is added before the chapters.
+        modified: The time the publication was last modified, in seconds since the epoch.
+            Defaults to now.
+
+    Returns:
+        The local images written, as referred to by the book and the chapters.
+    """
+    identifier = get_identifier(book)
+    language = book.language or 'und'
+    items: List[Tuple[str, str, str, Optional[str]]] = \
+        [('nav', 'nav.xhtml', 'application/xhtml+xml', 'nav'),
+         ('ncx', 'toc.ncx', 'application/x-dtbncx+xml', None),
+         ('style', 'style.css', 'text/css', None)]
+    spine: List[str] = []
+    toc: List[Tuple[str, str]] = []
+    images: Dict[str, str] = {}
+
+    def add_image(src: str, name: str, properties: Optional[str] = None) -> Optional[str]:
+        if src in images:
+            return images[src]
+
+        media_type = mimetypes.guess_type(src)[0]
+        file_path = os.path.join(os.getcwd(), src)
+
+        if media_type not in CORE_IMAGE_TYPES or not os.path.isfile(file_path):
+            LOG.warning(f'Could not add image {src} to the EPUB')
+            return None
+
+        images[src] = f'{name}{os.path.splitext(src)[1].lower()}'
+        items.append((f'image-{len(images)}', images[src], media_type, properties))
+        writer.copy_file(file_path, images[src])
+        return images[src]
+
+    if book.cover and add_image(book.cover, 'cover', 'cover-image') and cover_page:
+        writer.write_text('cover.xhtml', _XHTML.format(
+            language=_quoteattr(language),
+            title=_escape(book.title),
+            body=f'<div class="cover"><img src={_quoteattr(images[book.cover])} '
+                 f'alt={_quoteattr(book.title)}/></div>'))
+        items.append(('cover-page', 'cover.xhtml', 'application/xhtml+xml', None))
+        spine.append('cover-page')
+
+    def rewrite_src(src: str) -> str:
+        if _URL_SCHEME.match(src) or src.startswith(('/', '#')):
+            return src
+
+        return add_image(src, f'images/image-{len(images) + 1:04}') or src
+
+    for index, (chapter, html) in enumerate(zip(chapters, html_chapters), 1):
+        body, heading = to_xhtml(html, rewrite_src)
+        title = heading or os.path.splitext(os.path.basename(chapter.src))[0]
+        name = f'chapter-{index:04}.xhtml'
+
+        writer.write_text(name, _XHTML.format(language=_quoteattr(language),
+                                              title=_escape(title),
+                                              body=body))
+        items.append((f'chapter-{index:04}', name, 'application/xhtml+xml', None))
+        spine.append(f'chapter-{index:04}')
+        toc.append((title, name))
+
+    writer.write_text('style.css', css)
+    writer.write_text('nav.xhtml', _get_nav(book.title, language, toc))
+    writer.write_text('toc.ncx', _get_ncx(book.title, identifier, toc))
+    writer.write_text(posixpath.basename(PACKAGE_PATH),
+                      _get_package(book, identifier, items, spine, modified))
+
+    return list(images)
+
+
+class _Writer(metaclass=ABCMeta):
+    """Writes the files of a publication.
+    """
+
+    @abstractmethod
+    def write_text(self, name: str, text: str):
+        """Writes the text to the file name, encoded as utf-8.
+
+        Args:
+            name: The name of the file, relative to the package document.
+            text: The text.
+        """
+
+    @abstractmethod
+    def copy_file(self, path: str, name: str):
+        """Copies the file at path to the file name.
+
+        Args:
+            path: The path of the file.
+            name: The name of the copy, relative to the package document.
+        """
+
+
+class _ZipWriter(_Writer):
+    """Writes the files of a publication to a directory inside a zip file.
+
+    Args:
+        zip_file: The zip file.
+        directory: The directory inside the zip file.
+    """
+
+    def __init__(self, zip_file, directory: str):
+        """Initializes a new instance of the :class:`_ZipWriter` class.
+        """
+        self.__zip_file = zip_file
+        self.__directory = directory
+
+    def write_text(self, name: str, text: str):
+        self.__zip_file.writestr(posixpath.join(self.__directory, name), text)
+
+    def copy_file(self, path: str, name: str):
+        self.__zip_file.write(path, posixpath.join(self.__directory, name))
+
+
+class _DirectoryWriter(_Writer):
+    """Writes the files of a publication to a directory.
+
+    Args:
+        directory: The directory.
+    """
+
+    def __init__(self, directory: str):
+        """Initializes a new instance of the :class:`_DirectoryWriter` class.
+        """
+        self.__directory = directory
+
+    def write_text(self, name: str, text: str):
+        with open(self._get_path(name), 'w', encoding='utf-8') as file:
+            file.write(text)
+
+    def copy_file(self, path: str, name: str):
+        shutil.copyfile(path, self._get_path(name))
+
+    def _get_path(self, name: str) -> str:
+        """Gets the path of the file name, creating its parent directories.
+
+        Args:
+            name: The name of the file, relative to the directory.
+
+        Returns:
+            The path.
+        """
+        path = os.path.join(self.__directory, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+
+def get_identifier(book: Book) -> str:
+    """Gets the unique identifier of the book.
+
+    Args:
+        book: The book.
+
+    Returns:
+        The ISBN of the book as an URN or, if the book has no ISBN, an UUID derived from the
+        title and the authors, so the identifier stays the same from build to build.
+    """
+    if book.isbn:
+        return f'urn:isbn:{book.isbn}'
+
+    return uuid.uuid5(uuid.NAMESPACE_URL, f'{book.title}\n{book.authors or ""}').urn
+
+
+def to_xhtml(html: str,
+             rewrite_src: Optional[Callable[[str], str]] = None) -> Tuple[str, Optional[str]]:
+    """Turns the html of a chapter into well-formed XHTML.
+
+    Void elements are closed, unclosed elements are closed where their parent ends, stray end
+    tags and characters not allowed in XML are dropped.
+
+    Args:
+        html: The html.
+        rewrite_src: Optionally gets the new value of the src attribute of an img element.
+
+    Returns:
+        The XHTML and the text of the first heading, if any.
+    """
+    converter = _XhtmlConverter(rewrite_src)
+    converter.feed(html)
+    converter.close()
+
+    return ''.join(converter.parts), converter.heading
+
+
+class _XhtmlConverter(HTMLParser):  # pylint: disable=abstract-method
+    """Converts html to XHTML while it is parsed.
+
+    See :func:`to_xhtml`.
+
+    Attributes:
+        parts (List[str]): The XHTML converted so far.
+        heading (str): The text of the first heading or None.
+    """
+
+    def __init__(self, rewrite_src: Optional[Callable[[str], str]] = None):
+        """Initializes a new instance of the :class:`_XhtmlConverter` class.
+        """
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.heading: Optional[str] = None
+        self.__rewrite_src = rewrite_src
+        self.__open: List[str] = []
+        self.__heading_parts: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        attributes = {}
+
+        for name, value in attrs:
+            if _ATTRIBUTE_NAME.match(name) and name not in attributes:
+                attributes[name] = value if value is not None else name
+
+        if tag == 'img' and 'src' in attributes and self.__rewrite_src:
+            attributes['src'] = self.__rewrite_src(attributes['src'])
+
+        attributes_string = ''.join(f' {name}={_quoteattr(_clean(value))}'
+                                    for name, value in attributes.items())
+
+        if tag in _VOID_ELEMENTS:
+            self.parts.append(f'<{tag}{attributes_string}/>')
+            return
+
+        self.parts.append(f'<{tag}{attributes_string}>')
+        self.__open.append(tag)
+
+        if tag in _HEADINGS and self.heading is None and self.__heading_parts is None:
+            self.__heading_parts = []
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+        if tag not in _VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag not in self.__open:
+            return
+
+        while self.__open:
+            open_tag = self.__open.pop()
+            self.parts.append(f'</{open_tag}>')
+
+            if open_tag in _HEADINGS and self.__heading_parts is not None:
+                self.heading = _WHITESPACE.sub(' ', ''.join(self.__heading_parts)).strip() \
+                    or None
+                self.__heading_parts = None
+
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        self.parts.append(_escape(_clean(data)))
+
+        if self.__heading_parts is not None:
+            self.__heading_parts.append(data)
+
+    def handle_comment(self, data):
+        self.parts.append(f'<!--{_clean(data).replace("--", "- -").rstrip("-")}-->')
+
+    def close(self):
+        super().close()
+
+        while self.__open:
+            self.handle_endtag(self.__open[-1])
+
+
+def _escape(text: str) -> str:
+    """Escapes the characters of a string that aren't allowed in XML text.
+
+    Args:
+        text: The string.
+
+    Returns:
+        The escaped string.
+    """
+    return escape(text, quote=False)
+
+
+def _quoteattr(value: str) -> str:
+    """Escapes a string and puts it in double quotes for use as an XML attribute value.
+
+    Args:
+        value: The string.
+
+    Returns:
+        The quoted attribute value.
+    """
+    return '"' + escape(value, quote=True) + '"'
+
+
+def _clean(text: str) -> str:
+    """Removes the characters not allowed in XML from a string.
+
+    Args:
+        text: The string.
+
+    Returns:
+        The string without characters not allowed in XML.
+    """
+    return _INVALID_CHARACTERS.sub('', text)
+
+
+def _get_nav(title: str,
+             language: str,
+             toc: Sequence[Tuple[str, str]]) -> str:
+    """Gets the EPUB3 navigation document.
+
+    Args:
+        title: The title of the book.
+        language: The language of the book.
+        toc: The title and the file name of each chapter.
+
+    Returns:
+        The navigation document.
+    """
+    entries = '\n'.join(f'<li><a href={_quoteattr(name)}>{_escape(chapter_title)}</a></li>'
+                        for chapter_title, name in toc)
+
+    return _XHTML.format(language=_quoteattr(language),
+                         title=_escape(title),
+                         body=f'<nav epub:type="toc" id="toc">\n<h1>{_escape(title)}</h1>\n'
+                              f'<ol>\n{entries}\n</ol>\n</nav>')
+
+
+def _get_ncx(title: str,
+             identifier: str,
+             toc: Sequence[Tuple[str, str]]) -> str:
+    """Gets the NCX table of contents read by EPUB2 reading systems.
+
+    Args:
+        title: The title of the book.
+        identifier: The unique identifier of the book.
+        toc: The title and the file name of each chapter.
+
+    Returns:
+        The NCX document.
+    """
+    nav_points = '\n'.join(
+        f'<navPoint id="navpoint-{index}" playOrder="{index}">'
+        f'<navLabel><text>{_escape(chapter_title)}</text></navLabel>'
+        f'<content src={_quoteattr(name)}/></navPoint>'
+        for index, (chapter_title, name) in enumerate(toc, 1))
+
+    return f'''<?xml version="1.0" encoding="utf-8"?>
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
+<head>
+<meta name="dtb:uid" content={_quoteattr(identifier)}/>
+<meta name="dtb:depth" content="1"/>
+<meta name="dtb:totalPageCount" content="0"/>
+<meta name="dtb:maxPageNumber" content="0"/>
+</head>
+<docTitle><text>{_escape(title)}</text></docTitle>
+<navMap>
+{nav_points}
+</navMap>
+</ncx>
+'''
+
+
+def _get_package(book: Book,
+                 identifier: str,
+                 items: Sequence[Tuple[str, str, str, Optional[str]]],
+                 spine: Sequence[str],
+                 modified: Optional[float] = None) -> str:
+    """Gets the package document listing the metadata, the files and the reading order.
+
+    Args:
+        book: The book.
+        identifier: The unique identifier of the book.
+        items: The id, the file name, the media type and the properties of each file.
+        spine: The ids of the XHTML documents in reading order.
+        modified: The time the publication was last modified, in seconds since the epoch.
+
+    Returns:
+        The package document.
+    """
+    manifest = '\n'.join(
+        f'<item id="{id_}" href={_quoteattr(href)} media-type="{media_type}"'
+        + (f' properties="{properties}"' if properties else '') + '/>'
+        for id_, href, media_type, properties in items)
+    itemrefs = '\n'.join(f'<itemref idref="{idref}"/>' for idref in spine)
+    cover = next((id_ for id_, _, _, properties in items if properties == 'cover-image'), None)
+
+    return f'''<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">
+<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+{_get_metadata(book, identifier, cover, modified)}
+</metadata>
+<manifest>
+{manifest}
+</manifest>
+<spine toc="ncx">
+{itemrefs}
+</spine>
+</package>
+'''
+
+
+def _get_metadata(book: Book,
+                  identifier: str,
+                  cover: Optional[str] = None,
+                  modified: Optional[float] = None) -> str:
+    """Gets the metadata elements of the package document.
+
+    Args:
+        book: The book.
+        identifier: The unique identifier of the book.
+        cover: The id of the cover image, if any.
+        modified: The time the publication was last modified, in seconds since the epoch.
+            Defaults to now.
+
+    Returns:
+        The metadata elements.
+    """
+    def element(name: str, text: str, **attributes) -> str:
+        attributes_string = ''.join(f' {key.replace("_", "-")}={_quoteattr(str(value))}'
+                                    for key, value in attributes.items())
+        return f'<{name}{attributes_string}>{_escape(str(text))}</{name}>'
+
+    metadata = [element('dc:identifier', identifier, id='book-id'),
+                element('dc:title', book.title, id='title'),
+                element('dc:language', book.language or 'und'),
+                element('meta', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(modified)),
+                        property='dcterms:modified')]
+
+    if book.title_sort:
+        metadata.append(element('meta', book.title_sort, refines='#title', property='file-as'))
+
+    authors = [author.strip() for author in (book.authors or '').split('&') if author.strip()]
+
+    for index, author in enumerate(authors, 1):
+        metadata.append(element('dc:creator', author, id=f'creator-{index}'))
+        metadata.append(element('meta', 'aut', refines=f'#creator-{index}', property='role',
+                                scheme='marc:relators'))
+
+    if book.author_sort and authors:
+        metadata.append(element('meta', book.author_sort, refines='#creator-1',
+                                property='file-as'))
+
+    if book.book_producer:
+        metadata.append(element('dc:contributor', book.book_producer, id='producer'))
+        metadata.append(element('meta', 'bkp', refines='#producer', property='role',
+                                scheme='marc:relators'))
+
+    if book.publisher:
+        metadata.append(element('dc:publisher', book.publisher))
+
+    if book.pubdate:
+        metadata.append(element('dc:date', book.pubdate))
+
+    if book.comments:
+        metadata.append(element('dc:description', book.comments))
+
+    for tag in (book.tags or '').split(','):
+        if tag.strip():
+            metadata.append(element('dc:subject', tag.strip()))
+
+    if book.series:
+        metadata.append(element('meta', book.series, id='series',
+                                property='belongs-to-collection'))
+        metadata.append(element('meta', 'series', refines='#series',
+                                property='collection-type'))
+
+        if book.series_index is not None:
+            metadata.append(element('meta', book.series_index, refines='#series',
+                                    property='group-position'))
+
+    if cover:
+        metadata.append(f'<meta name="cover" content={_quoteattr(cover)}/>')
+
+    return '\n'.join(metadata)
@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""This module implements the memory-mapped substitution path for very large chapter files.
+
+Chapter files are mapped into memory instead of being read and decoded up front. The leading
+substitutions that give the same result on utf-8 encoded bytes as on text run directly on the
+mapped file: literal prefilters search the mapping and regular expressions scan it without a
+copy. The chapter is decoded only once, after the last of these substitutions, and the
+remaining substitutions are applied to the decoded text as usual.
+
+Chapters are always decoded as utf-8. Chapters containing carriage returns are decoded right
+away, so their line endings are translated exactly like when reading them as text.
+"""
+
+import logging
+import mmap
+import re
+import weakref
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from publish.substitution import (Substitution, SimpleSubstitution, RegexSubstitution,
+                                  FusedSubstitution)
+
+try:
+    from re import _parser as sre_parse  # type: ignore
+except ImportError:  # pragma: no cover
+    import sre_parse  # Python < 3.11
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(logging.NullHandler())
+
+Buffer = Union[bytes, mmap.mmap]
+
+_UNSAFE_ESCAPES = re.compile(r'\\[xuUN0-7]')
+"""Escapes whose meaning differs between str and bytes patterns."""
+
+_REPEATS = tuple(getattr(sre_parse, name)
+                 for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+                 if hasattr(sre_parse, name))
+
+_ATOMIC_GROUP = getattr(sre_parse, 'ATOMIC_GROUP', None)
+
+_WORD_BOUNDARIES = (sre_parse.AT_BOUNDARY, sre_parse.AT_NON_BOUNDARY)
+
+_UNKNOWN = object()
+"""Stands in for the unknown pattern item following the items of a repeat or an assertion."""
+
+_BYTES_SUBSTITUTIONS: 'weakref.WeakKeyDictionary' = weakref.WeakKeyDictionary()
+"""The bytes counterparts of substitutions, so patterns are checked and compiled only once."""
+
+
+class _BytesSubstitution:
+    """The bytes counterpart of a substitution.
+
+    Args:
+        regular_expression: The regular expression compiled as a bytes pattern or None for
+            simple substitutions.
+        old: The utf-8 encoded old string for simple substitutions or None.
+        new: The utf-8 encoded new string or replacement template.
+        literals: The utf-8 encoded literals every match contains or None.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self,
+                 regular_expression: Optional['re.Pattern'],
+                 old: Optional[bytes],
+                 new: bytes,
+                 literals: Optional[Sequence[bytes]]):
+        """Initializes a new instance of the :class:`_BytesSubstitution` class.
+        """
+        self.regular_expression = regular_expression
+        self.old = old
+        self.new = new
+        self.literals = literals
+
+    def may_match(self, buffer: Buffer) -> bool:
+        """Tells whether the substitution may change the buffer, searching the buffer for the
+        literals every match contains.
+
+        Args:
+            buffer: The utf-8 encoded text, either as bytes or memory-mapped.
+
+        Returns:
+            False if the substitution can't change the buffer, otherwise True.
+        """
+        return self.literals is None or \
+            any(buffer.find(literal) != -1 for literal in self.literals)
+
+    def apply_to(self, buffer: Buffer) -> Buffer:
+        """Applies the substitution to the buffer.
+
+        Args:
+            buffer: The utf-8 encoded text, either as bytes or memory-mapped.
+
+        Returns:
+            The buffer itself if nothing changed, otherwise the changed bytes.
+        """
+        if self.regular_expression is None:
+            return bytes(buffer).replace(self.old, self.new)
+
+        changed, count = self.regular_expression.subn(self.new, buffer)
+
+        return changed if count else buffer
+
+
+@contextmanager
+def map_file(path: str) -> Iterator[Buffer]:
+    """Maps the file at path into memory for reading.
+
+    Args:
+        path: The path of the file.
+
+    Yields:
+        The memory-mapped file or empty bytes for an empty file, which can't be mapped.
+    """
+    with open(path, 'rb') as file:
+        try:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            yield b''
+            return
+
+        try:
+            yield buffer
+        finally:
+            buffer.close()
+
+
+def read_substituted(path: str, substitutions: Sequence[Substitution]) -> str:
+    """Maps the chapter file at path into memory and applies the substitutions to it.
+
+    See :func:`substitute_buffer`.
+
+    Args:
+        path: The path of the chapter file.
+        substitutions: The compiled list of substitutions.
+
+    Returns:
+        The changed markdown content.
+    """
+    with map_file(path) as buffer:
+        return substitute_buffer(buffer, substitutions)
+
+
+def substitute_buffer(buffer: Buffer, substitutions: Sequence[Substitution]) -> str:
+    """Applies the substitutions to the utf-8 encoded content of a chapter.
+
+    The leading substitutions that can be applied to bytes are applied to the buffer first,
+    then it is decoded and the remaining substitutions are applied to the text.
+
+    Args:
+        buffer: The utf-8 encoded content, either as bytes or memory-mapped.
+        substitutions: The compiled list of substitutions.
+
+    Returns:
+        The changed markdown content.
+
+    Raises:
+        UnicodeDecodeError: If the chapter is not valid utf-8.
+    """
+    if buffer.find(b'\r') != -1:
+        # Carriage returns are translated like universal newlines do before anything else.
+        return _apply(_decode(buffer).replace('\r\n', '\n').replace('\r', '\n'), substitutions)
+
+    bytes_substitutions, remaining = split_bytes_substitutions(substitutions)
+    changed = buffer
+
+    for substitution, bytes_substitution in bytes_substitutions:
+        counted = isinstance(substitution, RegexSubstitution)
+
+        if not bytes_substitution.may_match(changed):
+            if counted:
+                substitution.skipped += 1
+            continue
+
+        if counted:
+            substitution.applied += 1
+
+        changed = bytes_substitution.apply_to(changed)
+
+    return _apply(_decode(changed), remaining)
+
+
+def split_bytes_substitutions(substitutions: Sequence[Substitution]
+                              ) -> Tuple[List[Tuple[Substitution, _BytesSubstitution]],
+                                         Sequence[Substitution]]:
+    """Splits the compiled list of substitutions into the leading substitutions that can be
+    applied to utf-8 encoded bytes and the remaining ones.
+
+    Fused substitutions are applied to bytes one substitution at a time, if all of their
+    substitutions can be applied to bytes.
+
+    Args:
+        substitutions: The compiled list of substitutions.
+
+    Returns:
+        A tuple of the leading substitutions, each paired with its bytes counterpart, and the
+        remaining substitutions.
+    """
+    bytes_substitutions = []
+    count = 0
+
+    for substitution in substitutions:
+        parts = substitution.substitutions if isinstance(substitution, FusedSubstitution) \
+            else [substitution]
+        counterparts = [get_bytes_substitution(part) for part in parts]
+
+        if None in counterparts:
+            break
+
+        bytes_substitutions.extend(zip(parts, counterparts))
+        count += 1
+
+    return bytes_substitutions, substitutions[count:]
+
+
+def get_bytes_substitution(substitution: Substitution) -> Optional[_BytesSubstitution]:
+    """Gets the bytes counterpart of the substitution, which gives the same result on utf-8
+    encoded bytes as the substitution gives on text.
+
+    Simple substitutions always have one, unless their old string is empty. Regex
+    substitutions only have one if their pattern means the same as a bytes pattern: it must not
+    match the empty string, ignore case, use unicode character classes or word boundaries, or
+    escapes for non-ascii characters. Anything matching any single character, such as `.` or
+    `[^"]`, may only be repeated without an upper limit and must be followed by something that
+    can't match in the middle of a character, such as `"`, or end the pattern. All other
+    substitutions have none.
+
+    Args:
+        substitution: The substitution.
+
+    Returns:
+        The bytes counterpart or None if the substitution has none.
+    """
+    try:
+        return _BYTES_SUBSTITUTIONS[substitution]
+    except KeyError:
+        pass
+
+    bytes_substitution = None
+
+    if isinstance(substitution, SimpleSubstitution) and substitution.old:
+        old = substitution.old.encode('utf-8')
+        bytes_substitution = _BytesSubstitution(None, old, substitution.new.encode('utf-8'), [old])
+    elif isinstance(substitution, RegexSubstitution):
+        bytes_substitution = _get_bytes_regex_substitution(substitution)
+
+    _BYTES_SUBSTITUTIONS[substitution] = bytes_substitution
+
+    return bytes_substitution
+
+
+def _get_bytes_regex_substitution(substitution: RegexSubstitution
+                                  ) -> Optional[_BytesSubstitution]:
+    """Gets the bytes counterpart of the regex substitution. See
+    :func:`get_bytes_substitution`.
+
+    Args:
+        substitution: The regex substitution.
+
+    Returns:
+        The bytes counterpart or None if the regex substitution has none.
+    """
+    regular_expression = substitution.regular_expression
+    pattern = regular_expression.pattern
+    replace_with = substitution.replace_with
+
+    if not isinstance(pattern, str) or not isinstance(replace_with, str) or \
+            _UNSAFE_ESCAPES.search(pattern) or regular_expression.flags & re.IGNORECASE:
+        return None
+
+    ascii_only = bool(regular_expression.flags & re.ASCII)
+
+    try:
+        parsed = sre_parse.parse(pattern, regular_expression.flags)
+
+        # Empty matches would be replaced between the bytes of every character.
+        if parsed.getwidth()[0] == 0 or not _is_bytes_safe(parsed, ascii_only, None):
+            return None
+        bytes_expression = re.compile(pattern.encode('utf-8'),
+                                      regular_expression.flags & ~re.UNICODE)
+    except (re.error, RecursionError):
+        return None
+
+    literals = None if substitution.literals is None \
+        else [literal.encode('utf-8') for literal in substitution.literals]
+
+    return _BytesSubstitution(bytes_expression, None, replace_with.encode('utf-8'), literals)
+
+
+def _is_bytes_safe(items: Iterable,
+                   ascii_only: bool,
+                   following=_UNKNOWN,
+                   repeated: bool = False) -> bool:
+    """Tells whether the parsed pattern items match the same utf-8 encoded text as bytes as
+    they match as str.
+
+    Args:
+        items: The parsed pattern items.
+        ascii_only: Determines whether the pattern uses the ASCII flag.
+        following: The parsed item following the items, None at the end of the pattern.
+        repeated: Determines whether the items are the only item of a repeat that can only
+            stop at the boundary of a character, so it matches whole characters even where
+            a single item matches bytes.
+
+    Returns:
+        True if the items are safe, otherwise False.
+    """
+    items = list(items)
+
+    for index, (operator, argument) in enumerate(items):
+        after = items[index + 1] if index + 1 < len(items) else following
+
+        if operator == sre_parse.LITERAL:
+            continue
+
+        if operator in (sre_parse.ANY, sre_parse.NOT_LITERAL):
+            if not repeated or (operator == sre_parse.NOT_LITERAL and argument > 0x7f):
+                return False
+        elif operator == sre_parse.IN:
+            if not _is_bytes_safe_set(argument, ascii_only, repeated):
+                return False
+        elif operator == sre_parse.CATEGORY:
+            if not ascii_only:
+                return False
+        elif operator == sre_parse.AT:
+            if argument in _WORD_BOUNDARIES and not ascii_only:
+                return False
+        elif operator in _REPEATS:
+            minimum, maximum, sub_items = argument
+            sub_items = list(sub_items)
+
+            if len(sub_items) == 1 and sub_items[0][0] == sre_parse.LITERAL and \
+                    sub_items[0][1] > 0x7f:
+                # Only the last byte of a non-ascii character would be repeated.
+                return False
+
+            repeated_items = len(sub_items) == 1 and minimum <= 1 and \
+                maximum == sre_parse.MAXREPEAT and \
+                _is_character_boundary(after, operator != sre_parse.MIN_REPEAT)
+
+            if not _is_bytes_safe(sub_items, ascii_only, _UNKNOWN, repeated_items):
+                return False
+        elif operator == sre_parse.SUBPATTERN:
+            if argument[1] & re.IGNORECASE or not _is_bytes_safe(argument[3], ascii_only, after):
+                return False
+        elif operator == sre_parse.BRANCH:
+            if not all(_is_bytes_safe(branch, ascii_only, after) for branch in argument[1]):
+                return False
+        elif operator in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            if not _is_bytes_safe(argument[1], ascii_only):
+                return False
+        elif operator == _ATOMIC_GROUP:
+            if not _is_bytes_safe(argument, ascii_only, after):
+                return False
+        elif operator == sre_parse.GROUPREF_EXISTS:
+            if not _is_bytes_safe(argument[1], ascii_only, after) or \
+                    (argument[2] is not None and
+                     not _is_bytes_safe(argument[2], ascii_only, after)):
+                return False
+        elif operator != sre_parse.GROUPREF:
+            return False
+
+    return True
+
+
+def _is_character_boundary(item, greedy: bool) -> bool:
+    """Tells whether the parsed pattern item following a repeat can only match at the boundary
+    of a character, so the repeat can't stop in the middle of a character.
+
+    Args:
+        item: The parsed item following the repeat, None at the end of the pattern.
+        greedy: Determines whether the repeat is greedy. Greedy repeats at the end of the
+            pattern only stop where the text doesn't match anymore.
+
+    Returns:
+        True if the item only matches at the boundary of a character, otherwise False.
+    """
+    if item is None:
+        return greedy
+
+    if item is _UNKNOWN:
+        return False
+
+    operator, argument = item
+
+    if operator == sre_parse.LITERAL:
+        return True
+
+    if operator == sre_parse.AT:
+        return argument not in _WORD_BOUNDARIES
+
+    return operator == sre_parse.IN and \
+        all((member == sre_parse.LITERAL and value <= 0x7f) or
+            (member == sre_parse.RANGE and value[1] <= 0x7f)
+            for member, value in argument)
+
+
+def _is_bytes_safe_set(items: Iterable, ascii_only: bool, repeated: bool) -> bool:
+    """Tells whether the parsed items of a character set match the same utf-8 encoded text as
+    bytes as they match as str.
+
+    Sets are safe if they only contain ascii characters. Negated sets also match the bytes
+    of non-ascii characters, so they are only safe if they are repeated without an upper
+    limit.
+
+    Args:
+        items: The parsed items of the character set.
+        ascii_only: Determines whether the pattern uses the ASCII flag.
+        repeated: Determines whether the set is the only item of a repeat without an upper
+            limit.
+
+    Returns:
+        True if the set is safe, otherwise False.
+    """
+    for operator, argument in items:
+        if operator == sre_parse.NEGATE:
+            if not repeated:
+                return False
+        elif operator == sre_parse.LITERAL:
+            if argument > 0x7f:
+                return False
+        elif operator == sre_parse.RANGE:
+            if argument[1] > 0x7f:
+                return False
+        elif operator != sre_parse.CATEGORY or not ascii_only:
+            return False
+
+    return True
+
+
+def _decode(buffer: Buffer) -> str:
+    """Decodes the utf-8 encoded buffer without copying a memory-mapped file first.
+
+    Args:
+        buffer: The buffer.
+
+    Returns:
+        The text.
+    """
+    with memoryview(buffer) as view:
+        return str(view, 'utf-8')
+
+
+def _apply(text: str, substitutions: Sequence[Substitution]) -> str:
+    """Applies the substitutions to the text.
+
+    Args:
+        text: The text.
+        substitutions: The substitutions.
+
+    Returns:
+        The changed text.
+    """
+    for substitution in substitutions:
+        text = substitution.apply_to(text)
+
+    return text
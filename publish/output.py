@@ -10,22 +10,31 @@
 """This module offers the output classes used to transform book objects into html or epub files.
 """
 
+import hashlib
+import io
+import itertools
 import logging
 import os
 import shutil
-import subprocess  # nosec
 import uuid
+import tempfile
+from contextlib import contextmanager
 from tempfile import mkdtemp
 from textwrap import fill
-from typing import Iterable, Generator, Optional, Sequence
-from pkg_resources import resource_string
-
-import markdown
-from jinja2 import Template
+from typing import Iterable, Iterator, Generator, Hashable, List, Optional, Sequence, Tuple
 
 from publish import __version__ as package_version
 from publish.book import Book, Chapter
-from publish.substitution import Substitution, apply_substitutions
+from publish.build import BuildContext
+from publish.cache import RenderCache, fingerprint_substitutions, hash_file, hash_key
+from publish.ebookconvert import (ConversionResult, EbookConvertNotFoundError, convert,
+                                  get_version)
+from publish.mapped import Buffer, map_file, read_substituted, substitute_buffer
+from publish.render import (MD_PARAGRAPH_SEP, HTML_CHAPTER_SEP, collect_reference_definitions,
+                            get_markdown_fingerprint, render_markdown, render_chapter,
+                            render_chapters)
+from publish.substitution import ChapterSubstitutions, Substitution, substitute_texts
+from publish.template import get_template
 
 LOG = logging.getLogger(__name__)
 LOG.addHandler(logging.NullHandler())
@@ -65,6 +74,39 @@ class HtmlOutput:
             no matter how the chapters are configured.
 
             Defaults to False.
+        jobs (int): The number of processes used to render the chapters.
+
+            If set to a number greater than 1, the chapters are rendered separately across
+            a pool of processes and joined together in order. Reference-style links defined
+            in one chapter still resolve in all other chapters.
+
+            Defaults to 1, which renders all chapters as one single document.
+        processes (int): The number of processes used to render the chapters when they are
+            rendered separately, without changing whether they are.
+
+            Defaults to None, which uses `jobs` processes. Set by
+            :func:`publish.build.divide_jobs` to share the processes between outputs.
+        streaming (bool): Determines whether to stream the html document to disk.
+
+            If set to true, the chapters are substituted, rendered and written to the output
+            file one at a time, so memory usage is bound by the largest chapter instead of the
+            whole book. Streaming outputs do not share their html document with other outputs
+            of the same build and always render in a single process.
+
+            Defaults to False.
+        memory_map (bool): Determines whether chapter files are memory-mapped.
+
+            If set to true, the leading substitutions that can be applied to utf-8 encoded
+            bytes run directly on the memory-mapped chapter file, which is decoded only once
+            they are done. Meant for very large chapter files, which must be utf-8 encoded.
+
+            Defaults to False.
+        template (str): The path to the jinja2 template used to create the html document.
+
+            The template can extend the bundled template by starting with
+            ``{% extends "publish/template.jinja" %}`` and overriding its blocks.
+
+            Defaults to None, which uses the bundled template.
     """
 
     def __init__(self,
@@ -75,22 +117,36 @@ class HtmlOutput:
         self.path = path
         self.stylesheet = kwargs.pop('stylesheet', None)
         self.force_publish = kwargs.pop('force_publish', False)
+        self.jobs = kwargs.pop('jobs', 1)
+        self.processes = kwargs.pop('processes', None)
+        self.streaming = kwargs.pop('streaming', False)
+        self.memory_map = kwargs.pop('memory_map', False)
+        self.template = kwargs.pop('template', None)
 
     def make(self,
              book: Book,
-             substitutions: Optional[Iterable[Substitution]] = None):
+             substitutions: Optional[Iterable[Substitution]] = None,
+             context: Optional[BuildContext] = None):
         """Makes the Output for the provided book and substitutions.
 
         Args:
             book: The book.
             substitutions: The substitutions.
+            context: The optional build context shared by all outputs of the same build.
+                If present, the html document is only rendered if no other output of the
+                build has rendered the same document before.
         """
         LOG.info('Making HtmlOutput ...')
 
-        if not substitutions:
-            substitutions = []
+        substitutions = list(substitutions) if substitutions else []
+
+        if self.streaming:
+            self._write_html_document(book, substitutions, self.path,
+                                      context.cache if context else None)
+            LOG.info('... HtmlOutput finished')
+            return
 
-        html_document = self._get_html_document(book, substitutions)
+        html_document = self._render_html_document(book, substitutions, context)
 
         with open(self.path, 'w') as file:
             file.write(html_document)
@@ -114,6 +170,99 @@ class HtmlOutput:
 
         return list(filter(lambda c: c.publish is True, chapters))
 
+    @property
+    def renders_by_chapter(self) -> bool:
+        """Determines whether the chapters are rendered separately and joined together instead
+        of as one single document, which is the case if `jobs` is greater than 1 or the
+        output is streamed. The html differs slightly between both."""
+        return self.jobs > 1 or self.streaming
+
+    def get_render_key(self,
+                       book: Book,
+                       substitutions: Sequence[Substitution]) -> Hashable:
+        """Gets the key identifying the html document this output renders for the book and
+        substitutions.
+
+        Two outputs with the same render key produce the same html document, which allows a
+        :class:`publish.build.BuildContext` to render it only once per build. The key is made up
+        of the chapters to be published, the substitutions, the stylesheet, the template, the
+        parts of the book that end up in the html template and whether the chapters are
+        rendered separately.
+
+        Args:
+            book: The book.
+            substitutions: The list of substitutions.
+
+        Returns:
+            The render key.
+        """
+        chapters = tuple(chapter.src
+                         for chapter in self.get_chapters_to_be_published(book.chapters))
+
+        return (chapters,
+                tuple(substitutions),
+                self.stylesheet,
+                self.template,
+                book.title,
+                book.language,
+                self.renders_by_chapter)
+
+    def _render_html_document(self,
+                              book: Book,
+                              substitutions: Sequence[Substitution],
+                              context: Optional[BuildContext] = None) -> str:
+        """Gets the html document for the book, either by rendering it or, if a build context
+        is present, by asking the build context for it.
+
+        Args:
+            book: The book.
+            substitutions: The list of substitutions.
+            context: The optional build context.
+
+        Returns:
+            The html document as a string.
+        """
+        if not context:
+            return self._get_html_document(book, substitutions)
+
+        return context.get_document(
+            self.get_render_key(book, substitutions),
+            lambda: self._get_html_document(book, substitutions, context.cache))
+
+    def _write_html_document(self,
+                             book: Book,
+                             substitutions: Sequence[Substitution],
+                             path: str,
+                             cache: Optional[RenderCache] = None):
+        """Renders the book to html chapter by chapter and streams the html document to the
+        file at path.
+
+        The document is written to a temporary file next to path first, which replaces the
+        file at path once the document is complete.
+
+        Args:
+            book: The book.
+            substitutions: The list of substitutions.
+            path: The path of the html document.
+            cache: The optional render cache.
+        """
+        html_content = self._iter_html_content(book.chapters, substitutions, cache)
+        html_document = _stream_template(html_content=html_content,
+                                         title=book.title,
+                                         css=self._get_css(),
+                                         language=book.language,
+                                         template=self.template)
+        partial_path = f'{path}.part'
+
+        try:
+            with open(partial_path, 'w') as file:
+                for chunk in html_document:
+                    file.write(chunk)
+            os.replace(partial_path, path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
     def _get_css(self) -> str:
         """Gets the css from the css file specified in stylesheet as a string.
 
@@ -133,7 +282,8 @@ class HtmlOutput:
 
     def _get_html_document(self,
                            book: Book,
-                           substitutions: Iterable[Substitution]
+                           substitutions: Iterable[Substitution],
+                           cache: Optional[RenderCache] = None
                            ) -> str:
         """Takes a book, renders it to html, applying the list of substitutions in the process
         and returns the finished html document as a string.
@@ -141,25 +291,29 @@ class HtmlOutput:
         Args:
             book: The book.
             substitutions: The list of substitutions.
+            cache: The optional render cache.
 
         Returns:
             The html document as a string.
         """
-        html_content = self._get_html_content(book.chapters, substitutions)
+        html_content = self._get_html_content(book.chapters, substitutions, cache)
         html_document = _apply_template(html_content=html_content,
                                         title=book.title,
                                         css=self._get_css(),
-                                        language=book.language)
+                                        language=book.language,
+                                        template=self.template)
 
         return html_document
 
     def _get_html_content(self,
                           chapters: Iterable[Chapter],
-                          substitutions: Iterable[Substitution]) -> str:
+                          substitutions: Iterable[Substitution],
+                          cache: Optional[RenderCache] = None) -> str:
         """Gets the content of the provided list of chapters as as an html string.
 
-        The list of substitutions is applied to the markdown content before it is rendered to
-        html.
+        The list of substitutions is applied to the markdown content of one chapter at a time
+        before the chapters are rendered to html. Substitutions with a selector are only applied
+        to the chapters they select.
 
         The order of the chapters is preserved.
 
@@ -169,17 +323,186 @@ class HtmlOutput:
         Args:
             chapters: The list of chapters.
             substitutions: The list of substitutions.
+            cache: The optional render cache. If present, the substituted markdown of each
+                chapter and the html of the whole document are taken from the cache where
+                possible. The document is still rendered as a whole, so the html is the same
+                as without a cache.
 
         Returns:
             The content of the provided list of chapters as an html string.
         """
-        markdown_ = self._get_markdown_content(chapters)
-        markdown_ = apply_substitutions(
-            markdown_,
-            substitutions)
+        if self.jobs > 1:
+            return self._get_html_content_by_chapter(chapters, substitutions, cache)
+
+        chapters_to_publish = self._get_chapters_to_publish(chapters)
+        substitutions = list(substitutions)
+        fingerprint, cache = _get_substitutions_fingerprint(substitutions, cache)
+
+        if substitutions:
+            LOG.info('Applying substitutions ...')
+
+        if cache is not None:
+            return self._get_cached_html_content(chapters_to_publish, substitutions,
+                                                 fingerprint, cache)
+
+        if self.memory_map:
+            chapter_substitutions = ChapterSubstitutions(substitutions)
+            markdown_ = MD_PARAGRAPH_SEP.join(
+                read_substituted(chapter.src, chapter_substitutions.get_compiled(chapter))
+                for chapter in chapters_to_publish)
+        else:
+            markdown_chapters = self._get_markdown_chapters(chapters_to_publish)
+            markdown_ = MD_PARAGRAPH_SEP.join(
+                substitute_texts(markdown_chapters, substitutions, chapters_to_publish))
+
+        LOG.info('Rendering markdown to html ...')
+        return render_markdown(markdown_)
+
+    def _get_cached_html_content(self,
+                                 chapters: Sequence[Chapter],
+                                 substitutions: Sequence[Substitution],
+                                 fingerprint: Optional[str],
+                                 cache: RenderCache) -> str:
+        """Gets the content of the chapters as an html string, rendering the whole document at
+        once unless it is found in the render cache.
+
+        See :meth:`_get_html_content`.
+
+        Args:
+            chapters: The list of chapters to be published.
+            substitutions: The list of substitutions.
+            fingerprint: The fingerprint of the substitutions.
+            cache: The render cache.
+
+        Returns:
+            The content of the chapters as an html string.
+        """
+        chapter_substitutions = ChapterSubstitutions(substitutions)
+        markdown_keys = []
+        markdown_chapters = []
+
+        for chapter in chapters:
+            key, markdown_ = _substitute_chapter(chapter, chapter_substitutions, fingerprint,
+                                                 cache, self.memory_map)
+            markdown_keys.append(key)
+            markdown_chapters.append(markdown_)
+
+        html_key = hash_key('document', tuple(markdown_keys), get_markdown_fingerprint())
+        html_content = cache.get(html_key)
+
+        if html_content is not None:
+            LOG.info('Html document taken from the render cache')
+            return html_content
 
         LOG.info('Rendering markdown to html ...')
-        return markdown.markdown(markdown_)
+        html_content = render_markdown(MD_PARAGRAPH_SEP.join(markdown_chapters))
+        cache.put(html_key, html_content)
+
+        return html_content
+
+    def _get_html_content_by_chapter(self,
+                                     chapters: Iterable[Chapter],
+                                     substitutions: Iterable[Substitution],
+                                     cache: Optional[RenderCache] = None) -> str:
+        """Gets the content of the provided list of chapters as an html string, applying the
+        substitutions to and rendering each chapter separately.
+
+        The chapters are rendered across a pool of `processes` or, if that is None, `jobs`
+        processes. If a render cache is present, the substituted markdown and the html of each
+        chapter are taken from the cache where possible and stored in it otherwise.
+
+        Args:
+            chapters: The list of chapters.
+            substitutions: The list of substitutions.
+            cache: The optional render cache.
+
+        Returns:
+            The content of the provided list of chapters as an html string.
+        """
+        return HTML_CHAPTER_SEP.join(self._get_html_chapters(chapters, substitutions, cache))
+
+    def _get_html_chapters(self,
+                           chapters: Iterable[Chapter],
+                           substitutions: Iterable[Substitution],
+                           cache: Optional[RenderCache] = None) -> List[str]:
+        """Gets the html of each of the provided list of chapters that is set to be published,
+        applying the substitutions to and rendering each chapter separately.
+
+        See :meth:`_get_html_content_by_chapter`.
+
+        Args:
+            chapters: The list of chapters.
+            substitutions: The list of substitutions.
+            cache: The optional render cache.
+
+        Returns:
+            The html of each chapter to be published, in order.
+        """
+        substitutions = list(substitutions)
+        fingerprint, cache = _get_substitutions_fingerprint(substitutions, cache)
+        chapter_substitutions = ChapterSubstitutions(substitutions)
+
+        markdown_keys = []
+        markdown_chapters = []
+
+        if substitutions:
+            LOG.info('Applying substitutions ...')
+
+        for chapter in self._get_chapters_to_publish(chapters):
+            key, markdown_ = _substitute_chapter(chapter, chapter_substitutions, fingerprint,
+                                                 cache, self.memory_map)
+            markdown_keys.append(key)
+            markdown_chapters.append(markdown_)
+
+        LOG.info('Rendering markdown to html ...')
+        definitions = collect_reference_definitions(markdown_chapters)
+
+        if cache is None:
+            return render_chapters(markdown_chapters, self.processes or self.jobs, definitions)
+
+        html_keys = [hash_key('html', key, definitions, get_markdown_fingerprint())
+                     for key in markdown_keys]
+        html_chapters = [cache.get(key) for key in html_keys]
+        missing = [index for index, html in enumerate(html_chapters) if html is None]
+
+        if missing:
+            rendered = render_chapters([markdown_chapters[index] for index in missing],
+                                       self.processes or self.jobs,
+                                       definitions)
+
+            for index, html in zip(missing, rendered):
+                html_chapters[index] = html
+                cache.put(html_keys[index], html)
+
+        LOG.info(f'{len(html_chapters) - len(missing)} of {len(html_chapters)} chapters '
+                 f'taken from the render cache')
+
+        return html_chapters
+
+    def _iter_html_content(self,
+                           chapters: Iterable[Chapter],
+                           substitutions: Iterable[Substitution],
+                           cache: Optional[RenderCache] = None) -> Iterator[str]:
+        """Gets the content of the provided list of chapters as an iterator of html strings,
+        applying the substitutions to and rendering one chapter at a time.
+
+        The substituted markdown of each chapter is spooled to a temporary file while the
+        reference definitions of the whole book are collected. Only then are the chapters
+        rendered, one after another, so no more than a single chapter is held in memory at any
+        time. Chapters are always rendered in the current process.
+
+        Args:
+            chapters: The list of chapters.
+            substitutions: The list of substitutions.
+            cache: The optional render cache.
+
+        Returns:
+            An iterator over the html of the chapters and the separators between them.
+        """
+        chapters_to_publish = self._get_chapters_to_publish(chapters)
+
+        return _generate_html_content(chapters_to_publish, list(substitutions), cache,
+                                      self.memory_map)
 
     def _get_markdown_content(self,
                               chapters: Iterable[Chapter]) -> str:
@@ -194,24 +517,51 @@ class HtmlOutput:
         Returns:
             The markdown content of the list of chapters concatenated into a single string.
         """
-        markdown_ = []
-        md_paragraph_sep = '\n\n'
+        return MD_PARAGRAPH_SEP.join(self._get_markdown_chapters(chapters))
+
+    def _get_markdown_chapters(self,
+                               chapters: Iterable[Chapter]) -> Iterator[str]:
+        """Gets the markdown content of each chapter of the provided list of chapters that is
+        set to be published.
+
+        The order of the chapters is preserved. Each chapter is only read when the iterator
+        reaches it, but the list of chapters is validated right away.
+
+        Args:
+            chapters: The list of chapters.
+
+        Returns:
+            An iterator over the markdown contents of the chapters.
+        """
+        chapters_to_publish = self._get_chapters_to_publish(chapters)
+
+        LOG.info('Collecting chapters ...')
+        return (read_markdown(chapter) for chapter in chapters_to_publish)
 
+    def _get_chapters_to_publish(self,
+                                 chapters: Iterable[Chapter]) -> List[Chapter]:
+        """Gets the list of chapters to be published, raising an error if there are none.
+
+        Args:
+            chapters: The list of chapters.
+
+        Returns:
+            The list of chapters to be published.
+
+        Raises:
+            NoChaptersFoundError: If there are no chapters or none of them are set to be
+                published.
+        """
         if not chapters:
             raise NoChaptersFoundError('Your book contains no chapters.')
 
-        chapters_to_publish = self.get_chapters_to_be_published(chapters)
+        chapters_to_publish = list(self.get_chapters_to_be_published(chapters))
 
         if not chapters_to_publish:
             raise NoChaptersFoundError('None of your chapters are set to be'
                                        'published.')
 
-        LOG.info('Collecting chapters ...')
-        for chapter in chapters_to_publish:
-            with open(chapter.src, 'r') as file:
-                markdown_.append(file.read())
-
-        return md_paragraph_sep.join(markdown_)
+        return chapters_to_publish
 
 
 class EbookConvertOutput(HtmlOutput):
@@ -236,6 +586,41 @@ class EbookConvertOutput(HtmlOutput):
             no matter how the chapters are configured.
 
             Defaults to False.
+        jobs (int): The number of processes used to render the chapters.
+
+            Defaults to 1, which renders all chapters as one single document.
+        processes (int): The number of processes used to render the chapters when they are
+            rendered separately.
+
+            Defaults to None, which uses `jobs` processes.
+        streaming (bool): Determines whether to stream the html document passed to
+            ebook-convert to disk chapter by chapter.
+
+            Defaults to False.
+        memory_map (bool): Determines whether chapter files are memory-mapped.
+
+            Defaults to False.
+        template (str): The path to the jinja2 template used to create the html document.
+
+            Defaults to None, which uses the bundled template.
+        timeout (float): The number of seconds after which ebook-convert is killed.
+
+            Defaults to None, which waits for ebook-convert indefinitely.
+        stream_output (bool): Determines whether the output of ebook-convert is logged line by
+            line while it runs. The output is captured either way and included in the error
+            raised if ebook-convert fails.
+
+            Defaults to False.
+        split_chapters (bool): Determines whether each chapter is passed to ebook-convert as
+            an XHTML document of its own.
+
+            If set to true, ebook-convert reads a package document listing the chapters in
+            order instead of a single html document, so it needs neither parse the whole book
+            at once nor split it up by itself. The template is not used in this case.
+
+            Defaults to False.
+        conversion_result (ConversionResult): The result of the last ebook-convert call,
+            including its cpu time and peak memory usage, or None.
     """
 
     def __init__(self,
@@ -245,27 +630,51 @@ class EbookConvertOutput(HtmlOutput):
         """
         super().__init__(path, **kwargs)
         self.ebookconvert_params = kwargs.pop('ebookconvert_params', [])
+        self.timeout = kwargs.pop('timeout', None)
+        self.stream_output = kwargs.pop('stream_output', False)
+        self.split_chapters = kwargs.pop('split_chapters', False)
+        self.conversion_result = None
+
+    @property
+    def renders_by_chapter(self) -> bool:
+        """Determines whether the chapters are rendered separately, which is always the case if
+        they are passed to ebook-convert one XHTML document each."""
+        return self.split_chapters or super().renders_by_chapter
 
     def make(self,
              book: Book,
-             substitutions: Optional[Iterable[Substitution]] = None):
+             substitutions: Optional[Iterable[Substitution]] = None,
+             context: Optional[BuildContext] = None):
         """Makes an ebook from the provided book object and the markdown chapters
         specified therein.
 
         Substitutions are applied to the raw markdown before the markdown is
         processed.
 
+        ebook-convert writes the ebook to a partial file next to the output path, which
+        replaces the output once the conversion succeeded. If the build context has an artifact
+        store, the ebook is taken from the store instead of calling ebook-convert whenever the
+        html document, the command line and the version of ebook-convert are the same as for
+        an ebook made before.
+
+        See `split_chapters` for passing the chapters to ebook-convert one XHTML document each.
+
         Args:
             book: The book.
             substitutions: The list of substitutions.
+            context: The optional build context shared by all outputs of the same build.
+
+        Raises:
+            EbookConvertNotFoundError: If ebook-convert could not be found.
+            EbookConvertError: If ebook-convert failed.
         """
         LOG.info('Making EbookConvertOutput ...')
         if not book:
             raise AttributeError("book must not be None")
 
-        if not substitutions:
-            substitutions = []
+        substitutions = list(substitutions) if substitutions else []
 
+        partial_path = None
         temp_directory = mkdtemp()
         # mkstmp and NamedTemporaryFile won't work, because the html file
         # will be kept open by EbookConvertOutput with exclusive access,
@@ -273,33 +682,377 @@ class EbookConvertOutput(HtmlOutput):
         # -> ebook-convert fails with 'Permission denied'.
 
         try:
-            temp_path = os.path.join(
-                temp_directory, str(uuid.uuid4()) + '.html')
-
-            html_document = self._get_html_document(book, substitutions)
-
-            with open(temp_path, 'w') as file:
-                file.write(html_document)
-
+            temp_path = self._stage_input(book, substitutions, temp_directory, context)
+            root, extension = os.path.splitext(self.path)
+            partial_path = f'{root}.part{extension}'
             call_params = _get_ebook_convert_params(book,
                                                     input_path=temp_path,
-                                                    output_path=self.path,
+                                                    output_path=partial_path,
                                                     additional_params=self.ebookconvert_params)
+            artifacts = context.artifacts if context else None
+            artifact_key = _get_artifact_key(temp_path, call_params) if artifacts else None
+
+            if artifact_key and artifacts.get(artifact_key, self.path):
+                self.conversion_result = None
+                LOG.info('... EbookConvertOutput finished: taken from the artifact store')
+                return
 
             LOG.info('Calling ebook-convert ...')
 
             try:
-                subprocess.call(call_params, shell=False)  # nosec
-            except FileNotFoundError:
-                LOG.error(
+                result = convert(call_params,
+                                 timeout=self.timeout,
+                                 stream_output=self.stream_output)
+            except FileNotFoundError as error:
+                raise EbookConvertNotFoundError(
                     fill('Could not find ebook-convert. Please install calibre if you want to '
                          'use EbookconvertOutput and make sure ebook-convert is accessible '
-                         'through the PATH variable.'))
-                return
-            LOG.info('... EbookConvertOutput finished')
+                         'through the PATH variable.')) from error
+
+            self.conversion_result = result
+
+            if artifact_key:
+                artifacts.put(artifact_key, partial_path)
+
+            os.replace(partial_path, self.path)
+            LOG.info(f'... EbookConvertOutput finished: {_format_usage(result)}')
         finally:
             shutil.rmtree(temp_directory)
 
+            if partial_path and os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    def _stage_input(self,
+                     book: Book,
+                     substitutions: Sequence[Substitution],
+                     directory: str,
+                     context: Optional[BuildContext] = None) -> str:
+        """Writes the input of ebook-convert to the directory.
+
+        Args:
+            book: The book.
+            substitutions: The list of substitutions.
+            directory: The temporary directory.
+            context: The optional build context.
+
+        Returns:
+            The path of the html document or, if split_chapters is set, of the package document
+            referencing the XHTML documents of the chapters.
+        """
+        cache = context.cache if context else None
+
+        if self.split_chapters:
+            # epub builds on this module, so it can only be imported once both are loaded.
+            from publish.epub import stage_book  # pylint: disable=import-outside-toplevel
+
+            chapters = self._get_chapters_to_publish(book.chapters)
+
+            if self.streaming:
+                html_chapters = itertools.islice(
+                    self._iter_html_content(chapters, substitutions, cache), 0, None, 2)
+            else:
+                html_chapters = iter(self._get_html_chapters(chapters, substitutions, cache))
+
+            return stage_book(directory, book, chapters, html_chapters, self._get_css())
+
+        path = os.path.join(directory, str(uuid.uuid4()) + '.html')
+
+        if self.streaming:
+            self._write_html_document(book, substitutions, path, cache)
+        else:
+            html_document = self._render_html_document(book, substitutions, context)
+
+            with open(path, 'w') as file:
+                file.write(html_document)
+
+        return path
+
+
+def _format_usage(result: ConversionResult) -> str:
+    """Formats the wall time, cpu time and peak memory usage of an ebook-convert call.
+
+    Args:
+        result: The result of the call.
+
+    Returns:
+        The formatted resource usage.
+    """
+    usage = f'{result.seconds:.2f} s wall time'
+
+    if result.cpu_seconds is not None:
+        usage += f', {result.cpu_seconds:.2f} s cpu time'
+
+    if result.max_rss is not None:
+        usage += f', {result.max_rss / 1024 ** 2:.1f} MiB peak memory'
+
+    return usage
+
+
+def _get_artifact_key(input_path: str, call_params: Sequence[str]) -> Optional[str]:
+    """Gets the key of the ebook-convert result in the artifact store.
+
+    The key is made up of the version of ebook-convert, the content of the input, the file type
+    of the output and the command line without the executable and the paths of the input and
+    output, which are temporary. Parameters whose value is the path of a file, such as the
+    cover, add the content of the file to the key.
+
+    Args:
+        input_path: The path of the html or package document passed to ebook-convert.
+        call_params: The ebook-convert command line, see :func:`_get_ebook_convert_params`.
+
+    Returns:
+        The key or None if ebook-convert could not be run to tell its version.
+    """
+    version = get_version(call_params[0])
+
+    if version is None:
+        return None
+
+    params = []
+
+    for param in call_params[3:]:
+        value = param.split('=', 1)[-1]
+        params.append((param, hash_file(value) if os.path.isfile(value) else None))
+
+    return hash_key('ebook-convert', version, _hash_input(input_path),
+                    os.path.splitext(call_params[2])[1].lower(), tuple(params))
+
+
+def _hash_input(input_path: str) -> Optional[str]:
+    """Hashes the input of ebook-convert.
+
+    Args:
+        input_path: The path of the html or package document passed to ebook-convert.
+
+    Returns:
+        The hash of the html document or, for a package document, of the names and contents of
+        all files in its directory.
+    """
+    if not input_path.endswith('.opf'):
+        return hash_file(input_path)
+
+    directory = os.path.dirname(input_path)
+    files = []
+
+    for parent, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            path = os.path.join(parent, file_name)
+            files.append((os.path.relpath(path, directory).replace(os.sep, '/'), hash_file(path)))
+
+    return hash_key(*sorted(files))
+
+
+def _generate_html_content(chapters: Sequence[Chapter],
+                           substitutions: Sequence[Substitution],
+                           cache: Optional[RenderCache],
+                           memory_map: bool = False) -> Generator[str, None, None]:
+    """Generates the html of the chapters one at a time.
+
+    See :meth:`HtmlOutput._iter_html_content`.
+
+    Args:
+        chapters: The list of chapters to be published.
+        substitutions: The list of substitutions.
+        cache: The optional render cache.
+        memory_map: Determines whether chapter files are memory-mapped.
+
+    Yields:
+        The html of each chapter and the separators between them.
+    """
+    fingerprint, cache = _get_substitutions_fingerprint(substitutions, cache)
+    chapter_substitutions = ChapterSubstitutions(substitutions)
+    spooled_chapters = []
+    definitions = []
+
+    with tempfile.TemporaryFile('w+', encoding='utf-8', newline='') as spool:
+        LOG.info('Collecting chapters and applying substitutions ...')
+        for chapter in chapters:
+            key, markdown_ = _substitute_chapter(chapter, chapter_substitutions, fingerprint,
+                                                 cache, memory_map)
+            definitions.append(collect_reference_definitions([markdown_]))
+            spooled_chapters.append((key, spool.tell(), len(markdown_)))
+            spool.write(markdown_)
+
+        definitions = '\n'.join(filter(None, definitions))
+
+        LOG.info('Rendering markdown to html ...')
+        for index, (key, position, length) in enumerate(spooled_chapters):
+            if index:
+                yield HTML_CHAPTER_SEP
+
+            html_key = None
+            html = None
+
+            if cache is not None:
+                html_key = hash_key('html', key, definitions, get_markdown_fingerprint())
+                html = cache.get(html_key)
+
+            if html is None:
+                spool.seek(position)
+                html = render_chapter(spool.read(length), definitions)
+
+                if cache is not None:
+                    cache.put(html_key, html)
+
+            yield html
+
+
+def _get_substitutions_fingerprint(substitutions: Sequence[Substitution],
+                                   cache: Optional[RenderCache]
+                                   ) -> Tuple[Optional[str], Optional[RenderCache]]:
+    """Gets the fingerprint of the substitutions used to key the render cache.
+
+    If the substitutions cannot be fingerprinted, the render cache is disabled.
+
+    Args:
+        substitutions: The list of substitutions.
+        cache: The optional render cache.
+
+    Returns:
+        A tuple of the fingerprint and the render cache, both of which are None if no render
+        cache is used.
+    """
+    if cache is None:
+        return None, None
+
+    fingerprint = fingerprint_substitutions(substitutions)
+
+    if fingerprint is None:
+        LOG.info('Substitutions of unknown type present, render cache disabled ...')
+        return None, None
+
+    return fingerprint, cache
+
+
+def _substitute_chapter(chapter: Chapter,
+                        substitutions: ChapterSubstitutions,
+                        fingerprint: Optional[str],
+                        cache: Optional[RenderCache],
+                        memory_map: bool = False) -> Tuple[Optional[str], str]:
+    """Reads the markdown content of the chapter and applies the substitutions applying to it,
+    taking the result from the render cache if possible.
+
+    If the render cache has a change detector, the chapter file is only read if its
+    substituted markdown is not in the cache.
+
+    Args:
+        chapter: The chapter.
+        substitutions: The substitutions of each chapter.
+        fingerprint: The fingerprint of the list of all substitutions.
+        cache: The optional render cache.
+        memory_map: Determines whether the chapter file is memory-mapped. See
+            :func:`publish.mapped.substitute_buffer`.
+
+    Returns:
+        A tuple of the cache key of the substituted markdown, or None if no render cache is
+        used, and the substituted markdown.
+    """
+    if cache is None:
+        if memory_map:
+            return None, read_substituted(chapter.src, substitutions.get_compiled(chapter))
+
+        return None, _apply_substitutions_to_chapter(read_markdown(chapter),
+                                                     substitutions.get_compiled(chapter))
+
+    selection = substitutions.get_selection(chapter)
+
+    if len(selection) < len(substitutions.substitutions):
+        fingerprint = hash_key(fingerprint, selection)
+
+    digest = cache.detector.get_hash(chapter.src) if cache.detector else None
+    markdown_ = None
+
+    if digest is not None:
+        key = hash_key('markdown', digest, fingerprint)
+        markdown_ = cache.get(key)
+
+        if markdown_ is not None:
+            return key, markdown_
+
+    with _open_chapter(chapter, memory_map) as data:
+        data_digest = hashlib.sha256(data).hexdigest()
+
+        if data_digest != digest:
+            # Either there is no change detector or the chapter changed after it was hashed.
+            key = hash_key('markdown', data_digest, fingerprint)
+            markdown_ = cache.get(key)
+
+        if markdown_ is None:
+            if memory_map:
+                markdown_ = substitute_buffer(data, substitutions.get_compiled(chapter))
+            else:
+                markdown_ = _apply_substitutions_to_chapter(_decode_markdown(data),
+                                                            substitutions.get_compiled(chapter))
+            cache.put(key, markdown_)
+
+    return key, markdown_
+
+
+@contextmanager
+def _open_chapter(chapter: Chapter, memory_map: bool) -> Iterator[Buffer]:
+    """Opens the chapter file for reading its raw content.
+
+    Args:
+        chapter: The chapter.
+        memory_map: Determines whether the chapter file is memory-mapped instead of read.
+
+    Yields:
+        The raw content of the chapter file.
+    """
+    if memory_map:
+        with map_file(chapter.src) as buffer:
+            yield buffer
+        return
+
+    with open(chapter.src, 'rb') as file:
+        yield file.read()
+
+
+def read_markdown(chapter: Chapter) -> str:
+    """Reads the markdown content of the chapter.
+
+    Args:
+        chapter: The chapter.
+
+    Returns:
+        The markdown content.
+    """
+    with open(chapter.src, 'r') as file:
+        return file.read()
+
+
+def _apply_substitutions_to_chapter(text: str,
+                                    substitutions: Iterable[Substitution]) -> str:
+    """Applies the list of substitutions to the markdown content of a single chapter.
+
+    Unlike :func:`publish.substitution.apply_substitutions` this does not log each applied
+    substitution, which would log the same messages once per chapter.
+
+    Args:
+        text: The markdown content of the chapter.
+        substitutions: The list of substitutions.
+
+    Returns:
+        The changed markdown content.
+    """
+    for substitution in substitutions:
+        text = substitution.apply_to(text)
+
+    return text
+
+
+def _decode_markdown(data: bytes) -> str:
+    """Decodes the raw content of a chapter file the same way :func:`read_markdown` reads
+    it, using the default encoding and universal newlines.
+
+    Args:
+        data: The raw content of the chapter file.
+
+    Returns:
+        The markdown content.
+    """
+    return io.TextIOWrapper(io.BytesIO(data)).read()
+
 
 def _get_ebook_convert_params(book: Book,
                               input_path: str,
@@ -333,7 +1086,8 @@ def _get_ebook_convert_params(book: Book,
 def _apply_template(html_content: str,
                     title: str,
                     css: str,
-                    language: str) -> str:
+                    language: str,
+                    template: Optional[str] = None) -> str:
     """Renders the html content, title, css and document language into the jinja2 formatted
     template and returns the resulting html document.
 
@@ -342,25 +1096,68 @@ def _apply_template(html_content: str,
         title: The title gets inserted into the {{ title }} of the template.
         css: The css gets inserted into the {{ css }} of the template.
         language: The language gets inserted into the {{ language }} of the template.
+        template: The path to the template. Defaults to the bundled template.
 
     Returns:
         The html document.
     """
-    template = resource_string(__name__, 'template.jinja') \
-        .decode('utf-8') \
-        .replace('\r\n', '\n')
-    # resource_string opens the file as bytes, which means that we
-    # have to decode to utf-8. The replace is necessary because
-    # resource_string, instead of open, does not automatically
-    # strip \r\n down to \n on windows systems. Leaving \r\n as is
-    # would produce double line breaks when writing the resulting string
-    # back to disc, thus we have to do the replacement ourselves, too.
-
-    return Template(template).render(content=html_content,
-                                     title=title,
-                                     css=css,
-                                     language=language,
-                                     package_version=package_version)
+    return get_template(template).render(content=_Content([html_content]),
+                                         title=title,
+                                         css=css,
+                                         language=language,
+                                         package_version=package_version)
+
+
+def _stream_template(html_content: Iterable[str],
+                     title: str,
+                     css: str,
+                     language: str,
+                     template: Optional[str] = None) -> Iterator[str]:
+    """Renders the html content, title, css and document language into the jinja2 formatted
+    template piece by piece, consuming the html content only as the document is iterated.
+
+    Args:
+        html_content: The pieces of html content that get inserted into the {{ content }} of
+            the template. Only a template iterating over the content, as the bundled template
+            does, streams it piece by piece.
+        title: The title gets inserted into the {{ title }} of the template.
+        css: The css gets inserted into the {{ css }} of the template.
+        language: The language gets inserted into the {{ language }} of the template.
+        template: The path to the template. Defaults to the bundled template.
+
+    Returns:
+        An iterator over the pieces of the html document.
+    """
+    return get_template(template).generate(content=_Content(html_content),
+                                           title=title,
+                                           css=css,
+                                           language=language,
+                                           package_version=package_version)
+
+
+class _Content:
+    """The html content passed to templates as `content`.
+
+    Iterating over the content yields its pieces one at a time, which is how the bundled
+    template streams it. Inserting the content as a whole with {{ content }} joins its pieces.
+
+    Args:
+        pieces: The pieces of html content.
+    """
+
+    def __init__(self, pieces: Iterable[str]):
+        """Initializes a new instance of the :class:`_Content` class.
+        """
+        self.__pieces = pieces
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__pieces)
+
+    def __str__(self) -> str:
+        return ''.join(self.__pieces)
+
+    def __html__(self) -> str:
+        return str(self)
 
 
 def _yield_attributes_as_params(object_) -> Generator[str, None, None]:
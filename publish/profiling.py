@@ -0,0 +1,583 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""This module offers the substitution profiler, which measures how much time each substitution
+of a project takes, how often it matches and how many bytes it changes, in total and per
+chapter.
+
+The profiler also probes each regex substitution with long lines of growing length and flags
+those whose runtime grows faster than the length of the line, a telltale sign of catastrophic
+backtracking. The probes run in a separate worker process, so that a pattern that never
+finishes can be stopped. The same worker probes one substitution after another and is only
+replaced once it had to be stopped.
+
+The plan the substitutions are compiled into, and the passes saved by fusing and batching them,
+can be explained as well.
+"""
+
+import logging
+import math
+import multiprocessing
+import re
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from publish.book import Book, Chapter
+from publish.output import HtmlOutput, read_markdown
+from publish.substitution import (Substitution, SimpleSubstitution, RegexSubstitution,
+                                  TranslateSubstitution, SimpleSubstitutionSet, FusedSubstitution,
+                                  compile_substitutions)
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(logging.NullHandler())
+
+PROBE_TIMEOUT = 5.0
+"""The default number of seconds after which probing a single regex substitution is stopped."""
+
+PROBE_SIZES = (512, 1024, 2048, 4096)
+"""The lengths of the lines each regex substitution is probed with."""
+
+SUPERLINEAR_EXPONENT = 1.5
+"""The growth exponent of the runtime above which a regex substitution is flagged."""
+
+_MIN_PROBE_SECONDS = 0.001
+"""Probes faster than this on the longest line are too noisy to tell linear from superlinear
+growth apart."""
+
+_MAX_PROBE_CHARACTERS = 16
+"""The maximum number of characters taken from a pattern to build probe lines from."""
+
+
+class SubstitutionStats:
+    """The SubstitutionStats sum up the applications of a substitution.
+
+    Attributes:
+        seconds (float): The wall time spent applying the substitution in seconds.
+        matches (int): The number of matches or None if the substitution type doesn't tell.
+        bytes_changed (int): The number of utf-8 encoded bytes of matched text that were
+            replaced by something different or None if the substitution type doesn't tell.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        """Initializes a new instance of the :class:`SubstitutionStats` class.
+        """
+        self.seconds = 0.0
+        self.matches: Optional[int] = 0
+        self.bytes_changed: Optional[int] = 0
+
+    def add(self, seconds: float, matches: Optional[int], bytes_changed: Optional[int]):
+        """Adds a single application of the substitution to the stats.
+
+        Args:
+            seconds: The wall time of the application in seconds.
+            matches: The number of matches or None if unknown.
+            bytes_changed: The number of bytes changed or None if unknown.
+        """
+        self.seconds += seconds
+        self.matches = None if matches is None or self.matches is None \
+            else self.matches + matches
+        self.bytes_changed = None if bytes_changed is None or self.bytes_changed is None \
+            else self.bytes_changed + bytes_changed
+
+
+class SubstitutionProfile:
+    """The SubstitutionProfile holds the measurements of a single substitution.
+
+    Args:
+        index: The position of the substitution in the list of substitutions, starting at 1.
+        substitution: The substitution.
+
+    Attributes:
+        index (int): The position of the substitution in the list of substitutions.
+        substitution (Substitution): The substitution.
+        total (SubstitutionStats): The stats over all chapters.
+        chapters (Dict[str, SubstitutionStats]): The stats by chapter source.
+        warning (str): A description of the superlinear runtime growth of the substitution or
+            None.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, index: int, substitution: Substitution):
+        """Initializes a new instance of the :class:`SubstitutionProfile` class.
+        """
+        self.index = index
+        self.substitution = substitution
+        self.total = SubstitutionStats()
+        self.chapters: Dict[str, SubstitutionStats] = {}
+        self.warning: Optional[str] = None
+
+
+def profile_substitutions(book: Book,
+                          substitutions: Iterable[Substitution],
+                          probe_timeout: Optional[float] = PROBE_TIMEOUT,
+                          outputs: Optional[Iterable[HtmlOutput]] = None
+                          ) -> List[SubstitutionProfile]:
+    """Applies the substitutions to each chapter of the book one after another, measuring each
+    substitution on its own.
+
+    Unlike a build, the substitutions are not compiled, so that each of them is measured
+    separately. Substitutions are only applied to the chapters their selectors select.
+
+    Only the chapters published by any of the outputs are profiled, read the same way the
+    outputs read them.
+
+    Args:
+        book: The book.
+        substitutions: The list of substitutions.
+        probe_timeout: The number of seconds after which probing a regex substitution for
+            superlinear runtime growth is stopped. If None, regex substitutions are not probed.
+        outputs: The outputs of the book. If None, the chapters published by default are
+            profiled, i.e. those whose `publish` attribute is set.
+
+    Returns:
+        The profile of each substitution, in the order of the substitutions.
+    """
+    profiles = [SubstitutionProfile(index, substitution)
+                for index, substitution in enumerate(substitutions, start=1)]
+    longest_line = ''
+
+    for chapter in _get_published_chapters(book, outputs):
+        text = read_markdown(chapter)
+        longest_line = max(text.splitlines() + [longest_line], key=len)
+
+        for profile in profiles:
+            if not profile.substitution.applies_to(chapter):
+                continue
+
+            text, seconds, matches, bytes_changed = measure_substitution(profile.substitution,
+                                                                         text)
+            profile.total.add(seconds, matches, bytes_changed)
+            profile.chapters.setdefault(chapter.src, SubstitutionStats()) \
+                .add(seconds, matches, bytes_changed)
+
+    if probe_timeout is not None:
+        _probe_regex_substitutions(profiles, longest_line, probe_timeout)
+
+    return profiles
+
+
+def measure_substitution(substitution: Substitution,
+                         text: str) -> Tuple[str, float, Optional[int], Optional[int]]:
+    """Applies the substitution to the text, measuring its wall time, matches and changed bytes.
+
+    Only the application itself is timed. Matches and changed bytes are counted separately.
+
+    Args:
+        substitution: The substitution.
+        text: The text.
+
+    Returns:
+        A tuple of the changed text, the wall time in seconds, the number of matches and the
+        number of bytes changed. The latter two are None for substitution types that don't
+        tell.
+    """
+    measure = _MEASURES.get(type(substitution), _measure_substitution)
+
+    return measure(substitution, text)
+
+
+def format_profile(profiles: Sequence[SubstitutionProfile], top: int = 5) -> List[str]:
+    """Formats the profiles as a report, the slowest substitutions first.
+
+    Args:
+        profiles: The profiles of the substitutions.
+        top: The number of substitutions listed for each chapter.
+
+    Returns:
+        The lines of the report.
+    """
+    lines = ['Substitution profile, slowest first:',
+             f'  {"#":>4}  {"seconds":>9}  {"matches":>9}  {"bytes changed":>13}  substitution']
+    ranked = sorted(profiles, key=lambda p: p.total.seconds, reverse=True)
+
+    for profile in ranked:
+        lines.append(_format_stats(profile.index, profile.total) +
+                     f'  {describe_substitution(profile.substitution)}')
+
+    chapters = {chapter for profile in profiles for chapter in profile.chapters}
+
+    for chapter in sorted(chapters):
+        lines.append(f'{chapter}:')
+        for profile in sorted((profile for profile in profiles if chapter in profile.chapters),
+                              key=lambda p, c=chapter: p.chapters[c].seconds,
+                              reverse=True)[:top]:
+            lines.append(_format_stats(profile.index, profile.chapters[chapter]))
+
+    warnings = [profile for profile in profiles if profile.warning]
+
+    if warnings:
+        lines.append('Possible catastrophic backtracking:')
+        for profile in warnings:
+            lines.append(f'  {profile.index:>4}  {describe_substitution(profile.substitution)}: '
+                         f'{profile.warning}')
+
+    return lines
+
+
+def explain_plan(substitutions: Iterable[Substitution]) -> List[str]:
+    """Explains the plan the substitutions are compiled into by
+    :func:`publish.substitution.compile_substitutions`: the passes over each chapter, the
+    substitutions applied by each of them and the number of passes saved.
+
+    The selectors of the substitutions are ignored, chapters selecting only some substitutions
+    get a plan of their own.
+
+    Args:
+        substitutions: The list of substitutions.
+
+    Returns:
+        The lines of the explanation.
+    """
+    substitutions = list(substitutions)
+    numbers = {id(substitution): number
+               for number, substitution in enumerate(substitutions, start=1)}
+    plan = compile_substitutions(substitutions)
+    lines = ['Substitution plan:']
+
+    for number, step in enumerate(plan, start=1):
+        if isinstance(step, FusedSubstitution):
+            lines.append(f'  pass {number}: fused alternation of {len(step.substitutions)} '
+                         f'substitutions')
+        elif isinstance(step, SimpleSubstitutionSet):
+            lines.append(f'  pass {number}: simple substitution set of '
+                         f'{len(step.substitutions)} substitutions')
+        else:
+            lines.append(f'  pass {number}:')
+
+        for substitution in getattr(step, 'substitutions', [step]):
+            lines.append(f'    {numbers[id(substitution)]:>4}  '
+                         f'{describe_substitution(substitution)}')
+
+    saved = len(substitutions) - len(plan)
+    lines.append(f'{len(substitutions)} substitutions in {len(plan)} passes, '
+                 f'{saved} passes saved')
+
+    return lines
+
+
+def describe_substitution(substitution: Substitution) -> str:
+    """Describes the substitution in a single line.
+
+    Args:
+        substitution: The substitution.
+
+    Returns:
+        The description.
+    """
+    if isinstance(substitution, SimpleSubstitution):
+        return f'{substitution.old!r} -> {substitution.new!r}'
+
+    if isinstance(substitution, RegexSubstitution):
+        return f'/{substitution.regular_expression.pattern}/ -> {substitution.replace_with!r}'
+
+    if isinstance(substitution, TranslateSubstitution):
+        return f'translate {substitution.mapping!r}'
+
+    return type(substitution).__name__
+
+
+class ProbeWorker:
+    """The ProbeWorker runs probes in a single worker process, which is started on the first
+    probe and kept for the following ones. Only a worker that had to be killed because a probe
+    took too long is replaced.
+    """
+
+    def __init__(self):
+        """Initializes a new instance of the :class:`ProbeWorker` class.
+        """
+        self.__pool: Optional[Any] = None
+
+    def run(self, function: Callable[..., Any], args: Tuple, timeout: float) -> Any:
+        """Calls the function with args in the worker process.
+
+        Args:
+            function: The function. It must be importable by the worker process.
+            args: The arguments.
+            timeout: The number of seconds after which the worker process is killed.
+
+        Returns:
+            The return value of the function.
+
+        Raises:
+            multiprocessing.TimeoutError: If the function didn't return in time.
+        """
+        if self.__pool is None:
+            self.__pool = multiprocessing.Pool(1)  # pylint: disable=consider-using-with
+
+        try:
+            return self.__pool.apply_async(function, args).get(timeout)
+        except multiprocessing.TimeoutError:
+            self.close()
+            raise
+
+    def close(self):
+        """Kills the worker process, if it was started.
+        """
+        if self.__pool is not None:
+            self.__pool.terminate()
+            self.__pool.join()
+            self.__pool = None
+
+
+def probe_regular_expression(regular_expression: 're.Pattern',
+                             replace_with: str,
+                             lines: Sequence[Tuple[str, str]],
+                             timeout: float,
+                             worker: Optional[ProbeWorker] = None) -> Optional[str]:
+    """Probes the regular expression for superlinear runtime growth on each kind of line.
+
+    Each line is repeated to each of the :data:`PROBE_SIZES` and substituted in a worker
+    process, which is killed if it takes longer than the timeout.
+
+    Args:
+        regular_expression: The compiled regular expression.
+        replace_with: The replacement string.
+        lines: A tuple of the text to repeat and the text to end with for each kind of line.
+        timeout: The number of seconds after which probing is stopped.
+        worker: The worker to probe in. If None, a worker is started for this probe only.
+
+    Returns:
+        A description of the superlinear runtime growth or None if there is none.
+    """
+    own_worker = worker is None
+    worker = worker or ProbeWorker()
+
+    try:
+        timings = worker.run(_time_probes, (regular_expression, replace_with, lines), timeout)
+    except multiprocessing.TimeoutError:
+        return (f'did not finish within {timeout:g} seconds on lines of up to '
+                f'{PROBE_SIZES[-1]} characters')
+    finally:
+        if own_worker:
+            worker.close()
+
+    worst = max(timings, key=lambda timing: timing[1])
+    line, exponent, seconds = worst
+
+    if exponent <= SUPERLINEAR_EXPONENT:
+        return None
+
+    return (f'runtime grows with length^{exponent:.1f}, {seconds:.3f} s on a line of '
+            f'{PROBE_SIZES[-1]} characters like {line[:20]!r}')
+
+
+def _probe_regex_substitutions(profiles: Sequence[SubstitutionProfile],
+                               longest_line: str,
+                               timeout: float):
+    """Probes the regex substitutions among the profiles, storing a warning in the profile of
+    each regex substitution whose runtime grows superlinearly.
+
+    Args:
+        profiles: The profiles.
+        longest_line: The longest line of the book.
+        timeout: The number of seconds after which probing a single substitution is stopped.
+    """
+    worker = ProbeWorker()
+
+    try:
+        for profile in profiles:
+            substitution = profile.substitution
+
+            if not isinstance(substitution, RegexSubstitution):
+                continue
+
+            LOG.info(f'Probing substitution {profile.index} for catastrophic backtracking ...')
+            profile.warning = probe_regular_expression(
+                substitution.regular_expression,
+                substitution.replace_with,
+                _get_probe_lines(substitution.regular_expression.pattern, longest_line),
+                timeout,
+                worker)
+    finally:
+        worker.close()
+
+
+def _get_published_chapters(book: Book,
+                            outputs: Optional[Iterable[HtmlOutput]]) -> List[Chapter]:
+    """Gets the chapters of the book published by any of the outputs, in the order of the book.
+
+    Args:
+        book: The book.
+        outputs: The outputs. If None, the chapters published by default are returned.
+
+    Returns:
+        The chapters.
+    """
+    if outputs is None:
+        outputs = [HtmlOutput('')]
+
+    published = {id(chapter)
+                 for output in outputs
+                 for chapter in output.get_chapters_to_be_published(book.chapters)}
+
+    return [chapter for chapter in book.chapters if id(chapter) in published]
+
+
+def _get_probe_lines(pattern: str, longest_line: str) -> List[Tuple[str, str]]:
+    """Gets the kinds of lines to probe a pattern with: the longest line of the book and lines
+    repeating a single character of the pattern, with and without a trailing character that
+    keeps most patterns from matching at the end of the line.
+
+    Args:
+        pattern: The pattern.
+        longest_line: The longest line of the book.
+
+    Returns:
+        A tuple of the text to repeat and the text to end with for each kind of line.
+    """
+    characters = sorted({char for char in str(pattern) if char.isprintable()} | {'a', ' '})
+    lines = [(longest_line, '')] if longest_line.strip() else []
+
+    for char in characters[:_MAX_PROBE_CHARACTERS]:
+        lines.append((char, ''))
+        lines.append((char, '\0'))
+
+    return lines
+
+
+def _time_probes(regular_expression: 're.Pattern',
+                 replace_with: str,
+                 lines: Sequence[Tuple[str, str]]) -> List[Tuple[str, float, float]]:
+    """Times the substitution of each kind of line at each of the probe sizes.
+
+    Runs in the probing process.
+
+    Args:
+        regular_expression: The compiled regular expression.
+        replace_with: The replacement string.
+        lines: A tuple of the text to repeat and the text to end with for each kind of line.
+
+    Returns:
+        A tuple of the line, the growth exponent of the runtime and the runtime on the longest
+        probe for each kind of line.
+    """
+    timings = []
+
+    for body, tail in lines:
+        seconds = []
+
+        for size in PROBE_SIZES:
+            text = (body * (size // len(body) + 1))[:size - len(tail)] + tail
+            seconds.append(min(_time(lambda t=text: regular_expression.sub(replace_with, t))
+                               for _ in range(3)))
+
+        if seconds[-1] < _MIN_PROBE_SECONDS or seconds[0] <= 0:
+            exponent = 1.0
+        else:
+            exponent = math.log(seconds[-1] / seconds[0]) / \
+                math.log(PROBE_SIZES[-1] / PROBE_SIZES[0])
+
+        timings.append((body[:20] + tail, exponent, seconds[-1]))
+
+    return timings
+
+
+def _time(function: Callable[[], object]) -> float:
+    """Times a call of the function.
+
+    Args:
+        function: The function.
+
+    Returns:
+        The wall time of the call in seconds.
+    """
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def _measure_simple_substitution(substitution: SimpleSubstitution,
+                                 text: str) -> Tuple[str, float, Optional[int], Optional[int]]:
+    """Measures a simple substitution. See :func:`measure_substitution`."""
+    start = time.perf_counter()
+    changed = text.replace(substitution.old, substitution.new)
+    seconds = time.perf_counter() - start
+
+    matches = text.count(substitution.old)
+    bytes_changed = 0
+
+    if substitution.old != substitution.new:
+        bytes_changed = matches * len(substitution.old.encode('utf-8'))
+
+    return changed, seconds, matches, bytes_changed
+
+
+def _measure_regex_substitution(substitution: RegexSubstitution,
+                                text: str) -> Tuple[str, float, Optional[int], Optional[int]]:
+    """Measures a regex substitution. See :func:`measure_substitution`."""
+    start = time.perf_counter()
+    if substitution.may_match(text):
+        changed, matches = substitution.regular_expression.subn(substitution.replace_with, text)
+    else:
+        changed, matches = text, 0
+    seconds = time.perf_counter() - start
+
+    bytes_changed = 0
+
+    if matches:
+        for match in substitution.regular_expression.finditer(text):
+            if match.expand(substitution.replace_with) != match.group(0):
+                bytes_changed += len(match.group(0).encode('utf-8'))
+
+    return changed, seconds, matches, bytes_changed
+
+
+def _measure_translate_substitution(substitution: TranslateSubstitution,
+                                    text: str) -> Tuple[str, float, Optional[int], Optional[int]]:
+    """Measures a translate substitution. See :func:`measure_substitution`."""
+    start = time.perf_counter()
+    changed = substitution.apply_to(text)
+    seconds = time.perf_counter() - start
+
+    matches = 0
+    bytes_changed = 0
+
+    for old, new in substitution.mapping.items():
+        count = text.count(old)
+        matches += count
+        if old != new:
+            bytes_changed += count * len(old.encode('utf-8'))
+
+    return changed, seconds, matches, bytes_changed
+
+
+def _measure_substitution(substitution: Substitution,
+                          text: str) -> Tuple[str, float, Optional[int], Optional[int]]:
+    """Measures a substitution of unknown type. See :func:`measure_substitution`."""
+    start = time.perf_counter()
+    changed = substitution.apply_to(text)
+    seconds = time.perf_counter() - start
+
+    return changed, seconds, None, None
+
+
+def _format_stats(index: int, stats: SubstitutionStats) -> str:
+    """Formats the stats of the substitution at index as a row of the report.
+
+    Args:
+        index: The position of the substitution.
+        stats: The stats.
+
+    Returns:
+        The row.
+    """
+    matches = '?' if stats.matches is None else stats.matches
+    bytes_changed = '?' if stats.bytes_changed is None else stats.bytes_changed
+
+    return f'  {index:>4}  {stats.seconds:>9.4f}  {matches:>9}  {bytes_changed:>13}'
+
+
+_MEASURES: Dict[type, Callable[..., Tuple[str, float, Optional[int], Optional[int]]]] = {
+    SimpleSubstitution: _measure_simple_substitution,
+    RegexSubstitution: _measure_regex_substitution,
+    TranslateSubstitution: _measure_translate_substitution,
+}
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""This module renders the markdown content of a book to html, either as one single document or
+chapter by chapter.
+
+Rendering chapter by chapter allows the chapters to be spread across several processes. To make
+sure the reference-style links of a chapter resolve the same way they would as part of the
+whole book, the link reference definitions of all chapters are collected up front and handed to
+every chapter. Markdown extensions that depend on other parts of the document, such as
+footnotes or abbreviations, are not covered by this and have to be rendered as one single
+document.
+
+The markdown package and multiprocessing are only imported once something is rendered, so that
+builds taking every chapter from the render cache don't pay for importing them.
+"""
+
+import logging
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(logging.NullHandler())
+
+REFERENCE_DEFINITION = re.compile(
+    r'^[ ]{0,3}\[[^\[\]]+\]:[ ]*(?:\n[ ]*)?\S+[ ]*'
+    r'(?:(?:\n[ ]*)?(?:"[^\n]*"|\'[^\n]*\'|\([^\n]*\))[ ]*)?$',
+    re.MULTILINE)
+"""Matches markdown link reference definitions, i.e. ``[id]: http://example.com "Title"``."""
+
+MD_PARAGRAPH_SEP = '\n\n'
+HTML_CHAPTER_SEP = '\n'
+
+MARKDOWN_EXTENSIONS: List[str] = []
+"""The markdown extensions used to render markdown to html."""
+
+MARKDOWN_EXTENSION_CONFIGS: Dict[str, Dict[str, Any]] = {}
+"""The configuration of the markdown extensions."""
+
+
+def get_markdown_fingerprint() -> tuple:
+    """Gets the version of the markdown package and the extension configuration used to render
+    markdown to html.
+
+    Everything rendered by :func:`render_markdown` depends on this fingerprint in addition to
+    the markdown text itself.
+
+    Returns:
+        The fingerprint.
+    """
+    import markdown  # pylint: disable=import-outside-toplevel
+
+    return (markdown.__version__,
+            tuple(MARKDOWN_EXTENSIONS),
+            repr(sorted(MARKDOWN_EXTENSION_CONFIGS.items())))
+
+
+def render_markdown(text: str) -> str:
+    """Renders the markdown text to html.
+
+    Args:
+        text: The markdown text.
+
+    Returns:
+        The html.
+    """
+    import markdown  # pylint: disable=import-outside-toplevel
+
+    return markdown.markdown(text,
+                             extensions=MARKDOWN_EXTENSIONS,
+                             extension_configs=MARKDOWN_EXTENSION_CONFIGS)
+
+
+def collect_reference_definitions(texts: Iterable[str]) -> str:
+    """Collects the link reference definitions of all markdown texts.
+
+    The order of the definitions is preserved, so a definition that is overridden by a later
+    definition of the same id in the whole book is overridden in the same way when the
+    collected definitions are appended to a single chapter.
+
+    Args:
+        texts: The markdown texts.
+
+    Returns:
+        The reference definitions, one per line, or an empty string if there are none.
+    """
+    definitions = []
+
+    for text in texts:
+        definitions.extend(match.group(0).strip()
+                           for match in REFERENCE_DEFINITION.finditer(text))
+
+    return '\n'.join(definitions)
+
+
+def render_chapter(text: str, definitions: str = '') -> str:
+    """Renders the markdown text of a single chapter to html, making the reference definitions
+    of the whole book available to it.
+
+    Args:
+        text: The markdown text of the chapter.
+        definitions: The reference definitions of the whole book as returned by
+            :func:`collect_reference_definitions`.
+
+    Returns:
+        The html of the chapter.
+    """
+    if definitions:
+        text = MD_PARAGRAPH_SEP.join((text, definitions))
+
+    return render_markdown(text)
+
+
+def render_chapters(texts: Sequence[str],
+                    jobs: int = 1,
+                    definitions: Optional[str] = None) -> List[str]:
+    """Renders the markdown texts of a list of chapters to html chapter by chapter.
+
+    The link reference definitions of all chapters are made available to every chapter, so
+    reference-style links defined in one chapter and used in another resolve the same way they
+    would if the chapters were rendered as one single document.
+
+    Args:
+        texts: The markdown texts of the chapters.
+        jobs: The number of processes used to render the chapters. If jobs is 1 or less, the
+            chapters are rendered in the current process.
+        definitions: The reference definitions of the whole book as returned by
+            :func:`collect_reference_definitions`. Only required if the texts are not all
+            chapters of the book. Collected from the texts if omitted.
+
+    Returns:
+        The html of each chapter, in the same order as the markdown texts.
+    """
+    if definitions is None:
+        definitions = collect_reference_definitions(texts)
+
+    if definitions:
+        texts = [MD_PARAGRAPH_SEP.join((text, definitions)) for text in texts]
+
+    if not texts:
+        return []
+
+    if jobs <= 1 or len(texts) <= 1:
+        return [render_markdown(text) for text in texts]
+
+    # Importing ProcessPoolExecutor imports multiprocessing.
+    from concurrent.futures import ProcessPoolExecutor  # pylint: disable=import-outside-toplevel
+
+    LOG.info(f'Rendering {len(texts)} chapters using {jobs} processes ...')
+    chunksize = max(1, len(texts) // (jobs * 4))
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(render_markdown, texts, chunksize=chunksize))
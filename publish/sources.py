@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""This module finds the chapter files matching the glob patterns chapters can be given as.
+
+Patterns are matched one directory at a time, so only the directories a pattern can reach are
+listed. `*`, `?` and `[...]` match within a single file or directory name and `**` matches any
+number of directories. As with :mod:`glob`, wildcards don't match names starting with a dot.
+
+The files found are sorted in natural order, so `chapter 2.md` comes before `chapter 10.md`.
+"""
+
+import logging
+import os
+import re
+from fnmatch import fnmatch, filter as fnmatch_filter
+from typing import (TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional,
+                    Tuple)
+
+from publish.changes import Listing, list_directory
+
+if TYPE_CHECKING:  # pragma: no cover
+    from publish.changes import ChangeDetector  # noqa: F401 pylint: disable=cyclic-import
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(logging.NullHandler())
+
+DEFAULT_DIRECTORY_PATTERN = '**/*.md'
+"""The pattern of the chapter files in a directory, relative to that directory."""
+
+_MAGIC = re.compile(r'[*?[]')
+_DIGITS = re.compile(r'([0-9]+)')
+_SEPARATORS = re.compile(r'[\\/]')
+
+
+def is_pattern(path: str) -> bool:
+    """Tells whether the path is a glob pattern.
+
+    Args:
+        path: The path.
+
+    Returns:
+        True if the path contains `*`, `?` or `[`, otherwise False.
+    """
+    return _MAGIC.search(path) is not None
+
+
+def find_files(pattern: str,
+               exclude: Iterable[str] = (),
+               detector: Optional['ChangeDetector'] = None) -> List[str]:
+    """Finds the files matching the glob pattern, sorted in natural order.
+
+    Args:
+        pattern: The glob pattern. A path without wildcards matches itself, if the file exists.
+        exclude: The paths or glob patterns of the files to leave out. As with
+            :class:`publish.book.ChapterSelector`, `*` also matches path separators here.
+        detector: The optional change detector, whose directory listings are used instead of
+            listing each directory again.
+
+    Returns:
+        The paths of the files, starting with the part of the pattern without wildcards.
+    """
+    base, parts = _split_pattern(pattern)
+
+    if not parts:
+        return [pattern] if os.path.isfile(pattern) else []
+
+    excluded = [os.path.normpath(path) for path in exclude]
+    paths = [path for path in dict.fromkeys(_glob(base, parts, _get_lister(detector, {})))
+             if not any(fnmatch(os.path.normpath(path), excluded_pattern)
+                        for excluded_pattern in excluded)]
+
+    return sorted(paths, key=natural_sort_key)
+
+
+def find_directories(pattern: str, detector: Optional['ChangeDetector'] = None) -> List[str]:
+    """Finds the directories whose content determines the files matching the glob pattern.
+
+    A file added to or removed from any of these directories may change the files found by
+    :func:`find_files`. If the part of the pattern without wildcards names a directory that
+    doesn't exist yet, its closest existing parent directory is returned instead.
+
+    Args:
+        pattern: The glob pattern.
+        detector: The optional change detector, whose directory listings are used instead of
+            listing each directory again.
+
+    Returns:
+        The paths of the directories, starting with the part of the pattern without wildcards,
+        or an empty list if the pattern has no wildcards.
+    """
+    base, parts = _split_pattern(pattern)
+
+    if not parts:
+        return []
+
+    if not os.path.isdir(base or os.curdir):
+        missing = base
+
+        while missing and not os.path.isdir(missing):
+            parent = os.path.dirname(missing)
+            missing = parent if parent != missing else ''
+
+        return [missing or os.curdir]
+
+    listings: Dict[str, Listing] = {}
+
+    for _ in _glob(base, parts, _get_lister(detector, listings)):
+        pass
+
+    return [directory or os.curdir for directory in listings]
+
+
+def natural_sort_key(path: str) -> Tuple[Any, ...]:
+    """Gets the key sorting paths in natural order: directory by directory, ignoring case and
+    comparing numbers by their value.
+
+    Args:
+        path: The path.
+
+    Returns:
+        The sort key.
+    """
+    return (tuple(tuple(int(part) if index % 2 else part.casefold()
+                        for index, part in enumerate(_DIGITS.split(name)))
+                  for name in _SEPARATORS.split(path)),
+            path)
+
+
+def _split_pattern(pattern: str) -> Tuple[str, List[str]]:
+    """Splits a glob pattern into the directory without wildcards it starts at and the parts
+    matched one directory at a time.
+
+    Args:
+        pattern: The glob pattern.
+
+    Returns:
+        A tuple of the directory, an empty string for the current directory, and the parts. The
+        parts are empty if the pattern has no wildcards.
+    """
+    parts = os.path.normpath(pattern).replace(os.sep, '/').split('/')
+    static = next((index for index, part in enumerate(parts) if is_pattern(part)), len(parts))
+
+    if static == len(parts):
+        return pattern, []
+
+    base = '/'.join(parts[:static]) if parts[:static] != [''] else '/'
+    parts = parts[static:]
+
+    if parts[-1] == '**':
+        parts.append('*')
+
+    return base, parts
+
+
+def _get_lister(detector: Optional['ChangeDetector'],
+                listings: Dict[str, Listing]) -> Callable[[str], Listing]:
+    """Gets the function listing the directories visited by :func:`_glob`, each of them once.
+
+    Args:
+        detector: The optional change detector, whose directory listings are used instead of
+            listing each directory again.
+        listings: The listings by directory, filled in as directories are listed.
+
+    Returns:
+        The function.
+    """
+    def list_(directory: str) -> Listing:
+        if directory not in listings:
+            directory_path = directory or os.curdir
+            listings[directory] = detector.list_directory(directory_path) if detector \
+                else list_directory(directory_path)
+        return listings[directory]
+
+    return list_
+
+
+def _glob(directory: str,
+          parts: List[str],
+          list_: Callable[[str], Listing]) -> Iterator[str]:
+    """Finds the files below directory matching the parts of a glob pattern.
+
+    Args:
+        directory: The path of the directory or an empty string for the current directory.
+        parts: The names, patterns or `**` making up the rest of the glob pattern.
+        list_: Gets the names of the files and of the subdirectories in a directory.
+
+    Yields:
+        The paths of the matching files.
+    """
+    part, rest = parts[0], parts[1:]
+    files, directories = list_(directory)
+
+    if part == '**':
+        yield from _glob(directory, rest, list_)
+
+        for name in directories:
+            if not name.startswith('.'):
+                yield from _glob(os.path.join(directory, name), parts, list_)
+    elif rest:
+        for name in _match(directories, part):
+            yield from _glob(os.path.join(directory, name), rest, list_)
+    else:
+        for name in _match(files, part):
+            yield os.path.join(directory, name)
+
+
+def _match(names: List[str], part: str) -> List[str]:
+    """Gets the names matching a part of a glob pattern.
+
+    Args:
+        names: The names of the entries of a directory.
+        part: The name or pattern.
+
+    Returns:
+        The matching names. Names starting with a dot only match parts starting with a dot.
+    """
+    if not is_pattern(part):
+        return [name for name in names if name == part]
+
+    return [name for name in fnmatch_filter(names, part)
+            if not name.startswith('.') or part.startswith('.')]
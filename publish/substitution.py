@@ -14,14 +14,46 @@ rendered to html or epub.
 
 # pylint: disable=too-few-public-methods,anomalous-backslash-in-string
 
-import logging.config
+import logging
 import re
 from abc import ABCMeta, abstractmethod
-from typing import Iterable, Union
+from bisect import bisect_right
+from itertools import accumulate
+from typing import (Dict, FrozenSet, Iterable, Iterator, List, Mapping, Optional, Set, Tuple,
+                    Union)
+
+from publish.book import Chapter, ChapterSelector
+
+try:
+    from re import _parser as sre_parse  # type: ignore
+except ImportError:  # pragma: no cover
+    import sre_parse  # Python < 3.11
 
 LOG = logging.getLogger(__name__)
 LOG.addHandler(logging.NullHandler())
 
+MAX_COMPILED_LENGTH = 100
+"""The maximum length of the old and new strings of simple substitutions that are compiled
+into a :class:`SimpleSubstitutionSet`. Longer ones are applied on their own."""
+
+MAX_REQUIRED_LITERALS = 8
+"""The maximum number of alternative literals a :class:`RegexSubstitution` checks for before
+running its regular expression."""
+
+MAX_REORDERED = 16
+"""The maximum number of substitutions a substitution is moved ahead of to fuse it with earlier
+ones into a :class:`FusedSubstitution`."""
+
+MAX_FUSED_ALPHABET = 1024
+"""The maximum number of distinct characters the pattern of a substitution may match, including
+the characters its lookarounds check, for it to be fused into a :class:`FusedSubstitution`."""
+
+FusionAnalysis = Tuple[FrozenSet[str], FrozenSet[str], bool, Optional[FrozenSet[str]]]
+"""The analysis of a regex substitution needed to fuse it with others: the characters its
+pattern can match or check, the characters its replacement can insert, whether the replacement
+is never empty and the characters every match starts with, or None if the pattern starts with a
+literal. See :func:`fuse_substitutions`."""
+
 
 class Substitution(metaclass=ABCMeta):
     """The Substitution class acts as an abstract interface for future
@@ -29,8 +61,25 @@ class Substitution(metaclass=ABCMeta):
 
     In order for a substitution to be executable by an output class,
     it must offer the apply_to method described below.
+
+    Attributes:
+        selector (ChapterSelector): The selector of the chapters the substitution applies to.
+            If None, the substitution applies to all chapters.
     """
 
+    selector: Optional[ChapterSelector] = None
+
+    def applies_to(self, chapter: Chapter) -> bool:
+        """Tells whether the substitution applies to the chapter.
+
+        Args:
+            chapter: The chapter.
+
+        Returns:
+            True if the substitution has no selector or its selector matches the chapter.
+        """
+        return self.selector is None or self.selector.matches(chapter)
+
     @abstractmethod
     def apply_to(self, text: str) -> str:
         """Applies the substitution to the text, returning the changed text.
@@ -46,12 +95,14 @@ class Substitution(metaclass=ABCMeta):
 class SimpleSubstitution(Substitution):
     """The SimpleSubstitution allows for simple text replacements.
 
-    Substitutions are always applied to all chapters when calling
-    `*Output.make(book, substitutions)`.
+    Substitutions are applied to all chapters when calling
+    `*Output.make(book, substitutions)`, unless a selector limits them to some chapters.
 
     Attributes:
         old (str): The string to find.
         new (str): The string to replace the find string with.
+        selector (ChapterSelector): The selector of the chapters the substitution applies to
+            or None.
 
     Examples:
 
@@ -78,12 +129,13 @@ class SimpleSubstitution(Substitution):
 
     """
 
-    def __init__(self, old: str, new: str):
+    def __init__(self, old: str, new: str, selector: Optional[ChapterSelector] = None):
         """Initializes a new instance of the :class:`SimpleSubstitution` class.
         """
         super().__init__()
         self.old = old
         self.new = new
+        self.selector = selector
 
     def apply_to(self, text: str) -> str:
         """Applies the substitution to the text, returning the changed text.
@@ -101,8 +153,8 @@ class RegexSubstitution(Substitution):
     """The RegexSubstitution allows you to use regular expressions to make
     text replacements.
 
-    Substitutions are always applied to all chapters when calling
-    `*Output.make(book, substitutions)`.
+    Substitutions are applied to all chapters when calling
+    `*Output.make(book, substitutions)`, unless a selector limits them to some chapters.
 
     Args:
         pattern: The search pattern.
@@ -111,6 +163,8 @@ class RegexSubstitution(Substitution):
             syntax to denote these groups, i.e. \1, \2 and so on.
 
             See the documentation of the python re package for more information.
+        selector: The selector of the chapters the substitution applies to. Defaults to all
+            chapters.
 
     Examples:
 
@@ -139,27 +193,1122 @@ class RegexSubstitution(Substitution):
     """
 
     def __init__(self, pattern: Union[bytes, str],
-                 replace_with: Union[bytes, str]):
-        self.regular_expression = re.compile(pattern)
+                 replace_with: Union[bytes, str],
+                 selector: Optional[ChapterSelector] = None):
+        self.__regular_expression: Optional['re.Pattern'] = re.compile(pattern)
+        self.pattern = self.__regular_expression.pattern
+        self.flags = self.__regular_expression.flags
         self.replace_with = replace_with
+        self.selector = selector
+        self.literals = get_required_literals(self.__regular_expression)
+        self.fusion = _get_fusion_analysis(self.__regular_expression, replace_with)
+        self.applied = 0
+        self.skipped = 0
+
+    @classmethod
+    def from_analysis(cls,
+                      pattern: str,
+                      flags: int,
+                      replace_with: str,
+                      literals: Optional[FrozenSet[str]],
+                      fusion: Optional[FusionAnalysis],
+                      selector: Optional[ChapterSelector] = None) -> 'RegexSubstitution':
+        """Creates a regex substitution from the analysis of an earlier one with the same
+        pattern, e.g. one read from a cache, without analysing the pattern again. The pattern
+        is only compiled when the substitution is first applied.
+
+        Args:
+            pattern: The search pattern.
+            flags: The flags of the compiled pattern.
+            replace_with: The string to replace the pattern with.
+            literals: The literals every match contains or None.
+            fusion: The analysis of the pattern needed to fuse the substitution with others or
+                None, if it can't be fused.
+            selector: The selector of the chapters the substitution applies to. Defaults to
+                all chapters.
+
+        Returns:
+            The regex substitution.
+        """
+        # pylint: disable=protected-access,too-many-arguments
+        substitution = cls.__new__(cls)
+        substitution.__regular_expression = None
+        substitution.pattern = pattern
+        substitution.flags = flags
+        substitution.replace_with = replace_with
+        substitution.selector = selector
+        substitution.literals = literals
+        substitution.fusion = fusion
+        substitution.applied = 0
+        substitution.skipped = 0
+        return substitution
+
+    @property
+    def regular_expression(self) -> 're.Pattern':
+        """The compiled search pattern."""
+        if self.__regular_expression is None:
+            self.__regular_expression = re.compile(self.pattern, self.flags)
+        return self.__regular_expression
+
+    def may_match(self, text: str) -> bool:
+        """Tells whether the regular expression may match the text, checking only whether the
+        text contains one of the literals every match contains.
+
+        Args:
+            text: The text.
+
+        Returns:
+            False if the regular expression can't match the text, otherwise True.
+        """
+        return self.literals is None or any(literal in text for literal in self.literals)
 
     def apply_to(self, text: str):
         """Applies the substitution to the text, returning the changed text.
 
+        The regular expression isn't run at all if the text lacks the literals every match
+        contains.
+
         Args:
             text: The text to apply this simple substitution to.
 
         Returns:
             The changed text.
         """
+        if not self.may_match(text):
+            self.skipped += 1
+            return text
+
+        self.applied += 1
         return self.regular_expression.sub(self.replace_with, text)
 
 
+class TranslateSubstitution(Substitution):
+    """The TranslateSubstitution replaces single characters with other characters, all of them
+    in a single pass over the text.
+
+    All characters are replaced at once, so the replacement of one character is never replaced
+    again by another entry of the mapping.
+
+    Args:
+        mapping: The replacement of each character. A replacement may be empty to remove the
+            character or longer than a single character.
+        selector: The selector of the chapters the substitution applies to. Defaults to all
+            chapters.
+
+    Attributes:
+        mapping (Dict[str, str]): The replacement of each character.
+        selector (ChapterSelector): The selector of the chapters the substitution applies to
+            or None.
+
+    Raises:
+        TypeError: If a key of the mapping is not a single character or a value is not a string.
+
+    Examples:
+
+        .. code-block:: python
+
+            substitution = TranslateSubstitution({"'": '’', '"': '”'})
+
+            substitution.apply_to('"It\'s"')  # '”It’s”'
+    """
+
+    def __init__(self, mapping: Dict[str, str], selector: Optional[ChapterSelector] = None):
+        """Initializes a new instance of the :class:`TranslateSubstitution` class.
+        """
+        for old, new in mapping.items():
+            if not isinstance(old, str) or len(old) != 1 or not isinstance(new, str):
+                raise TypeError(f'{old!r}: {new!r} does not map a single character to a string.')
+
+        self.mapping = dict(mapping)
+        self.selector = selector
+        self.__table = str.maketrans(self.mapping)
+
+    def apply_to(self, text: str) -> str:
+        """Applies the substitution to the text, returning the changed text.
+
+        Args:
+            text: The text to apply the substitution to.
+
+        Returns:
+            The changed text.
+        """
+        return text.translate(self.__table)
+
+
+class SimpleSubstitutionSet(Substitution):
+    """The SimpleSubstitutionSet applies a sequence of simple substitutions with the same result
+    as applying them one after another, but skips the substitutions that can't change the text.
+
+    A single pass over the text with an automaton matching all old strings at once finds the
+    substitutions whose old string occurs in the text. Only those are applied, in order. Where
+    the new string of an applied substitution could form the old string of a later substitution
+    together with the text around it, the text around each replacement is searched for such
+    old strings as well.
+
+    Use :func:`compile_substitutions` to create simple substitution sets.
+
+    Args:
+        substitutions: The sequence of simple substitutions. The old strings must not be empty
+            and only the last substitution may have an empty new string.
+
+    Attributes:
+        substitutions (List[SimpleSubstitution]): The sequence of simple substitutions.
+    """
+
+    def __init__(self, substitutions: Iterable[SimpleSubstitution]):
+        """Initializes a new instance of the :class:`SimpleSubstitutionSet` class.
+        """
+        self.substitutions = list(substitutions)
+        self.__indices_by_old: Dict[str, List[int]] = {}
+
+        for index, substitution in enumerate(self.substitutions):
+            self.__indices_by_old.setdefault(substitution.old, []).append(index)
+
+        trie = _get_trie(self.__indices_by_old)
+        self.__scanner = re.compile(f'(?=({_get_trie_pattern(trie)}))')
+        self.__prefixes = _get_prefixes(trie)
+        self.__max_length = max(len(old) for old in self.__indices_by_old)
+        self.__olds = _OverlapIndex(self.__indices_by_old)
+        self.__successors: Dict[int, Set[int]] = {}
+
+    def apply_to(self, text: str) -> str:
+        """Applies the substitutions to the text, returning the changed text.
+
+        Args:
+            text: The text to apply the substitutions to.
+
+        Returns:
+            The changed text.
+        """
+        applicable = self._find(text, 0, len(text))
+
+        if len(applicable) * 2 > len(self.substitutions):
+            # Most substitutions apply anyway, finding out which of the others do would take
+            # longer than applying them.
+            for substitution in self.substitutions:
+                text = text.replace(substitution.old, substitution.new)
+            return text
+
+        for index, substitution in enumerate(self.substitutions):
+            if index not in applicable:
+                continue
+
+            successors = self._get_successors(index) - applicable
+
+            if not successors:
+                text = text.replace(substitution.old, substitution.new)
+                continue
+
+            text, positions = _replace(text, substitution.old, substitution.new)
+
+            for position in positions:
+                found = self._find(text,
+                                   position - self.__max_length + 1,
+                                   position + len(substitution.new) + self.__max_length - 1)
+                applicable.update(found & successors)
+
+        return text
+
+    def _find(self, text: str, start: int, end: int) -> Set[int]:
+        """Finds the substitutions whose old string occurs in the text between start and end.
+
+        Args:
+            text: The text.
+            start: The index of the first character to search.
+            end: The index after the last character to search.
+
+        Returns:
+            The indices of the substitutions.
+        """
+        found = {match.group(1)
+                 for match in self.__scanner.finditer(text, max(0, start), max(0, end))}
+
+        return {index
+                for old in found
+                for prefix in self.__prefixes[old]
+                for index in self.__indices_by_old[prefix]}
+
+    def _get_successors(self, index: int) -> Set[int]:
+        """Gets the indices of the later substitutions whose old string could be formed by the
+        new string of the substitution at index together with the text around it.
+
+        Args:
+            index: The index of the substitution.
+
+        Returns:
+            The indices.
+        """
+        if index not in self.__successors:
+            new = self.substitutions[index].new
+            self.__successors[index] = {successor
+                                        for old in self.__olds.get_overlapping(new)
+                                        for successor in self.__indices_by_old[old]
+                                        if successor > index}
+
+        return self.__successors[index]
+
+
+class FusedSubstitution(Substitution):
+    """The FusedSubstitution applies a sequence of independent regex substitutions in a single
+    pass over the text, with the same result as applying them one after another.
+
+    The patterns of the substitutions are joined into one alternation, each ending in an empty
+    marker group, and each match is replaced as the substitution whose marker group matched
+    would replace it. A lookahead for the characters the patterns start with skips the
+    positions none of them can match at. Substitutions whose
+    required literals don't occur in the text are left out of the alternation.
+
+    Use :func:`fuse_substitutions` to find the substitutions that can be fused.
+
+    Args:
+        substitutions: The sequence of independent substitutions.
+
+    Attributes:
+        substitutions (List[Substitution]): The sequence of substitutions.
+
+    Raises:
+        ValueError: If one of the substitutions can't be fused.
+    """
+
+    def __init__(self, substitutions: Iterable[Substitution]):
+        """Initializes a new instance of the :class:`FusedSubstitution` class.
+        """
+        self.substitutions = list(substitutions)
+        self.__rules = [_get_fusion_rule(substitution) for substitution in self.substitutions]
+
+        if any(rule is None or not rule.fusible for rule in self.__rules):
+            raise ValueError('Only regex substitutions starting with a character set, without '
+                             'flags or back references, can be fused.')
+
+        self.__passes: Dict[Tuple[int, ...], Tuple['re.Pattern', Dict]] = {}
+
+    def apply_to(self, text: str) -> str:
+        """Applies the substitutions to the text, returning the changed text.
+
+        Args:
+            text: The text to apply the substitutions to.
+
+        Returns:
+            The changed text.
+        """
+        active = []
+
+        for index, (substitution, rule) in enumerate(zip(self.substitutions, self.__rules)):
+            if rule.may_match(text):
+                active.append(index)
+                substitution.applied += 1
+            else:
+                substitution.skipped += 1
+
+        if not active:
+            return text
+
+        if len(active) == 1:
+            substitution = self.substitutions[active[0]]
+
+            return substitution.regular_expression.sub(substitution.replace_with, text)
+
+        regular_expression, replacements = self._get_pass(tuple(active))
+
+        def replace(match):
+            replacement = replacements[match.lastindex]
+
+            if isinstance(replacement, str):
+                return replacement
+
+            return ''.join([piece if isinstance(piece, str) else match.group(piece) or ''
+                            for piece in replacement])
+
+        return regular_expression.sub(replace, text)
+
+    def _get_pass(self, active: Tuple[int, ...]) -> Tuple['re.Pattern', Dict]:
+        """Gets the alternation of the active substitutions and the replacement of each of its
+        groups.
+
+        Args:
+            active: The indices of the active substitutions.
+
+        Returns:
+            A tuple of the compiled alternation and a dictionary mapping the index of the marker
+            group of each substitution to its replacement. See
+            :meth:`_FusionRule.get_replacement`.
+        """
+        if active not in self.__passes:
+            # The lookahead lets the regular expression engine rule out most positions with a
+            # single check instead of trying every alternative there.
+            characters = set().union(*(self.__rules[index].first for index in active))
+            first = ''.join(map(re.escape, sorted(characters)))
+            alternatives = '|'.join(f'(?:{self.__rules[index].pattern})()' for index in active)
+            regular_expression = re.compile(f'(?=[{first}])(?:{alternatives})')
+            replacements = {}
+            first = 1
+
+            for index in active:
+                rule = self.__rules[index]
+                replacements[first + rule.groups] = \
+                    rule.get_replacement(first, regular_expression.groupindex)
+                first += rule.groups + 1
+
+            self.__passes[active] = (regular_expression, replacements)
+
+        return self.__passes[active]
+
+
+def compile_substitutions(substitutions: Iterable[Substitution]) -> List[Substitution]:
+    """Compiles the list of substitutions into an equivalent list applying consecutive simple
+    substitutions as a :class:`SimpleSubstitutionSet` and consecutive independent substitutions
+    as a :class:`FusedSubstitution`.
+
+    A set ends after a substitution with an empty new string, because removing text joins the
+    text around it. Simple substitutions with an empty or very long old or new string, and all
+    other substitutions, are left out of sets. Of those, consecutive substitutions are fused as
+    described in :func:`fuse_substitutions`.
+
+    Args:
+        substitutions: The list of substitutions.
+
+    Returns:
+        The compiled list of substitutions.
+    """
+    compiled: List[Substitution] = []
+    batch: List[SimpleSubstitution] = []
+
+    def close_batch():
+        if len(batch) > 1:
+            compiled.append(SimpleSubstitutionSet(batch))
+        else:
+            compiled.extend(batch)
+        batch.clear()
+
+    for substitution in substitutions:
+        if not isinstance(substitution, SimpleSubstitution) \
+                or not substitution.old \
+                or len(substitution.old) > MAX_COMPILED_LENGTH \
+                or len(substitution.new) > MAX_COMPILED_LENGTH:
+            close_batch()
+            compiled.append(substitution)
+            continue
+
+        batch.append(substitution)
+
+        if not substitution.new:
+            close_batch()
+
+    close_batch()
+
+    return fuse_substitutions(compiled)
+
+
+def fuse_substitutions(substitutions: Iterable[Substitution]) -> List[Substitution]:
+    """Fuses independent regex substitutions of the list into a :class:`FusedSubstitution`,
+    which applies them in a single pass.
+
+    A substitution is independent of an earlier one if neither could change the matches of the
+    other, which is proven from the characters their patterns can match: the patterns must not
+    have a character in common, the earlier substitution must not insert a character the later
+    pattern can match, and it must not remove its matches entirely, which would join the text
+    around them. Lookarounds count towards the characters of a pattern and line anchors match
+    newlines. Only regex substitutions without flags, back references and character classes
+    such as `.`, `\\w` or `[^"]`, and simple substitutions with a non-empty old string are
+    analysed.
+
+    Only regex substitutions starting with a character set, such as `[0-9]+%`, are fused. The
+    regular expression engine searches for patterns starting with a literal, and for the old
+    string of simple substitutions, much faster than it could try an alternation at every
+    position, so these are applied on their own. A substitution is moved ahead of up to
+    :data:`MAX_REORDERED` substitutions to fuse it with earlier ones, if it is independent of
+    them in both directions, which means applying them in either order gives the same result.
+
+    Args:
+        substitutions: The list of substitutions.
+
+    Returns:
+        The list of substitutions with the fused substitutions in place of the ones they
+        apply.
+    """
+    fused: List[Substitution] = []
+    batch: List[Substitution] = []
+    rules: List[_FusionRule] = []
+    held: List[Substitution] = []
+    held_rules: List[_FusionRule] = []
+
+    def close_batch():
+        if len(batch) > 1:
+            fused.append(FusedSubstitution(batch))
+        else:
+            fused.extend(batch)
+        fused.extend(held)
+        batch.clear()
+        rules.clear()
+        held.clear()
+        held_rules.clear()
+
+    for substitution in substitutions:
+        rule = _get_fusion_rule(substitution)
+
+        if rule is not None and rule.fusible and rules and \
+                all(earlier.is_independent_of(rule) for earlier in rules) and \
+                all(rule.commutes_with(passed) for passed in held_rules):
+            batch.append(substitution)
+            rules.append(rule)
+            continue
+
+        if rule is not None and rules and len(held) < MAX_REORDERED:
+            # Stays after the batch, later substitutions may still be moved ahead of it.
+            held.append(substitution)
+            held_rules.append(rule)
+            continue
+
+        close_batch()
+
+        if rule is not None and rule.fusible:
+            batch.append(substitution)
+            rules.append(rule)
+        else:
+            fused.append(substitution)
+
+    close_batch()
+
+    return fused
+
+
+def collapse_translations(substitutions: Iterable[Substitution]) -> List[Substitution]:
+    """Collapses consecutive simple substitutions replacing a single character with at most a
+    single character into an equivalent :class:`TranslateSubstitution`.
+
+    A translation ends before a substitution whose old character already is an old or new
+    character of the translation, because applying it one after another would then differ from
+    replacing all characters at once, and before a substitution with a different selector.
+    Single substitutions are left as they are.
+
+    Args:
+        substitutions: The list of substitutions.
+
+    Returns:
+        The list of substitutions with consecutive single character substitutions collapsed.
+    """
+    collapsed: List[Substitution] = []
+    batch: List[SimpleSubstitution] = []
+
+    def close_batch():
+        if len(batch) > 1:
+            collapsed.append(TranslateSubstitution({item.old: item.new for item in batch},
+                                                   batch[0].selector))
+        else:
+            collapsed.extend(batch)
+        batch.clear()
+
+    for substitution in substitutions:
+        if not isinstance(substitution, SimpleSubstitution) \
+                or len(substitution.old) != 1 \
+                or len(substitution.new) > 1:
+            close_batch()
+            collapsed.append(substitution)
+            continue
+
+        if batch and batch[0].selector != substitution.selector or \
+                any(substitution.old in (item.old, item.new) for item in batch):
+            close_batch()
+
+        batch.append(substitution)
+
+    close_batch()
+
+    return collapsed
+
+
+def get_required_literals(regular_expression: 're.Pattern') -> Optional[FrozenSet[str]]:
+    """Gets a set of literals at least one of which is contained in every match of the regular
+    expression.
+
+    Of all such sets found in the pattern, the one whose shortest literal is longest is
+    returned, as it rules out the most texts.
+
+    Args:
+        regular_expression: The compiled regular expression.
+
+    Returns:
+        The literals or None, if no such set is known, e.g. because the pattern ignores case or
+        contains no literals.
+    """
+    if not isinstance(regular_expression.pattern, str) or \
+            regular_expression.flags & re.IGNORECASE:
+        return None
+
+    try:
+        literals = _get_required_literals(sre_parse.parse(regular_expression.pattern,
+                                                          regular_expression.flags))
+    except (re.error, RecursionError):
+        return None
+
+    if literals is None or len(literals) > MAX_REQUIRED_LITERALS:
+        return None
+
+    return frozenset(literals)
+
+
+def _get_required_literals(items: Iterable) -> Optional[Set[str]]:
+    """Gets a set of literals at least one of which is contained in every match of the sequence
+    of parsed pattern items. See :func:`get_required_literals`.
+
+    Args:
+        items: The parsed pattern items.
+
+    Returns:
+        The literals or None.
+    """
+    candidates = []
+    run: List[str] = []
+
+    for operator, argument in items:
+        if operator == sre_parse.LITERAL:
+            run.append(chr(argument))
+            continue
+
+        if run:
+            candidates.append({''.join(run)})
+            run = []
+
+        candidate = _get_item_literals(operator, argument)
+
+        if candidate:
+            candidates.append(candidate)
+
+    if run:
+        candidates.append({''.join(run)})
+
+    if not candidates:
+        return None
+
+    return max(candidates, key=lambda literals: (min(map(len, literals)), -len(literals)))
+
+
+def _get_item_literals(operator, argument) -> Optional[Set[str]]:
+    """Gets a set of literals at least one of which is contained in every match of a single
+    parsed pattern item other than a literal. See :func:`get_required_literals`.
+
+    Args:
+        operator: The operator of the item.
+        argument: The argument of the item.
+
+    Returns:
+        The literals or None.
+    """
+    if operator == sre_parse.SUBPATTERN:
+        _, add_flags, _, items = argument
+        return None if add_flags & re.IGNORECASE else _get_required_literals(items)
+
+    if operator in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT,
+                    getattr(sre_parse, 'POSSESSIVE_REPEAT', None)):
+        minimum, _, items = argument
+        return _get_required_literals(items) if minimum > 0 else None
+
+    if operator == getattr(sre_parse, 'ATOMIC_GROUP', None):
+        return _get_required_literals(argument)
+
+    if operator == sre_parse.BRANCH:
+        literals: Set[str] = set()
+        for items in argument[1]:
+            branch_literals = _get_required_literals(items)
+            if branch_literals is None:
+                return None
+            literals |= branch_literals
+        return literals
+
+    if operator == sre_parse.IN and \
+            all(member == sre_parse.LITERAL for member, _ in argument):
+        return {chr(character) for _, character in argument}
+
+    return None
+
+
+class _FusionRule:
+    """The view of a substitution needed to fuse it with others. See
+    :func:`fuse_substitutions`.
+
+    Args:
+        regular_expression: The compiled pattern of the substitution.
+        replace_with: The replacement template of the substitution.
+        alphabet: The characters the pattern can match or check.
+        output: The characters the replacement can insert.
+        separates: Determines whether the replacement is never empty.
+        literals: The literals every match contains or None.
+        first: The characters every match starts with or None, if the pattern starts with a
+            literal and can't be fused.
+    """
+
+    # pylint: disable=too-many-arguments,too-many-instance-attributes
+
+    def __init__(self,
+                 regular_expression: 're.Pattern',
+                 replace_with: str,
+                 alphabet: FrozenSet[str],
+                 output: FrozenSet[str],
+                 separates: bool,
+                 literals: Optional[FrozenSet[str]],
+                 first: Optional[FrozenSet[str]]):
+        """Initializes a new instance of the :class:`_FusionRule` class.
+        """
+        self.regular_expression = regular_expression
+        self.pattern = regular_expression.pattern
+        self.groups = regular_expression.groups
+        self.replace_with = replace_with
+        self.alphabet = alphabet
+        self.output = output
+        self.separates = separates
+        self.literals = literals
+        self.first = first
+        self.fusible = first is not None
+
+    def may_match(self, text: str) -> bool:
+        """Tells whether the text contains one of the literals every match contains.
+
+        Args:
+            text: The text.
+
+        Returns:
+            False if the pattern can't match the text, otherwise True.
+        """
+        return self.literals is None or any(literal in text for literal in self.literals)
+
+    def is_independent_of(self, later: '_FusionRule') -> bool:
+        """Tells whether the later rule is independent of this one. See
+        :func:`fuse_substitutions`.
+
+        Args:
+            later: The later rule.
+
+        Returns:
+            True if the rules can be applied in a single pass, otherwise False.
+        """
+        return self.separates and \
+            not self.alphabet & later.alphabet and \
+            not self.output & later.alphabet and \
+            not set(self.regular_expression.groupindex) & set(later.regular_expression.groupindex)
+
+    def commutes_with(self, other: '_FusionRule') -> bool:
+        """Tells whether applying this and the other rule in either order gives the same
+        result.
+
+        Args:
+            other: The other rule.
+
+        Returns:
+            True if the rules commute, otherwise False.
+        """
+        return self.is_independent_of(other) and other.is_independent_of(self)
+
+    def get_replacement(self,
+                        group: int,
+                        groupindex: Mapping[str, int]) -> Union[str, List[Union[str, int]]]:
+        """Gets the replacement of the rule when its pattern is part of an alternation.
+
+        Args:
+            group: The index the first group of the pattern has in the alternation.
+            groupindex: The indices of the named groups of the alternation.
+
+        Returns:
+            The replacement if it refers to no groups, otherwise the pieces of the replacement:
+            strings and the indices of the groups of the alternation whose match to insert.
+        """
+        pieces: List[Union[str, int]] = []
+
+        for match in _TEMPLATE_TOKEN.finditer(self.replace_with):
+            name, number = match.group(1, 2)
+
+            if number is not None or (name is not None and name.isdigit()):
+                number = int(number or name)
+                pieces.append(group + number - 1 if number else 0)
+            elif name is not None:
+                pieces.append(groupindex[name])
+            elif pieces and isinstance(pieces[-1], str):
+                pieces[-1] += _EMPTY.sub(match.group(0), '')
+            else:
+                pieces.append(_EMPTY.sub(match.group(0), ''))
+
+        if all(isinstance(piece, str) for piece in pieces):
+            return ''.join(pieces)
+
+        return pieces
+
+
+_TEMPLATE_TOKEN = re.compile(r'\\(?:g<([^>]*)>|([1-9][0-9]?)(?![0-9])|([^0-9]))|[^\\]+',
+                             re.DOTALL)
+"""Matches the text, group references and escapes of a replacement template."""
+
+_TEMPLATE_ESCAPES = {'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t',
+                     'v': '\v'}
+"""The characters of the escapes a replacement template may contain."""
+
+_EMPTY = re.compile('')
+"""Expands the escapes of replacement templates."""
+
+
+def _get_fusion_rule(substitution: Substitution) -> Optional[_FusionRule]:
+    """Gets the view of the substitution needed to fuse it with others.
+
+    Args:
+        substitution: The substitution.
+
+    Returns:
+        The rule or None if the substitution can't be fused.
+    """
+    if isinstance(substitution, SimpleSubstitution):
+        if not substitution.old:
+            return None
+
+        return _FusionRule(re.compile(re.escape(substitution.old)),
+                           substitution.new.replace('\\', '\\\\'),
+                           frozenset(substitution.old),
+                           frozenset(substitution.new),
+                           bool(substitution.new),
+                           frozenset([substitution.old]),
+                           None)
+
+    if not isinstance(substitution, RegexSubstitution) or substitution.fusion is None:
+        return None
+
+    alphabet, output, separates, first = substitution.fusion
+
+    return _FusionRule(substitution.regular_expression, substitution.replace_with, alphabet,
+                       output, separates, substitution.literals, first)
+
+
+def _get_fusion_analysis(regular_expression: 're.Pattern',
+                         replace_with: Union[bytes, str]) -> Optional[FusionAnalysis]:
+    """Analyses the pattern and replacement of a regex substitution for fusing it with others.
+    See :func:`fuse_substitutions`.
+
+    Args:
+        regular_expression: The compiled pattern of the substitution.
+        replace_with: The replacement template of the substitution.
+
+    Returns:
+        The analysis or None if the substitution can't be fused.
+    """
+    if not isinstance(regular_expression.pattern, str) or not isinstance(replace_with, str) or \
+            regular_expression.flags != re.UNICODE:
+        return None
+
+    try:
+        items = sre_parse.parse(regular_expression.pattern)
+        alphabet = _get_alphabet(items)
+    except (re.error, RecursionError):
+        return None
+
+    if alphabet is None or len(alphabet) > MAX_FUSED_ALPHABET or items.getwidth()[0] == 0:
+        return None
+
+    first = None if _has_literal_prefix(items) else _get_first_characters(items)
+
+    output: Set[str] = set()
+    separates = False
+
+    for match in _TEMPLATE_TOKEN.finditer(replace_with):
+        name, number, escape = match.groups()
+
+        if name is not None or number is not None:
+            output |= alphabet
+        elif escape is not None:
+            if escape.isalpha() and ord(escape) < 0x80 and escape not in _TEMPLATE_ESCAPES:
+                return None
+            output.update(('\\', escape, _TEMPLATE_ESCAPES.get(escape, escape)))
+            separates = True
+        else:
+            output.update(match.group(0))
+            separates = True
+
+    if sum(len(match.group(0)) for match in _TEMPLATE_TOKEN.finditer(replace_with)) != \
+            len(replace_with):
+        # Octal escapes or a trailing backslash.
+        return None
+
+    return (frozenset(alphabet), frozenset(output), separates,
+            None if first is None else frozenset(first))
+
+
+def _has_literal_prefix(items) -> bool:
+    """Tells whether the parsed pattern items start with a literal character.
+
+    Args:
+        items: The parsed pattern items.
+
+    Returns:
+        True if the items start with a literal, otherwise False.
+    """
+    while items and items[0][0] == sre_parse.SUBPATTERN:
+        items = items[0][1][3]
+
+    return bool(items) and items[0][0] == sre_parse.LITERAL
+
+
+def _get_first_characters(items) -> Optional[Set[str]]:
+    """Gets the characters every match of the parsed pattern items starts with.
+
+    Args:
+        items: The parsed pattern items.
+
+    Returns:
+        The characters or None if the items don't start with a literal character or a
+        character set.
+    """
+    if not items:
+        return None
+
+    operator, argument = items[0]
+
+    if operator == sre_parse.LITERAL:
+        return {chr(argument)}
+
+    if operator == sre_parse.IN:
+        return _get_alphabet([items[0]])
+
+    if operator in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT,
+                    getattr(sre_parse, 'POSSESSIVE_REPEAT', None)):
+        return _get_first_characters(argument[2]) if argument[0] > 0 else None
+
+    if operator == sre_parse.SUBPATTERN:
+        return _get_first_characters(argument[3])
+
+    if operator == sre_parse.BRANCH:
+        characters: Set[str] = set()
+        for branch in argument[1]:
+            branch_characters = _get_first_characters(branch)
+            if branch_characters is None:
+                return None
+            characters |= branch_characters
+        return characters
+
+    return None
+
+
+def _get_alphabet(items: Iterable) -> Optional[Set[str]]:
+    """Gets the characters the parsed pattern items can match or check.
+
+    Args:
+        items: The parsed pattern items.
+
+    Returns:
+        The characters or None if there are too many to tell, e.g. because of `.` or `\\w`,
+        or if the items contain back references or word boundaries.
+    """
+    alphabet: Set[str] = set()
+
+    for operator, argument in items:
+        if operator == sre_parse.LITERAL:
+            alphabet.add(chr(argument))
+            continue
+
+        if operator == sre_parse.IN:
+            for member, value in argument:
+                if member == sre_parse.LITERAL:
+                    alphabet.add(chr(value))
+                elif member == sre_parse.RANGE and value[1] - value[0] < MAX_FUSED_ALPHABET:
+                    alphabet.update(map(chr, range(value[0], value[1] + 1)))
+                else:
+                    return None
+            continue
+
+        if operator == sre_parse.AT:
+            if argument in (sre_parse.AT_BEGINNING, sre_parse.AT_END):
+                alphabet.add('\n')
+            elif argument not in (sre_parse.AT_BEGINNING_STRING, sre_parse.AT_END_STRING):
+                return None
+            continue
+
+        if operator in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT,
+                        getattr(sre_parse, 'POSSESSIVE_REPEAT', None)):
+            sub_items = [argument[2]]
+        elif operator == sre_parse.SUBPATTERN:
+            if argument[1] & re.IGNORECASE:
+                return None
+            sub_items = [argument[3]]
+        elif operator == sre_parse.BRANCH:
+            sub_items = argument[1]
+        elif operator in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            sub_items = [argument[1]]
+        elif operator == getattr(sre_parse, 'ATOMIC_GROUP', None):
+            sub_items = [argument]
+        else:
+            return None
+
+        for sub_item in sub_items:
+            sub_alphabet = _get_alphabet(sub_item)
+            if sub_alphabet is None:
+                return None
+            alphabet |= sub_alphabet
+
+    return alphabet
+
+
+class _OverlapIndex:
+    """The _OverlapIndex finds the strings that can overlap a given string in some text, that
+    is the strings that contain it or are contained in it, and those with a suffix that is a
+    prefix of it or the other way round.
+
+    Args:
+        strings: The strings to index.
+    """
+
+    def __init__(self, strings: Iterable[str]):
+        """Initializes a new instance of the :class:`_OverlapIndex` class.
+        """
+        self.__strings = [string for string in strings if string]
+        self.__known = set(self.__strings)
+        self.__joined = ''.join(string + '\0' for string in self.__strings)
+        self.__offsets = list(accumulate([0] + [len(string) + 1 for string in self.__strings]))
+        self.__lengths = {len(string) for string in self.__strings}
+        self.__by_prefix: Dict[str, List[str]] = {}
+        self.__by_suffix: Dict[str, List[str]] = {}
+
+        for string in self.__strings:
+            for end in range(1, len(string)):
+                self.__by_prefix.setdefault(string[:end], []).append(string)
+                self.__by_suffix.setdefault(string[-end:], []).append(string)
+
+    def get_overlapping(self, string: str) -> Set[str]:
+        """Gets the indexed strings that can overlap the string.
+
+        Args:
+            string: The string.
+
+        Returns:
+            The strings.
+        """
+        if not string:
+            return set()
+
+        if '\0' in string:
+            return set(self.__strings)
+
+        overlapping = set()
+
+        start = self.__joined.find(string)
+        while start >= 0:
+            overlapping.add(self.__strings[bisect_right(self.__offsets, start) - 1])
+            start = self.__joined.find(string, start + 1)
+
+        for length in self.__lengths:
+            for start in range(len(string) - length + 1):
+                if string[start:start + length] in self.__known:
+                    overlapping.add(string[start:start + length])
+
+        for end in range(1, len(string)):
+            overlapping.update(self.__by_suffix.get(string[:end], ()))
+            overlapping.update(self.__by_prefix.get(string[-end:], ()))
+
+        return overlapping
+
+
+def _replace(text: str, old: str, new: str) -> Tuple[str, List[int]]:
+    """Replaces all occurrences of old in the text with new, like :meth:`str.replace`.
+
+    Args:
+        text: The text.
+        old: The string to find.
+        new: The string to replace it with.
+
+    Returns:
+        A tuple of the changed text and the positions of the replacements in the changed text.
+    """
+    parts = text.split(old)
+    positions = []
+    position = 0
+
+    for part in parts[:-1]:
+        position += len(part)
+        positions.append(position)
+        position += len(new)
+
+    return new.join(parts), positions
+
+
+def _get_trie(strings: Iterable[str]) -> Dict[Optional[str], Dict]:
+    """Gets the trie of the strings.
+
+    Each node of the trie is a dictionary mapping the next character to the child node. Nodes
+    at which a string ends contain the key None.
+
+    Args:
+        strings: The strings.
+
+    Returns:
+        The root node of the trie.
+    """
+    trie: Dict[Optional[str], Dict] = {}
+
+    for string in strings:
+        node = trie
+        for char in string:
+            node = node.setdefault(char, {})
+        node[None] = {}
+
+    return trie
+
+
+def _get_trie_pattern(trie: Dict[Optional[str], Dict]) -> str:
+    """Gets a regular expression matching the longest string in the trie starting at a position.
+
+    The regular expression is structured like the trie, so that matching takes time
+    proportional to the length of the longest string rather than the number of strings.
+
+    Args:
+        trie: The root node of the trie.
+
+    Returns:
+        The regular expression.
+    """
+    alternatives = [re.escape(char) + _get_trie_pattern(child)
+                    for char, child in sorted(item for item in trie.items() if item[0])]
+
+    if None in trie:
+        if not alternatives:
+            return ''
+        alternatives.append('')
+
+    if len(alternatives) == 1:
+        return alternatives[0]
+
+    return f'(?:{"|".join(alternatives)})'
+
+
+def _get_prefixes(trie: Dict[Optional[str], Dict]) -> Dict[str, List[str]]:
+    """Gets the strings in the trie that are prefixes of each string in the trie, including the
+    string itself.
+
+    Args:
+        trie: The root node of the trie.
+
+    Returns:
+        The prefixes by string.
+    """
+    prefixes: Dict[str, List[str]] = {}
+    pending = [(trie, '', [])]
+
+    while pending:
+        node, string, found = pending.pop()
+
+        if None in node:
+            found = found + [string]
+            prefixes[string] = found
+
+        for char, child in node.items():
+            if char is not None:
+                pending.append((child, string + char, found))
+
+    return prefixes
+
+
 def apply_substitutions(
         text: str,
         substitutions: Iterable[Substitution]) -> str:
     """Applies the list of substitutions to the markdown content.
 
+    The substitutions are compiled with :func:`compile_substitutions` first, so consecutive
+    simple substitutions are applied in a single pass where possible.
+
+    The text doesn't belong to a chapter, so the selectors of the substitutions are ignored.
+
     Args:
         text: The text to apply the substitutions to.
         substitutions: The list of substitutions to be applied.
@@ -168,14 +1317,125 @@ def apply_substitutions(
         The changed text.
     """
     text = str(text)
+    substitutions = compile_substitutions(substitutions)
 
     if substitutions:
         LOG.info('Applying substitutions ...')
 
-    substitution_count = len(list(substitutions))
+    substitution_count = len(substitutions)
 
     for index, substitution in enumerate(substitutions):
         text = substitution.apply_to(text)
         LOG.info(f'{index + 1} of {substitution_count} applied')
 
     return text
+
+
+def substitute_texts(texts: Iterable[str],
+                     substitutions: Iterable[Substitution],
+                     chapters: Optional[Iterable[Chapter]] = None) -> Iterator[str]:
+    """Applies the list of substitutions to each of the texts, one text at a time.
+
+    The texts are consumed lazily, so only a single text and its substituted version are held
+    in memory at any time, no matter how many texts there are. The substitutions are compiled
+    with :func:`compile_substitutions` once, when the first text is requested.
+
+    Each text is substituted on its own, so a pattern never matches across two texts: for the
+    chapters of a book, `end\\s+start` doesn't match the end of one chapter followed by the
+    start of the next, and `\\A` and `\\Z` match at the start and end of every chapter.
+
+    Args:
+        texts: The texts, for example the markdown content of each chapter of a book.
+        substitutions: The list of substitutions to be applied. Any iterable will do.
+        chapters: The chapter each text belongs to, in the same order. If given, substitutions
+            with a selector are only applied to the texts of the chapters they select.
+            Otherwise all substitutions are applied to all texts.
+
+    Yields:
+        The changed texts, in the same order.
+    """
+    if chapters is None:
+        substitutions = compile_substitutions(substitutions)
+
+        for text in texts:
+            for substitution in substitutions:
+                text = substitution.apply_to(text)
+
+            yield text
+
+        return
+
+    chapter_substitutions = ChapterSubstitutions(substitutions)
+
+    for chapter, text in zip(chapters, texts):
+        for substitution in chapter_substitutions.get_compiled(chapter):
+            text = substitution.apply_to(text)
+
+        yield text
+
+
+class ChapterSubstitutions:
+    """The ChapterSubstitutions select the substitutions applying to each chapter and compile
+    them with :func:`compile_substitutions`.
+
+    Chapters selecting the same substitutions share a single compiled list, so without any
+    selectors the substitutions are compiled only once.
+
+    Args:
+        substitutions: The list of substitutions.
+
+    Attributes:
+        substitutions (List[Substitution]): The list of substitutions.
+    """
+
+    def __init__(self, substitutions: Iterable[Substitution]):
+        """Initializes a new instance of the :class:`ChapterSubstitutions` class.
+        """
+        self.substitutions = list(substitutions)
+        self.__selective = any(substitution.selector is not None
+                               for substitution in self.substitutions)
+        self.__compiled: Dict[Tuple[int, ...], List[Substitution]] = {}
+
+    def get_selection(self, chapter: Chapter) -> Tuple[int, ...]:
+        """Gets the indices of the substitutions applying to the chapter.
+
+        Args:
+            chapter: The chapter.
+
+        Returns:
+            The indices, in ascending order.
+        """
+        if not self.__selective:
+            return tuple(range(len(self.substitutions)))
+
+        return tuple(index for index, substitution in enumerate(self.substitutions)
+                     if substitution.applies_to(chapter))
+
+    def get(self, chapter: Chapter) -> List[Substitution]:
+        """Gets the substitutions applying to the chapter.
+
+        Args:
+            chapter: The chapter.
+
+        Returns:
+            The substitutions, in order.
+        """
+        return [self.substitutions[index] for index in self.get_selection(chapter)]
+
+    def get_compiled(self, chapter: Chapter) -> List[Substitution]:
+        """Gets the compiled substitutions applying to the chapter.
+
+        Args:
+            chapter: The chapter.
+
+        Returns:
+            The compiled substitutions.
+        """
+        selection = self.get_selection(chapter)
+        compiled = self.__compiled.get(selection)
+
+        if compiled is None:
+            compiled = compile_substitutions(self.substitutions[index] for index in selection)
+            self.__compiled[selection] = compiled
+
+        return compiled
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""This module loads substitutions from tab or comma separated table files.
+
+Tables hold one substitution per row. The first row names the columns: `old` and `new` for
+simple substitutions, `pattern` and `replace_with` for regex substitutions, or all four to mix
+both in one table. Rows are read one at a time, so even tables with many thousands of rows are
+never held in memory as text.
+
+The substitutions read from each table are cached on disk as json, along with the analysis of
+their patterns, and reused as long as the content hash of the table file stays the same. A
+cached table is loaded without parsing or analysing it again, and its regular expressions are
+only compiled when they are first applied. Reading the cache never runs any code.
+"""
+
+import csv
+import hashlib
+import json
+import logging
+import os
+from typing import (TYPE_CHECKING, Any, Dict, FrozenSet, Iterable, Iterator, List, Optional,
+                    Tuple)
+
+from publish.cache import CACHE_DIRECTORY, hash_file, write_bytes_atomically
+from publish.substitution import (Substitution, SimpleSubstitution, RegexSubstitution,
+                                  TranslateSubstitution, collapse_translations)
+
+if TYPE_CHECKING:  # pragma: no cover
+    from publish.changes import ChangeDetector  # noqa: F401 pylint: disable=cyclic-import
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(logging.NullHandler())
+
+TABLE_CACHE_DIRECTORY = os.path.join(CACHE_DIRECTORY, 'tables')
+"""The default directory the substitutions read from tables are cached in."""
+
+TABLE_CACHE_VERSION = 3
+"""The version of the format of the cached substitutions. Cache entries of other versions are
+ignored."""
+
+TAB_SEPARATED_EXTENSIONS = ('.tsv', '.tab', '.txt')
+"""The file extensions of tables whose columns are separated by tabs. All other tables are read
+as comma separated values."""
+
+Row = Tuple[str, str, str]
+"""A row of a table: the type of the substitution, `simple` or `regex`, and its two values."""
+
+
+def load_substitutions_file(path: str,
+                            cache_directory: Optional[str] = None,
+                            detector: Optional['ChangeDetector'] = None) -> List[Substitution]:
+    """Loads the substitutions from the table file at path, taking them from the cache if the
+    table didn't change since it was last read.
+
+    Args:
+        path: The path of the table file.
+        cache_directory: The directory the substitutions are cached in. If None, the table is
+            read every time.
+        detector: The optional change detector used to tell the content hash of the table file.
+
+    Returns:
+        The list of substitutions.
+
+    Raises:
+        TypeError: If the columns of the table don't match any substitution type.
+        ValueError: If a row of the table defines no substitution.
+    """
+    if cache_directory is None:
+        return read_substitutions_file(path)
+
+    digest = detector.get_hash(path) if detector else hash_file(path)
+
+    if digest is None:
+        raise FileNotFoundError(f'Substitutions file {path} not found.')
+
+    cache_path = os.path.join(cache_directory,
+                              hashlib.sha256(os.path.abspath(path).encode('utf-8')).hexdigest())
+    substitutions = _read_cache_entry(cache_path, digest)
+
+    if substitutions is None:
+        LOG.info(f'Reading substitutions from {path} ...')
+        substitutions = read_substitutions_file(path)
+        write_bytes_atomically(cache_path, json.dumps({
+            'version': TABLE_CACHE_VERSION,
+            'digest': digest,
+            'substitutions': [_dump_substitution(substitution)
+                              for substitution in substitutions]}).encode('utf-8'))
+
+    return substitutions
+
+
+def read_substitutions_file(path: str) -> List[Substitution]:
+    """Reads the substitutions from the table file at path.
+
+    Consecutive simple substitutions replacing a single character with at most a single
+    character are collapsed into a TranslateSubstitution, just like those defined in a
+    project file.
+
+    Args:
+        path: The path of the table file.
+
+    Returns:
+        The list of substitutions.
+
+    Raises:
+        TypeError: If the columns of the table don't match any substitution type.
+        ValueError: If a row of the table defines no substitution.
+    """
+    return _get_substitutions(_iter_rows(path))
+
+
+def _get_substitutions(rows: Iterable[Row]) -> List[Substitution]:
+    """Creates the substitutions defined by the rows of a table.
+
+    Args:
+        rows: The rows.
+
+    Returns:
+        The list of substitutions.
+    """
+    return collapse_translations(
+        SimpleSubstitution(old=first, new=second) if type_ == 'simple'
+        else RegexSubstitution(pattern=first, replace_with=second)
+        for type_, first, second in rows)
+
+
+def _iter_rows(path: str) -> Iterator[Row]:
+    """Reads the table file at path one row at a time.
+
+    Args:
+        path: The path of the table file.
+
+    Yields:
+        The substitution type and values defined by each row.
+
+    Raises:
+        TypeError: If the columns of the table don't match any substitution type.
+        ValueError: If a row of the table defines no substitution.
+    """
+    if os.path.splitext(path)[1].lower() in TAB_SEPARATED_EXTENSIONS:
+        dialect: Dict = {'delimiter': '\t', 'quoting': csv.QUOTE_NONE}
+    else:
+        dialect = {'delimiter': ','}
+
+    # utf-8-sig skips the byte order mark spreadsheet applications like to write.
+    with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+        reader = csv.reader(file, **dialect)
+        columns = next(reader, [])
+
+        if not {'old', 'new'} <= set(columns) and not {'pattern', 'replace_with'} <= set(columns):
+            raise TypeError(f'{path}: {columns} do not match any substitution type.')
+
+        for row in reader:
+            if not any(row):
+                continue
+
+            values = dict(zip(columns, row))
+
+            if values.get('old') and 'new' in values:
+                yield 'simple', values['old'], values['new']
+            elif values.get('pattern') and 'replace_with' in values:
+                yield 'regex', values['pattern'], values['replace_with']
+            else:
+                raise ValueError(f'{path}, line {reader.line_num}: {row} does not define a '
+                                 f'substitution.')
+
+
+def _dump_substitution(substitution: Substitution) -> List[Any]:
+    """Gets the json representation of a substitution read from a table.
+
+    Args:
+        substitution: The substitution.
+
+    Returns:
+        The type of the substitution followed by its definition and, for regex substitutions,
+        the analysis of its pattern.
+    """
+    if isinstance(substitution, TranslateSubstitution):
+        return ['translate', substitution.mapping]
+
+    if isinstance(substitution, RegexSubstitution):
+        fusion = substitution.fusion
+        return ['regex', substitution.pattern, substitution.flags, substitution.replace_with,
+                _dump_set(substitution.literals),
+                None if fusion is None else [sorted(fusion[0]), sorted(fusion[1]), fusion[2],
+                                             _dump_set(fusion[3])]]
+
+    return ['simple', substitution.old, substitution.new]  # type: ignore
+
+
+def _load_substitution(item: Any) -> Substitution:
+    """Creates a substitution from its json representation without analysing it again.
+
+    Args:
+        item: The json representation of the substitution.
+
+    Returns:
+        The substitution.
+
+    Raises:
+        TypeError: If the representation is invalid.
+        ValueError: If the representation is invalid.
+    """
+    if not isinstance(item, list) or not item:
+        raise TypeError(f'{item!r} is not a substitution.')
+
+    if item[0] == 'simple' and len(item) == 3 and _is_strings(item[1:]):
+        return SimpleSubstitution(old=item[1], new=item[2])
+
+    if item[0] == 'translate' and len(item) == 2 and isinstance(item[1], dict):
+        return TranslateSubstitution(item[1])
+
+    if item[0] == 'regex' and len(item) == 6 and _is_strings((item[1], item[3])) and \
+            isinstance(item[2], int):
+        fusion = item[5]
+
+        if fusion is not None and (not isinstance(fusion, list) or len(fusion) != 4 or
+                                   not isinstance(fusion[2], bool)):
+            raise TypeError(f'{fusion!r} is not an analysis of a pattern.')
+
+        return RegexSubstitution.from_analysis(
+            item[1], item[2], item[3], _load_set(item[4]),
+            None if fusion is None else (_load_set(fusion[0]), _load_set(fusion[1]), fusion[2],
+                                         _load_set(fusion[3])))
+
+    raise ValueError(f'{item!r} is not a substitution.')
+
+
+def _dump_set(strings: Optional[Iterable[str]]) -> Optional[List[str]]:
+    """Gets the json representation of an optional set of strings.
+
+    Args:
+        strings: The set of strings or None.
+
+    Returns:
+        The sorted list of strings or None.
+    """
+    return None if strings is None else sorted(strings)
+
+
+def _load_set(strings: Any) -> Optional[FrozenSet[str]]:
+    """Creates an optional set of strings from its json representation.
+
+    Args:
+        strings: The json representation.
+
+    Returns:
+        The set of strings or None.
+
+    Raises:
+        TypeError: If the representation is not a list of strings or None.
+    """
+    if strings is None:
+        return None
+
+    if not isinstance(strings, list) or not _is_strings(strings):
+        raise TypeError(f'{strings!r} is not a list of strings.')
+
+    return frozenset(strings)
+
+
+def _is_strings(values: Iterable[Any]) -> bool:
+    """Tells whether all values are strings.
+
+    Args:
+        values: The values.
+
+    Returns:
+        True if all values are strings, otherwise False.
+    """
+    return all(isinstance(value, str) for value in values)
+
+
+def _read_cache_entry(cache_path: str, digest: str) -> Optional[List[Substitution]]:
+    """Reads the cached substitutions of a table.
+
+    Args:
+        cache_path: The path of the cache entry.
+        digest: The current content hash of the table file.
+
+    Returns:
+        The substitutions or None if there is no valid cache entry for the content hash.
+    """
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as file:
+            entry = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(entry, dict) or entry.get('version') != TABLE_CACHE_VERSION or \
+            entry.get('digest') != digest or not isinstance(entry.get('substitutions'), list):
+        return None
+
+    try:
+        return [_load_substitution(item) for item in entry['substitutions']]
+    except (TypeError, ValueError):
+        return None
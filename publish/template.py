@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""This module loads and compiles the jinja2 templates used to turn the html content of a book
+into an html document.
+
+Templates are compiled only once per process. User templates can extend the bundled template,
+which is available to them under the name `publish/template.jinja`, and override any of its
+blocks: `title`, `css`, `head` and `content`. Optionally, the compiled templates are also
+stored on disk in a jinja2 bytecode cache, so that new processes don't have to compile them
+either.
+
+jinja2 is only imported once the first template is loaded, so that commands not rendering any
+html don't pay for importing it.
+"""
+
+import logging
+import os
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:  # pragma: no cover
+    from jinja2 import BaseLoader, Environment, Template  # noqa: F401
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(logging.NullHandler())
+
+BUNDLED_TEMPLATE = 'publish/template.jinja'
+"""The name of the bundled template, as used in the `{% extends %}` tag of user templates."""
+
+
+class TemplateRegistry:
+    """The TemplateRegistry loads and compiles templates, keeping each compiled template for the
+    lifetime of the registry.
+
+    Templates loaded from files are recompiled if the file changes.
+
+    Args:
+        bytecode_cache_directory: The optional directory of the jinja2 bytecode cache.
+
+    Attributes:
+        bytecode_cache_directory (str): The directory of the jinja2 bytecode cache or None.
+    """
+
+    def __init__(self, bytecode_cache_directory: Optional[str] = None):
+        """Initializes a new instance of the :class:`TemplateRegistry` class.
+        """
+        self.bytecode_cache_directory = bytecode_cache_directory
+        self.__environments: Dict[str, 'Environment'] = {}
+
+    def enable_bytecode_cache(self, directory: str):
+        """Stores compiled templates in the jinja2 bytecode cache in directory from now on.
+
+        Args:
+            directory: The directory of the bytecode cache. Created if it doesn't exist.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.bytecode_cache_directory = directory
+        self.__environments.clear()
+
+    def get_template(self, path: Optional[str] = None) -> 'Template':
+        """Gets the compiled template at path or the bundled template if path is omitted.
+
+        Templates extended or included by the template at path are looked up relative to the
+        directory of path.
+
+        Args:
+            path: The path of the template file.
+
+        Returns:
+            The compiled template.
+        """
+        directory, name = _split_template_path(path)
+
+        return self._get_environment(directory).get_template(name)
+
+    def _get_environment(self, directory: str) -> 'Environment':
+        """Gets the jinja2 environment loading templates from directory.
+
+        Args:
+            directory: The directory.
+
+        Returns:
+            The environment.
+        """
+        if directory not in self.__environments:
+            # pylint: disable=import-outside-toplevel
+            from jinja2 import Environment, FileSystemBytecodeCache
+
+            bytecode_cache = None
+
+            if self.bytecode_cache_directory:
+                bytecode_cache = FileSystemBytecodeCache(self.bytecode_cache_directory)
+
+            self.__environments[directory] = Environment(loader=_get_loader(directory),
+                                                         bytecode_cache=bytecode_cache)
+
+        return self.__environments[directory]
+
+
+REGISTRY = TemplateRegistry()
+"""The template registry shared by all outputs."""
+
+
+def get_template(path: Optional[str] = None) -> 'Template':
+    """Gets the compiled template at path or the bundled template if path is omitted, using the
+    shared template registry.
+
+    Args:
+        path: The path of the template file.
+
+    Returns:
+        The compiled template.
+    """
+    return REGISTRY.get_template(path)
+
+
+def _split_template_path(path: Optional[str]) -> Tuple[str, str]:
+    """Splits the template path into the directory to load templates from and the name of the
+    template within that directory.
+
+    Args:
+        path: The path of the template file or None for the bundled template.
+
+    Returns:
+        A tuple of directory and name.
+    """
+    if not path:
+        return os.getcwd(), BUNDLED_TEMPLATE
+
+    path = os.path.abspath(path)
+
+    return os.path.dirname(path), os.path.basename(path)
+
+
+def _get_loader(directory: str) -> 'BaseLoader':
+    """Gets the loader for the user templates in directory and the bundled template.
+
+    Args:
+        directory: The directory.
+
+    Returns:
+        The loader.
+    """
+    # pylint: disable=import-outside-toplevel
+    from jinja2 import ChoiceLoader, FileSystemLoader, FunctionLoader, PrefixLoader
+
+    bundled_loader = PrefixLoader({
+        BUNDLED_TEMPLATE.split('/')[0]: FunctionLoader(_load_bundled_template)
+    })
+
+    return ChoiceLoader([bundled_loader, FileSystemLoader(directory)])
+
+
+def _load_bundled_template(name: str) -> Optional[str]:
+    """Loads the source of a template bundled with this package.
+
+    Args:
+        name: The name of the template.
+
+    Returns:
+        The source of the template or None if there is no such template.
+    """
+    if name != BUNDLED_TEMPLATE.split('/')[1]:
+        return None
+
+    return _read_package_resource(name) \
+        .decode('utf-8') \
+        .replace('\r\n', '\n')
+    # The resource is read as bytes, which means that we
+    # have to decode to utf-8. The replace is necessary because
+    # reading bytes, instead of open, does not automatically
+    # strip \r\n down to \n on windows systems. Leaving \r\n as is
+    # would produce double line breaks when writing the resulting string
+    # back to disc, thus we have to do the replacement ourselves, too.
+
+
+def _read_package_resource(name: str) -> bytes:
+    """Reads a resource bundled with this package.
+
+    Uses :mod:`importlib.resources` where available, which, unlike pkg_resources, doesn't scan
+    every installed distribution when imported. Python 3.6 lacks importlib.resources, so the
+    resource is read from the directory of this module there.
+
+    Args:
+        name: The name of the resource.
+
+    Returns:
+        The content of the resource.
+    """
+    try:
+        # pylint: disable=import-outside-toplevel
+        from importlib import resources
+    except ImportError:  # pragma: no cover
+        with open(os.path.join(os.path.dirname(__file__), name), 'rb') as file:
+            return file.read()
+
+    if hasattr(resources, 'files'):
+        return resources.files(__package__).joinpath(name).read_bytes()
+
+    return resources.read_binary(__package__, name)  # pragma: no cover
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""This module implements the watch mode, which rebuilds the outputs of a project whenever the
+files they depend on change.
+
+The project file, the substitutions files, the chapters, the stylesheets, the templates and the
+cover are watched with
+inotify on linux and by polling their stat results everywhere else. So are the directories
+searched for the chapters given as glob patterns or directories, so that adding, removing or
+renaming a chapter file finds the chapters again. Bursts of changes, such as an editor saving
+several files at once, are collected into a single rebuild, and only the outputs depending on
+the changed files are made again. The change detector, the render cache and the compiled
+templates are kept between rebuilds. Without caching, the render cache keeps its entries in
+memory, so unchanged chapters aren't substituted and rendered again even then.
+"""
+
+import ctypes
+import itertools
+import logging
+import os
+import select
+import struct
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from publish.book import Book
+from publish.build import BuildContext, BuildManifest, build, divide_jobs, get_dependencies
+from publish.cache import ArtifactStore, RenderCache
+from publish.changes import ChangeDetector
+from publish.output import HtmlOutput
+from publish.substitution import Substitution
+from publish.table import TABLE_CACHE_DIRECTORY
+from publish.sources import find_directories
+from publish.yaml import (PROJECT_CACHE_PATH, get_chapter_patterns, get_substitutions_files,
+                          load_project, load_yaml)
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(logging.NullHandler())
+
+DEFAULT_DEBOUNCE = 0.2
+"""The default number of seconds without further changes after which a rebuild starts."""
+
+DEFAULT_POLL_INTERVAL = 0.5
+"""The default number of seconds between two polls of the polling watcher."""
+
+_IN_CLOEXEC = 0o2000000
+_IN_NONBLOCK = 0o4000
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_INOTIFY_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO
+                 | _IN_CREATE | _IN_DELETE | _IN_ONLYDIR)
+_INOTIFY_LISTING_MASK = _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class PollingWatcher:
+    """The PollingWatcher detects changes to files by comparing their stat results at a fixed
+    interval. The modification time of a directory changes whenever a file is added to it or
+    removed from it.
+
+    Args:
+        interval: The number of seconds between two polls.
+
+    Attributes:
+        interval (float): The number of seconds between two polls.
+    """
+
+    def __init__(self, interval: float = DEFAULT_POLL_INTERVAL):
+        """Initializes a new instance of the :class:`PollingWatcher` class.
+        """
+        self.interval = interval
+        self.__stats: Dict[str, Optional[Tuple[int, int, int]]] = {}
+
+    def watch(self, paths: Iterable[str], directories: Iterable[str] = ()):
+        """Watches the files at paths and the listings of the directories from now on, and only
+        those.
+
+        Args:
+            paths: The paths of the files.
+            directories: The paths of the directories.
+        """
+        paths = {os.path.abspath(path) for path in itertools.chain(paths, directories)}
+        self.__stats = {path: self.__stats[path] if path in self.__stats else _stat(path)
+                        for path in paths}
+
+    def wait(self, debounce: float = DEFAULT_DEBOUNCE) -> Set[str]:
+        """Waits until any of the watched files changed and no further change happened for
+        debounce seconds.
+
+        Args:
+            debounce: The number of seconds without further changes to wait for.
+
+        Returns:
+            The absolute paths of the changed files and directories.
+        """
+        changed: Set[str] = set()
+        last_change = 0.0
+
+        while not changed or time.monotonic() - last_change < debounce:
+            time.sleep(self.interval if not changed else min(self.interval, debounce))
+
+            for path, stat in self.__stats.items():
+                current = _stat(path)
+
+                if current != stat:
+                    self.__stats[path] = current
+                    changed.add(path)
+                    last_change = time.monotonic()
+
+        return changed
+
+    def close(self):
+        """Stops watching all files and directories.
+        """
+        self.__stats = {}
+
+
+class InotifyWatcher:
+    """The InotifyWatcher detects changes to files using the inotify api of the linux kernel.
+
+    The directories containing the files are watched instead of the files themselves, so that
+    files replaced by editors saving to a temporary file first are still tracked. A watched
+    directory changes whenever a file is created in it, moved into or out of it or deleted.
+
+    Raises:
+        OSError: If inotify is not available.
+    """
+
+    def __init__(self):
+        """Initializes a new instance of the :class:`InotifyWatcher` class.
+        """
+        self.__libc = ctypes.CDLL(None, use_errno=True)
+        inotify_init1 = getattr(self.__libc, 'inotify_init1', None)
+
+        if inotify_init1 is None:
+            raise OSError('inotify is not available on this platform')
+
+        self.__fd = inotify_init1(_IN_CLOEXEC | _IN_NONBLOCK)
+
+        if self.__fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        self.__paths: Set[str] = set()
+        self.__listings: Set[str] = set()
+        self.__directories: Dict[int, str] = {}
+
+    def watch(self, paths: Iterable[str], directories: Iterable[str] = ()):
+        """Watches the files at paths and the listings of the directories from now on, and only
+        those.
+
+        Args:
+            paths: The paths of the files.
+            directories: The paths of the directories.
+        """
+        self.__paths = {os.path.abspath(path) for path in paths}
+        self.__listings = {os.path.abspath(directory) for directory in directories}
+        directories = {os.path.dirname(path) for path in self.__paths} | self.__listings
+
+        for descriptor, directory in list(self.__directories.items()):
+            if directory not in directories:
+                self.__libc.inotify_rm_watch(self.__fd, descriptor)
+                del self.__directories[descriptor]
+
+        for directory in directories - set(self.__directories.values()):
+            descriptor = self.__libc.inotify_add_watch(self.__fd,
+                                                       os.fsencode(directory),
+                                                       _INOTIFY_MASK)
+            if descriptor < 0:
+                LOG.warning(f'Cannot watch {directory}: {os.strerror(ctypes.get_errno())}')
+                continue
+            self.__directories[descriptor] = directory
+
+    def wait(self, debounce: float = DEFAULT_DEBOUNCE) -> Set[str]:
+        """Waits until any of the watched files changed and no further change happened for
+        debounce seconds.
+
+        Args:
+            debounce: The number of seconds without further changes to wait for.
+
+        Returns:
+            The absolute paths of the changed files and directories.
+        """
+        changed: Set[str] = set()
+
+        while True:
+            readable, _, _ = select.select([self.__fd], [], [], debounce if changed else None)
+
+            if not readable:
+                return changed
+
+            changed.update(self._read_events())
+
+    def close(self):
+        """Stops watching all files and directories and releases the inotify instance.
+        """
+        os.close(self.__fd)
+
+    def _read_events(self) -> Set[str]:
+        """Reads all pending inotify events.
+
+        Returns:
+            The absolute paths of the watched files and directories the events refer to.
+        """
+        try:
+            data = os.read(self.__fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        paths = set()
+        offset = 0
+
+        while offset < len(data):
+            descriptor, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & _IN_Q_OVERFLOW:
+                paths.update(self.__paths | self.__listings)
+            elif mask & _IN_IGNORED:
+                self.__directories.pop(descriptor, None)
+            elif descriptor in self.__directories:
+                directory = self.__directories[descriptor]
+                path = os.path.join(directory, name)
+                if path in self.__paths:
+                    paths.add(path)
+                if directory in self.__listings and mask & _INOTIFY_LISTING_MASK:
+                    paths.add(directory)
+
+        return paths
+
+
+Watcher = Union[InotifyWatcher, PollingWatcher]
+
+
+def get_watcher() -> Watcher:
+    """Gets an inotify watcher if inotify is available, or a polling watcher otherwise.
+
+    Returns:
+        The watcher.
+    """
+    try:
+        return InotifyWatcher()
+    except OSError as error:
+        LOG.info(f'Polling for changes, because inotify is not available: {error}')
+        return PollingWatcher()
+
+
+def watch(project_path: str,
+          jobs: int = 1,
+          cache: bool = True,
+          watcher: Optional[Watcher] = None,
+          debounce: float = DEFAULT_DEBOUNCE):
+    """Makes the outputs of the project and then makes them again whenever the files they
+    depend on change, until interrupted.
+
+    A change to the project file or a substitutions file makes every output whose inputs
+    changed again. So does a change to the chapters found for a glob pattern or directory, such
+    as a new chapter file. A change to any other file only makes the outputs depending on that
+    file again. Errors raised while
+    making outputs are logged and don't end the watch.
+
+    Args:
+        project_path: The path of the project file.
+        jobs: The maximum number of outputs made concurrently, also divided between them to
+            render their chapters with. See :func:`publish.build.divide_jobs`.
+        cache: Determines whether to use and update the caches of the project. If False, the
+            chapters are still cached in memory while watching.
+        watcher: The watcher. Defaults to the one returned by :func:`get_watcher`.
+        debounce: The number of seconds without further changes after which a rebuild starts.
+    """
+    detector = ChangeDetector() if cache else ChangeDetector(None)
+
+    if cache:
+        render_cache = RenderCache(detector=detector)
+    else:
+        render_cache = RenderCache(None, detector=detector)
+
+    artifacts = ArtifactStore() if cache else None
+    watcher = watcher or get_watcher()
+    project_path = os.path.abspath(project_path)
+
+    book, substitutions, outputs, manifest, project_files, directories = _load(
+        project_path, jobs, detector, cache)
+    _build(book, substitutions, outputs, render_cache, artifacts, jobs, manifest, detector)
+
+    try:
+        while True:
+            watched = _get_watched_paths(project_files, book, outputs)
+            watcher.watch(watched, directories)
+            LOG.info(f'Watching {len(watched)} files and {len(directories)} directories for '
+                     f'changes, press Ctrl+C to stop ...')
+
+            events = watcher.wait(debounce)
+            changed = set(detector.scan(events - directories)) | (events & directories)
+
+            if not changed:
+                continue
+
+            LOG.info(f'Changed: {", ".join(sorted(os.path.relpath(p) for p in changed))}')
+
+            project_changed = bool(changed & project_files)
+            chapters = [chapter.src for chapter in book.chapters]
+
+            if project_changed or changed & directories:
+                try:
+                    book, substitutions, outputs, manifest, project_files, directories = _load(
+                        project_path, jobs, detector, cache)
+                except Exception as error:  # pylint: disable=broad-except
+                    LOG.error(f'Cannot load {os.path.relpath(project_path)}: {error}')
+                    continue
+
+            if project_changed or chapters != [chapter.src for chapter in book.chapters]:
+                affected = outputs
+            else:
+                affected = [output for output in outputs
+                            if changed & _get_absolute_dependencies(book, output)]
+
+            _build(book, substitutions, affected, render_cache, artifacts, jobs, manifest,
+                   detector)
+    except KeyboardInterrupt:
+        LOG.info('Stopped watching')
+    finally:
+        watcher.close()
+
+
+def _load(project_path: str,
+          jobs: int,
+          detector: ChangeDetector,
+          cache: bool) -> Tuple[Book,
+                                List[Substitution],
+                                List[HtmlOutput],
+                                Optional[BuildManifest],
+                                Set[str],
+                                Set[str]]:
+    """Loads the project file.
+
+    Args:
+        project_path: The path of the project file.
+        jobs: The number of jobs divided between the outputs to render their chapters with.
+        detector: The change detector.
+        cache: Determines whether to use the build manifest, the project cache and the table
+            cache.
+
+    Returns:
+        A tuple of the book, the substitutions, the outputs, the build manifest or None, the
+        absolute paths of the project file and the substitutions files and the absolute paths
+        of the directories searched for chapters.
+    """
+    with open(project_path, 'rt', encoding='utf8') as file:
+        yaml = file.read()
+
+    dict_ = load_yaml(yaml)
+    project_files = {project_path}
+    project_files.update(os.path.abspath(path) for path in get_substitutions_files(dict_))
+    directories = {os.path.abspath(directory)
+                   for pattern in get_chapter_patterns(dict_)
+                   for directory in find_directories(pattern, detector)}
+    book, substitutions, outputs = load_project(yaml, detector,
+                                                TABLE_CACHE_DIRECTORY if cache else None,
+                                                PROJECT_CACHE_PATH if cache else None)
+
+    if jobs > 1:
+        divide_jobs(outputs, jobs)
+
+    manifest = BuildManifest(project=yaml, detector=detector) if cache else None
+
+    if manifest:
+        for output in outputs:
+            manifest.restore_images(output)
+
+    return book, list(substitutions), list(outputs), manifest, project_files, directories
+
+
+def _build(book: Book,  # pylint: disable=too-many-arguments
+           substitutions: List[Substitution],
+           outputs: List[HtmlOutput],
+           render_cache: Optional[RenderCache],
+           artifacts: Optional[ArtifactStore],
+           jobs: int,
+           manifest: Optional[BuildManifest],
+           detector: ChangeDetector):
+    """Makes the outputs, logging instead of raising errors.
+
+    Args:
+        book: The book.
+        substitutions: The list of substitutions.
+        outputs: The outputs to make.
+        render_cache: The render cache or None.
+        artifacts: The artifact store or None.
+        jobs: The maximum number of outputs made concurrently.
+        manifest: The build manifest or None.
+        detector: The change detector.
+    """
+    if not outputs:
+        return
+
+    try:
+        build(book, substitutions, outputs, BuildContext(render_cache, artifacts), jobs, manifest)
+    except Exception as error:  # pylint: disable=broad-except
+        # The author is about to fix whatever went wrong, so keep watching.
+        LOG.error(str(error))
+    finally:
+        detector.save()
+
+
+def _get_absolute_dependencies(book: Book, output: HtmlOutput) -> Set[str]:
+    """Gets the absolute paths of the files the output depends on.
+
+    Args:
+        book: The book.
+        output: The output.
+
+    Returns:
+        The absolute paths.
+    """
+    return {os.path.abspath(path) for path in get_dependencies(book, output) if path}
+
+
+def _get_watched_paths(project_files: Set[str],
+                       book: Book,
+                       outputs: Iterable[HtmlOutput]) -> Set[str]:
+    """Gets the absolute paths of the project files and of all files the outputs depend on.
+
+    Args:
+        project_files: The absolute paths of the project file and the substitutions files.
+        book: The book.
+        outputs: The outputs.
+
+    Returns:
+        The absolute paths.
+    """
+    paths = set(project_files)
+
+    for output in outputs:
+        paths.update(_get_absolute_dependencies(book, output))
+
+    return paths
+
+
+def _stat(path: str) -> Optional[Tuple[int, int, int]]:
+    """Gets the modification time in nanoseconds, size and inode of the file at path.
+
+    Args:
+        path: The path of the file.
+
+    Returns:
+        The stat result or None if there is no file at path.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
@@ -8,20 +8,49 @@
 # (license terms are at http://opensource.org/licenses/MIT).
 
 """Load anited. publish projects from yaml strings.
+
+Parsing the project file takes a while for projects with thousands of chapters and
+substitutions, so the parsed yaml can be cached on disk as json and reused as long as the
+project file and the version of anited. publish stay the same. Unlike a pickle, a json cache
+can't run any code when it is read, so a tampered cache can at worst describe another project.
+ruamel.yaml is only imported once a yaml string is actually parsed.
 """
+import datetime
+import json
 import logging
-from typing import Dict, Tuple, Iterable, Union, List
-
-import ruamel.yaml
-
-from publish.book import Book, Chapter
+import os
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, Tuple, Iterable, Union, List, Optional
+
+from publish import __version__
+from publish.book import Book, Chapter, ChapterSelector
+from publish.build import get_dependencies
+from publish.cache import CACHE_DIRECTORY, hash_key, write_bytes_atomically
+from publish.changes import ChangeDetector
 from publish.output import HtmlOutput, EbookConvertOutput
-from publish.substitution import Substitution, SimpleSubstitution, RegexSubstitution
+from publish.sources import DEFAULT_DIRECTORY_PATTERN, find_files, is_pattern
+from publish.substitution import (Substitution, SimpleSubstitution, RegexSubstitution,
+                                  TranslateSubstitution, collapse_translations)
+from publish.table import load_substitutions_file
+
+if TYPE_CHECKING:  # pragma: no cover
+    from publish.epub import EpubOutput  # noqa: F401
 
 LOG = logging.getLogger(__name__)
 LOG.addHandler(logging.NullHandler())
 
-YAML = ruamel.yaml.YAML(typ='safe', pure=True)
+PROJECT_CACHE_PATH = os.path.join(CACHE_DIRECTORY, 'project.json')
+"""The default path the parsed yaml of the project is cached at."""
+
+PROJECT_CACHE_VERSION = 3
+"""The version of the format of the cached project. Cached projects of other versions are
+ignored."""
+
+EPUB_WRITERS = ('ebook-convert', 'native')
+"""The values of the epub_writer option: make .epub outputs with ebook-convert, the default, or
+with :class:`publish.epub.EpubOutput`."""
+
+_DATE_TAG = '$date'
 
 
 def load_yaml(yaml: str) -> Dict:
@@ -33,12 +62,31 @@ def load_yaml(yaml: str) -> Dict:
     Returns:
         The yaml structure as a Python dictionary.
     """
-    return YAML.load(yaml)
+    return _get_yaml_loader().load(yaml)
+
+
+@lru_cache(maxsize=None)
+def _get_yaml_loader() -> Any:
+    """Gets the yaml loader, creating it when it is first needed.
+
+    The loader uses the C parser of ruamel.yaml.clib if it is installed and the pure Python
+    parser otherwise.
+
+    Returns:
+        The ruamel.yaml loader.
+    """
+    import ruamel.yaml  # pylint: disable=import-outside-toplevel
+
+    return ruamel.yaml.YAML(typ='safe')
 
 
-def load_project(yaml: str) -> Tuple[Book,
-                                     Iterable[Substitution],
-                                     Iterable[Union[HtmlOutput, EbookConvertOutput]]]:
+def load_project(yaml: str,
+                 detector: Optional[ChangeDetector] = None,
+                 table_cache: Optional[str] = None,
+                 project_cache: Optional[str] = None
+                 ) -> Tuple[Book,
+                            Iterable[Substitution],
+                            Iterable[Union[HtmlOutput, EbookConvertOutput]]]:
     """Loads a yaml string using the anited. publish project structure and returns the
     components of the project as a tuple: the book, the substitutions and the outputs.
 
@@ -48,22 +96,149 @@ def load_project(yaml: str) -> Tuple[Book,
     If the yaml string does not contain any substitutions or outputs, empty lists are returned
     in their place.
 
+    If a change detector is passed, the files the project depends on are scanned in bulk, so
+    that later queries for their content hashes don't touch the file system again.
+
+    Substitutions read from the files listed under 'substitutions_file' are appended to those
+    defined in the yaml string.
+
+    If a project cache is passed, the parsed yaml is taken from it if it was cached for the
+    same yaml string and version of anited. publish, and cached otherwise.
+
     Args:
         yaml: The yaml string.
+        detector: The optional change detector.
+        table_cache: The directory the substitutions read from substitutions files are cached
+            in. If None, substitutions files are read every time.
+        project_cache: The path the parsed yaml is cached at. If None, the yaml string is
+            parsed every time.
 
     Returns:
         A tuple consisting of the book, the list of substitutions and the list of outputs.
     """
-    dict_ = load_yaml(yaml)
+    dict_ = None
+
+    if project_cache:
+        digest = hash_key(__version__, yaml)
+        dict_ = _read_cached_project(project_cache, digest)
+
+    if dict_ is None:
+        dict_ = load_yaml(yaml)
+
+        if project_cache:
+            _write_cached_project(project_cache, digest, dict_)
 
     book = _load_book(dict_)
-    book.chapters.extend(_load_chapters(dict_))
-    substitutions = _load_substitutions(dict_)
-    outputs = _load_outputs(dict_)
+    book.chapters.extend(_load_chapters(dict_, detector))
+    substitutions = list(_load_substitutions(dict_))
+    outputs = list(_load_outputs(dict_))
+    substitutions_files = get_substitutions_files(dict_)
+
+    if detector:
+        paths = {chapter.src for chapter in book.chapters}
+        paths.update(substitutions_files)
+        paths.update(path
+                     for output in outputs
+                     for path in get_dependencies(book, output)
+                     if path)
+        detector.scan(paths)
+
+    for path in substitutions_files:
+        substitutions.extend(load_substitutions_file(path, table_cache, detector))
 
     return book, substitutions, outputs
 
 
+def _write_cached_project(path: str, digest: str, dict_: Dict):
+    """Caches the parsed yaml of a project as json.
+
+    Projects holding values json can't represent exactly, such as sets or dictionaries with
+    keys other than strings, are not cached.
+
+    Args:
+        path: The path of the cached project.
+        digest: The hash of the yaml string and the version of anited. publish.
+        dict_: The parsed yaml.
+    """
+    try:
+        data = json.dumps({'version': PROJECT_CACHE_VERSION,
+                           'digest': digest,
+                           'project': _to_json(dict_)})
+    except (TypeError, ValueError):
+        LOG.debug('The project can\'t be cached as json')
+        return
+
+    write_bytes_atomically(path, data.encode('utf-8'))
+
+
+def _read_cached_project(path: str, digest: str) -> Optional[Dict]:
+    """Reads the cached project.
+
+    Args:
+        path: The path of the cached project.
+        digest: The hash of the yaml string and the version of anited. publish.
+
+    Returns:
+        The parsed yaml or None if no project is cached for the digest.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            entry = json.load(file, object_hook=_from_json)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(entry, dict) or entry.get('version') != PROJECT_CACHE_VERSION or \
+            entry.get('digest') != digest or not isinstance(entry.get('project'), dict):
+        return None
+
+    return entry['project']
+
+
+def _to_json(value: Any) -> Any:
+    """Converts parsed yaml into values json represents exactly. Dates are tagged, so they can
+    be told apart from strings. Times are not supported.
+
+    Args:
+        value: The parsed yaml.
+
+    Returns:
+        The value to be encoded as json.
+
+    Raises:
+        TypeError: If the value can't be represented exactly.
+    """
+    if isinstance(value, dict):
+        if not all(isinstance(key, str) for key in value) or list(value) == [_DATE_TAG]:
+            raise TypeError('Only dictionaries with string keys can be cached')
+        return {key: _to_json(item) for key, item in value.items()}
+
+    if isinstance(value, list):
+        return [_to_json(item) for item in value]
+
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        return {_DATE_TAG: value.isoformat()}
+
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+
+    raise TypeError(f'{type(value).__name__} can\'t be cached')
+
+
+def _from_json(dict_: Dict) -> Any:
+    """Restores the dates tagged by :func:`_to_json`.
+
+    Args:
+        dict_: A dictionary decoded from json.
+
+    Returns:
+        The date or the dictionary itself.
+    """
+    if list(dict_) == [_DATE_TAG]:
+        return datetime.datetime.strptime(dict_[_DATE_TAG], '%Y-%m-%d').date()
+
+    return dict_
+
+
 def _load_book(dict_: Dict) -> Book:
     """Translates a dictionary into a book object. Dictionary keys and values are mapped to
     corresponding book properties of the same name.
@@ -81,21 +256,31 @@ def _load_book(dict_: Dict) -> Book:
     return book
 
 
-def _load_chapters(dict_: Dict) -> Iterable[Chapter]:
+def _load_chapters(dict_: Dict, detector: Optional[ChangeDetector] = None) -> Iterable[Chapter]:
     """Translates a dictionary into a list of chapter objects.
 
     The dictionary is assumed to have the following structure::
 
         {
             'chapters': [{ 'src': 'some_file.md' },
-                         { 'src': '...' }]
+                         { 'src': 'part_1/*.md', 'exclude': '*draft*' },
+                         { 'dir': 'appendix', 'pattern': '*.md', 'publish': False }]
         }
 
     If the key 'chapters' is not present in the dictionary or if there are no chapter
     sub-dictionaries, an empty list is returned instead.
 
+    A 'src' containing `*`, `?` or `[` is a glob pattern and adds a chapter for every matching
+    file. A 'dir' adds a chapter for every file matching 'pattern' inside the directory, by
+    default every markdown file in the directory and its subdirectories. The files of each
+    pattern or directory are added in natural order, leaving out those matching any of the
+    paths or glob patterns in 'exclude'. All other keys, such as 'publish' and 'tags', apply to
+    each of the chapters added. See :func:`publish.sources.find_files`.
+
     Args:
         dict_: The dictionary.
+        detector: The optional change detector, whose directory listings are used to find the
+            files matching glob patterns and directories.
 
     Returns:
         The list of chapter objects or an empty list either if not chapter sub-dictionaries are
@@ -105,11 +290,82 @@ def _load_chapters(dict_: Dict) -> Iterable[Chapter]:
 
     if 'chapters' in dict_ and dict_['chapters']:
         for chapter in dict_['chapters']:
-            chapters.append(Chapter(**chapter))
+            if _get_chapter_pattern(chapter) is not None:
+                chapters.extend(_load_chapter_files(chapter, detector))
+            else:
+                chapters.append(Chapter(**chapter))
 
     return chapters
 
 
+def _load_chapter_files(dict_: Dict, detector: Optional[ChangeDetector]) -> List[Chapter]:
+    """Translates a chapter sub-dictionary with a glob pattern or a directory into a list of
+    chapter objects, one for each matching file. See :func:`_load_chapters`.
+
+    Args:
+        dict_: The chapter sub-dictionary.
+        detector: The optional change detector.
+
+    Returns:
+        The list of chapter objects.
+    """
+    options = dict(dict_)
+    pattern = _get_chapter_pattern(options)
+    exclude = options.pop('exclude', None) or []
+
+    if isinstance(exclude, str):
+        exclude = [exclude]
+
+    if 'dir' in options:
+        del options['dir']
+        options.pop('pattern', None)
+    else:
+        del options['src']
+
+    paths = find_files(pattern, exclude, detector)
+
+    if not paths:
+        LOG.warning(f'No chapters found for {pattern}.')
+
+    return [Chapter(src=path, **options) for path in paths]
+
+
+def get_chapter_patterns(dict_: Dict) -> List[str]:
+    """Gets the glob patterns of the chapter sub-dictionaries listed in a dictionary that add a
+    chapter for every matching file. See :func:`_load_chapters`.
+
+    Args:
+        dict_: The dictionary.
+
+    Returns:
+        The glob patterns or an empty list if no chapter sub-dictionary has a pattern or a
+        directory.
+    """
+    patterns = (_get_chapter_pattern(chapter) for chapter in dict_.get('chapters') or [])
+
+    return [pattern for pattern in patterns if pattern is not None]
+
+
+def _get_chapter_pattern(dict_: Dict) -> Optional[str]:
+    """Gets the glob pattern of a chapter sub-dictionary.
+
+    Args:
+        dict_: The chapter sub-dictionary.
+
+    Returns:
+        The 'src' if it is a glob pattern, the 'pattern' inside the 'dir' if there is a 'dir',
+        otherwise None.
+    """
+    if 'dir' in dict_:
+        return os.path.join(str(dict_['dir']),
+                            str(dict_.get('pattern', DEFAULT_DIRECTORY_PATTERN)))
+
+    if is_pattern(dict_.get('src', '')):
+        return dict_['src']
+
+    return None
+
+
 def _load_substitutions(dict_: Dict) -> Iterable[Substitution]:
     """Translates a dictionary into a list of substitution objects.
 
@@ -117,7 +373,8 @@ def _load_substitutions(dict_: Dict) -> Iterable[Substitution]:
 
         {
             'substitutions': [{ 'old': 'some', 'new': 'text' },
-                              { 'pattern: '...', 'replace_with': '...' }]
+                              { 'pattern: '...', 'replace_with': '...' },
+                              { 'translate': { "'": '’', '"': '”' } }]
         }
 
     If the key 'substitutions' is not present in the dictionary or if there are no substitution
@@ -129,6 +386,12 @@ def _load_substitutions(dict_: Dict) -> Iterable[Substitution]:
     sub-dictionary will lead to a TypeError, because no Substitution class matches those property
     names.
 
+    The optional keys 'chapters' and 'tags' limit a substitution to the chapters whose src
+    matches one of the given paths or glob patterns or which have one of the given tags.
+
+    Consecutive simple substitutions replacing a single character with at most a single
+    character are collapsed into a TranslateSubstitution.
+
     Args:
         dict_: The dictionary.
 
@@ -144,22 +407,55 @@ def _load_substitutions(dict_: Dict) -> Iterable[Substitution]:
 
     if 'substitutions' in dict_ and dict_['substitutions']:
         for substitution in dict_['substitutions']:
+            selector = None
+
+            if 'chapters' in substitution or 'tags' in substitution:
+                selector = ChapterSelector(paths=substitution.get('chapters'),
+                                           tags=substitution.get('tags'))
+
             if 'old' in substitution and 'new' in substitution:
                 substitutions.append(
                     SimpleSubstitution(old=substitution['old'],
-                                       new=substitution['new']))
+                                       new=substitution['new'],
+                                       selector=selector))
             elif 'pattern' in substitution and 'replace_with' in substitution:
                 substitutions.append(
                     RegexSubstitution(pattern=substitution['pattern'],
-                                      replace_with=substitution['replace_with']))
+                                      replace_with=substitution['replace_with'],
+                                      selector=selector))
+            elif 'translate' in substitution:
+                substitutions.append(TranslateSubstitution(mapping=substitution['translate'],
+                                                           selector=selector))
             else:
                 raise TypeError(
                     f'{list(substitution.keys())} do not match any substitution type.')
 
-    return substitutions
+    return collapse_translations(substitutions)
+
+
+def get_substitutions_files(dict_: Dict) -> List[str]:
+    """Gets the paths of the substitutions files listed in a dictionary.
+
+    The dictionary is assumed to have one of the following structures::
 
+        { 'substitutions_file': 'terms.tsv' }
+        { 'substitutions_file': ['terms.tsv', 'names.csv'] }
 
-def _load_outputs(dict_: Dict) -> Iterable[Union[HtmlOutput, EbookConvertOutput]]:
+    Args:
+        dict_: The dictionary.
+
+    Returns:
+        The paths or an empty list if the key 'substitutions_file' is not present.
+    """
+    paths = dict_.get('substitutions_file') or []
+
+    if isinstance(paths, str):
+        return [paths]
+
+    return [str(path) for path in paths]
+
+
+def _load_outputs(dict_: Dict) -> Iterable[Union[HtmlOutput, EbookConvertOutput, 'EpubOutput']]:
     """Translates a dictionary into a list of output objects.
 
     The dictionary is assumed to have the following structure::
@@ -176,10 +472,12 @@ def _load_outputs(dict_: Dict) -> Iterable[Union[HtmlOutput, EbookConvertOutput]
     of the output sub-dictionary.
 
     A file name ending in the file type '.html' will produce an HtmlOutput. '.epub', '.mobi' or
-    any other file type excluding '.html' will produce an EbookConvertOutput.
+    any other file type excluding '.html' will produce an EbookConvertOutput. A file name ending
+    in '.epub' will produce an EpubOutput instead, if 'epub_writer' is set to 'native' for the
+    output or globally.
 
-    Note that a local stylesheet *replaces* the global stylesheet, but local ebookconvert_params
-    are *added* to the global ebookconvert_params if present.
+    Note that a local stylesheet or template *replaces* the global stylesheet or template, but
+    local ebookconvert_params are *added* to the global ebookconvert_params if present.
 
     Args:
         dict_: The dictionary.
@@ -190,11 +488,16 @@ def _load_outputs(dict_: Dict) -> Iterable[Union[HtmlOutput, EbookConvertOutput]
     """
     outputs = []
     global_stylesheet = None
+    global_template = None
     global_ec_params = []
+    global_epub_writer = dict_.get('epub_writer', EPUB_WRITERS[0])
 
     if 'stylesheet' in dict_:
         global_stylesheet = dict_['stylesheet']
 
+    if 'template' in dict_:
+        global_template = dict_['template']
+
     if 'ebookconvert_params' in dict_:
         global_ec_params = _load_ebookconvert_params(dict_)
 
@@ -205,8 +508,20 @@ def _load_outputs(dict_: Dict) -> Iterable[Union[HtmlOutput, EbookConvertOutput]
         if 'stylesheet' not in output and global_stylesheet:
             output['stylesheet'] = global_stylesheet
 
+        if 'template' not in output and global_template:
+            output['template'] = global_template
+
+        epub_writer = output.pop('epub_writer', global_epub_writer)
+
+        if epub_writer not in EPUB_WRITERS:
+            raise ValueError(f'Unknown epub_writer {epub_writer!r} for output {path}, '
+                             f'expected one of {", ".join(EPUB_WRITERS)}.')
+
         if file_type == 'html':
             outputs.append(HtmlOutput(**output))
+        elif file_type == 'epub' and epub_writer == 'native':
+            from publish.epub import EpubOutput  # pylint: disable=import-outside-toplevel
+            outputs.append(EpubOutput(**output))
         else:
             if 'ebookconvert_params' in output:
                 local_ec_params = _load_ebookconvert_params(output)
@@ -15,7 +15,7 @@
 from datetime import date
 
 import pytest
-from publish.book import Book, Chapter
+from publish.book import Book, Chapter, ChapterSelector
 from tests import get_test_book
 
 
@@ -163,6 +163,11 @@ class TestChapter:
         chapter = Chapter('source')
 
         assert chapter.publish is True
+        assert chapter.tags == []
+
+    def test_tags(self):
+        assert Chapter('a.md', tags='appendix').tags == ['appendix']
+        assert Chapter('a.md', tags=['appendix', 'draft']).tags == ['appendix', 'draft']
 
     def test_publish(self):
         chapter = Chapter('source')
@@ -183,3 +188,38 @@ class TestChapter:
         with pytest.raises(TypeError):
             # noinspection PyArgumentList
             Chapter()  # pylint: disable=no-value-for-parameter
+
+
+class TestChapterSelector:
+    def test_matches_path(self):
+        selector = ChapterSelector(paths='appendix/a.md')
+
+        assert selector.matches(Chapter('appendix/a.md'))
+        assert selector.matches(Chapter('./appendix//a.md'))
+        assert not selector.matches(Chapter('appendix/b.md'))
+
+    def test_matches_glob(self):
+        selector = ChapterSelector(paths=['appendix/*.md', 'glossary.md'])
+
+        assert selector.matches(Chapter('appendix/a.md'))
+        assert selector.matches(Chapter('glossary.md'))
+        assert not selector.matches(Chapter('chapter.md'))
+
+    def test_matches_tags(self):
+        selector = ChapterSelector(tags=['appendix'])
+
+        assert selector.matches(Chapter('a.md', tags=['draft', 'appendix']))
+        assert not selector.matches(Chapter('a.md', tags=['draft']))
+        assert not selector.matches(Chapter('a.md'))
+
+    def test_matches_path_or_tags(self):
+        selector = ChapterSelector(paths='a.md', tags='appendix')
+
+        assert selector.matches(Chapter('a.md'))
+        assert selector.matches(Chapter('b.md', tags='appendix'))
+        assert not selector.matches(Chapter('b.md'))
+
+    def test_equality(self):
+        assert ChapterSelector('a.md', 'x') == ChapterSelector(['a.md'], ['x'])
+        assert hash(ChapterSelector('a.md', 'x')) == hash(ChapterSelector(['a.md'], ['x']))
+        assert ChapterSelector('a.md') != ChapterSelector('b.md')
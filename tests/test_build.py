@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""Tests for `publish.build` module.
+"""
+
+# pylint: disable=missing-docstring,no-self-use,invalid-name,protected-access
+
+import logging
+import os
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from publish.book import Book, Chapter
+from publish.build import BuildContext, BuildManifest, build, divide_jobs
+from publish.output import HtmlOutput
+from publish.substitution import SimpleSubstitution, Substitution
+
+
+class BarrierOutput:
+    """Output stub that only finishes once `parties` outputs are being made at the same time."""
+
+    def __init__(self, path, barrier):
+        self.path = path
+        self.barrier = barrier
+
+    def make(self, book, substitutions=None, context=None):
+        logging.getLogger('publish.output').info('making')
+        self.barrier.wait(timeout=5)
+
+
+class LoggingOutput:
+    def __init__(self, path):
+        self.path = path
+
+    def make(self, book, substitutions=None, context=None):
+        logger = logging.getLogger('publish.output')
+        logger.info('%d%% done', 50)
+        logger.info('100% done')
+
+
+class FailingOutput:
+    def __init__(self, path):
+        self.path = path
+
+    def make(self, book, substitutions=None, context=None):
+        raise RuntimeError(self.path)
+
+
+class CustomSubstitution(Substitution):
+    def apply_to(self, text):
+        return text
+
+
+def get_book():
+    book = Book('title', language='en')
+    book.chapters.extend([Chapter('tests/resources/1.md'),
+                          Chapter('tests/resources/2.md', publish=False)])
+    return book
+
+
+class TestBuildContext:
+    def test_get_document_renders_once_per_key(self):
+        context = BuildContext()
+        calls = []
+
+        def render():
+            calls.append(1)
+            return 'document'
+
+        assert context.get_document('key', render) == 'document'
+        assert context.get_document('key', render) == 'document'
+        assert len(calls) == 1
+        assert context.hits == 1
+        assert context.misses == 1
+
+    def test_get_document_renders_again_for_other_key(self):
+        context = BuildContext()
+
+        assert context.get_document('a', lambda: 'a') == 'a'
+        assert context.get_document('b', lambda: 'b') == 'b'
+        assert context.misses == 2
+
+    def test_get_document_renders_once_when_called_concurrently(self):
+        context = BuildContext()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def render():
+            calls.append(1)
+            started.set()
+            release.wait(timeout=5)
+            return 'document'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            context.get_document('key', render))) for _ in range(3)]
+        threads[0].start()
+        started.wait(timeout=5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert results == ['document'] * 3
+        assert len(calls) == 1
+
+
+def test_build_renders_shared_document_once(tmp_path):
+    book = get_book()
+    substitutions = [SimpleSubstitution('text', 'content')]
+    outputs = [HtmlOutput(str(tmp_path / 'a.html')),
+               HtmlOutput(str(tmp_path / 'b.html'))]
+    context = BuildContext()
+
+    with patch.object(HtmlOutput, '_get_html_content',
+                      autospec=True, return_value='<p>content</p>') as mock_content:
+        build(book, substitutions, outputs, context)
+
+    assert mock_content.call_count == 1
+    assert context.hits == 1
+    assert (tmp_path / 'a.html').read_text() == (tmp_path / 'b.html').read_text()
+
+
+def test_build_renders_again_for_force_publish_and_stylesheet(tmp_path):
+    book = get_book()
+    outputs = [HtmlOutput(str(tmp_path / 'a.html')),
+               HtmlOutput(str(tmp_path / 'b.html'), force_publish=True),
+               HtmlOutput(str(tmp_path / 'c.html'), stylesheet='tests/resources/test.css')]
+    context = BuildContext()
+
+    build(book, [], outputs, context)
+
+    assert context.misses == 3
+    assert context.hits == 0
+    assert 'second file' not in (tmp_path / 'a.html').read_text()
+    assert 'second file' in (tmp_path / 'b.html').read_text()
+    assert 'chapter_separator' in (tmp_path / 'c.html').read_text()
+
+
+def test_build_renders_again_for_other_rendering_mode(tmp_path):
+    book = get_book()
+    outputs = [HtmlOutput(str(tmp_path / 'a.html')),
+               HtmlOutput(str(tmp_path / 'b.html'), jobs=2),
+               HtmlOutput(str(tmp_path / 'c.html'), jobs=4)]
+    context = BuildContext()
+
+    with patch('publish.output.render_chapters', side_effect=lambda texts, *_: list(texts)):
+        build(book, [], outputs, context)
+
+    assert context.misses == 2
+    assert context.hits == 1
+    assert (tmp_path / 'a.html').read_text() != (tmp_path / 'b.html').read_text()
+    assert (tmp_path / 'b.html').read_text() == (tmp_path / 'c.html').read_text()
+
+
+def test_build_accepts_substitution_generator(tmp_path):
+    book = get_book()
+    outputs = [HtmlOutput(str(tmp_path / 'a.html')),
+               HtmlOutput(str(tmp_path / 'b.html'))]
+
+    build(book, (s for s in [SimpleSubstitution('text', 'content')]), outputs)
+
+    assert 'With some content.' in (tmp_path / 'a.html').read_text()
+    assert 'With some content.' in (tmp_path / 'b.html').read_text()
+
+
+def test_build_makes_outputs_concurrently():
+    barrier = threading.Barrier(2)
+    outputs = [BarrierOutput('a.epub', barrier), BarrierOutput('b.epub', barrier)]
+
+    results = build(Book('title'), [], outputs, jobs=2)
+
+    assert [result.path for result in results] == ['a.epub', 'b.epub']
+    assert all(result.seconds >= 0 for result in results)
+
+
+def test_build_prefixes_log_messages_and_logs_summary(caplog):
+    barrier = threading.Barrier(1)
+
+    with caplog.at_level(logging.INFO):
+        build(Book('title'), [], [BarrierOutput('a.epub', barrier)])
+
+    messages = [record.getMessage() for record in caplog.records]
+
+    assert '[a.epub] making' in messages
+    assert 'Summary:' in messages
+    assert any(message.strip().startswith('a.epub') for message in messages)
+    assert not logging.getLogger('x').makeRecord('x', logging.INFO, '', 0, 'm', None,
+                                                 None).getMessage().startswith('[')
+
+
+def test_build_prefixes_log_messages_with_percent_in_path(caplog):
+    with caplog.at_level(logging.INFO):
+        build(Book('title'), [], [LoggingOutput('100%d.epub')])
+
+    messages = [record.getMessage() for record in caplog.records]
+
+    assert '[100%d.epub] 50% done' in messages
+    assert '[100%d.epub] 100% done' in messages
+
+
+def test_build_makes_remaining_outputs_before_raising():
+    barrier = threading.Barrier(1)
+    remaining = BarrierOutput('b.epub', barrier)
+
+    with patch.object(remaining, 'make', wraps=remaining.make) as mock_make:
+        with pytest.raises(RuntimeError, match='a.epub'):
+            build(Book('title'), [], [FailingOutput('a.epub'), remaining])
+
+    assert mock_make.call_count == 1
+
+
+@pytest.mark.parametrize('jobs, count, expected', [
+    (8, 1, 8),
+    (8, 2, 4),
+    (8, 3, 2),
+    (4, 4, 1),
+    (2, 5, 1),
+    (1, 2, 1),
+])
+def test_divide_jobs(jobs, count, expected):
+    outputs = [HtmlOutput(f'{index}.html') for index in range(count)]
+
+    divide_jobs(outputs, jobs)
+
+    assert [output.processes for output in outputs] == [expected] * count
+    assert min(jobs, count) * expected <= jobs
+    assert [output.renders_by_chapter for output in outputs] == [jobs > 1] * count
+
+
+def test_divide_jobs_renders_with_share_of_processes(tmp_path):
+    outputs = [HtmlOutput(str(tmp_path / f'{index}.html')) for index in range(4)]
+    divide_jobs(outputs, 4)
+
+    with patch('publish.output.render_chapters', return_value=[]) as mock_render:
+        outputs[0]._get_html_content(get_book().chapters, [])
+
+    assert mock_render.call_args[0][1] == 1
+
+
+class TestBuildManifest:
+    def make_project(self, tmp_path):
+        chapter = tmp_path / 'chapter.md'
+        chapter.write_text('# Chapter\n\nText.\n')
+        book = Book('title')
+        book.chapters.append(Chapter(str(chapter)))
+        output = HtmlOutput(str(tmp_path / 'book.html'))
+        return book, chapter, output
+
+    def build_counting(self, book, output, manifest, substitutions=None):
+        with patch.object(output, 'make', wraps=output.make) as mock_make:
+            results = build(book, substitutions or [], [output], manifest=manifest)
+        return mock_make.call_count, results
+
+    def test_skips_unchanged_output(self, tmp_path):
+        book, _, output = self.make_project(tmp_path)
+        path = str(tmp_path / 'manifest.json')
+
+        calls, _ = self.build_counting(book, output, BuildManifest(path, 'yaml'))
+        assert calls == 1
+
+        calls, results = self.build_counting(book, output, BuildManifest(path, 'yaml'))
+        assert calls == 0
+        assert results[0].skipped
+
+    def test_makes_output_again_when_inputs_change(self, tmp_path):
+        book, chapter, output = self.make_project(tmp_path)
+        path = str(tmp_path / 'manifest.json')
+        self.build_counting(book, output, BuildManifest(path, 'yaml'))
+
+        assert self.build_counting(book, output, BuildManifest(path, 'other yaml'))[0] == 1
+
+        chapter.write_text('# Chapter\n\nOther text.\n')
+        assert self.build_counting(book, output, BuildManifest(path, 'other yaml'))[0] == 1
+
+        book.chapters[0].publish = False
+        output.force_publish = True
+        assert self.build_counting(book, output, BuildManifest(path, 'other yaml'))[0] == 1
+
+        assert self.build_counting(book, output, BuildManifest(path, 'other yaml'),
+                                   [SimpleSubstitution('Text', 'text')])[0] == 1
+
+    def test_ignores_transient_settings(self, tmp_path):
+        book, _, output = self.make_project(tmp_path)
+        path = str(tmp_path / 'manifest.json')
+        output.jobs = 2
+        self.build_counting(book, output, BuildManifest(path))
+
+        output.jobs = 4
+        output.streaming = True
+
+        assert self.build_counting(book, output, BuildManifest(path))[0] == 0
+
+    @pytest.mark.parametrize('setting, value', [('jobs', 2), ('streaming', True)])
+    def test_makes_output_again_when_rendering_mode_changes(self, tmp_path, setting, value):
+        book, _, output = self.make_project(tmp_path)
+        path = str(tmp_path / 'manifest.json')
+        self.build_counting(book, output, BuildManifest(path))
+
+        setattr(output, setting, value)
+
+        assert self.build_counting(book, output, BuildManifest(path))[0] == 1
+
+    def test_makes_missing_output_again(self, tmp_path):
+        book, _, output = self.make_project(tmp_path)
+        path = str(tmp_path / 'manifest.json')
+        self.build_counting(book, output, BuildManifest(path))
+
+        os.remove(output.path)
+
+        assert self.build_counting(book, output, BuildManifest(path))[0] == 1
+
+    def test_never_skips_unknown_substitutions(self, tmp_path):
+        book, _, output = self.make_project(tmp_path)
+        path = str(tmp_path / 'manifest.json')
+        substitutions = [CustomSubstitution()]
+        self.build_counting(book, output, BuildManifest(path), substitutions)
+
+        assert self.build_counting(book, output, BuildManifest(path), substitutions)[0] == 1
+
+    def test_forgets_failed_output(self, tmp_path):
+        book, _, output = self.make_project(tmp_path)
+        path = str(tmp_path / 'manifest.json')
+        self.build_counting(book, output, BuildManifest(path))
+
+        (tmp_path / 'chapter.md').write_text('changed')
+        with patch.object(output, 'make', side_effect=RuntimeError):
+            with pytest.raises(RuntimeError):
+                build(book, [], [output], manifest=BuildManifest(path))
+
+        (tmp_path / 'chapter.md').write_text('# Chapter\n\nText.\n')
+        assert self.build_counting(book, output, BuildManifest(path))[0] == 1
+
+    def test_ignores_invalid_manifest_file(self, tmp_path):
+        path = tmp_path / 'manifest.json'
+        path.write_text('{invalid')
+
+        assert not BuildManifest(str(path)).is_up_to_date('book.html', 'fingerprint')
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""Tests for `publish.cache` module.
+"""
+
+# pylint: disable=missing-docstring,no-self-use,invalid-name
+
+import os
+
+from publish.book import ChapterSelector
+from publish.cache import ArtifactStore, RenderCache, fingerprint_substitutions, hash_key
+from publish.substitution import (Substitution, SimpleSubstitution, RegexSubstitution,
+                                  TranslateSubstitution)
+
+
+class UnknownSubstitution(Substitution):
+    def apply_to(self, text: str) -> str:
+        return text
+
+
+def test_hash_key_is_stable():
+    assert hash_key('a', 1, ('b', b'c')) == hash_key('a', 1, ('b', b'c'))
+    assert hash_key('a', 1) != hash_key('a', 2)
+
+
+def test_fingerprint_substitutions_depends_on_definitions_and_order():
+    simple = SimpleSubstitution('a', 'b')
+    regex = RegexSubstitution(r'\+\+(.*?)\+\+', r'<b>\1</b>')
+
+    fingerprint = fingerprint_substitutions([simple, regex])
+
+    assert fingerprint == fingerprint_substitutions([SimpleSubstitution('a', 'b'),
+                                                     RegexSubstitution(r'\+\+(.*?)\+\+',
+                                                                       r'<b>\1</b>')])
+    assert fingerprint != fingerprint_substitutions([regex, simple])
+    assert fingerprint != fingerprint_substitutions([SimpleSubstitution('a', 'c'), regex])
+    assert fingerprint != fingerprint_substitutions([simple,
+                                                     RegexSubstitution(r'\+\+(.*?)\+\+',
+                                                                       r'<i>\1</i>')])
+
+
+def test_fingerprint_substitutions_translate():
+    fingerprint = fingerprint_substitutions([TranslateSubstitution({'a': 'b', 'c': 'd'})])
+
+    assert fingerprint == fingerprint_substitutions([TranslateSubstitution({'c': 'd',
+                                                                            'a': 'b'})])
+    assert fingerprint != fingerprint_substitutions([TranslateSubstitution({'a': 'b'})])
+
+
+def test_fingerprint_substitutions_selector():
+    fingerprint = fingerprint_substitutions([SimpleSubstitution('a', 'b')])
+
+    assert fingerprint != fingerprint_substitutions([
+        SimpleSubstitution('a', 'b', ChapterSelector(tags='x'))])
+    assert fingerprint_substitutions([SimpleSubstitution('a', 'b', ChapterSelector(tags='x'))]) \
+        != fingerprint_substitutions([SimpleSubstitution('a', 'b', ChapterSelector(tags='y'))])
+
+
+def test_fingerprint_substitutions_unknown_type_returns_none():
+    assert fingerprint_substitutions([SimpleSubstitution('a', 'b'),
+                                      UnknownSubstitution()]) is None
+
+
+class TestRenderCache:
+    def test_get_returns_put_text(self, tmp_path):
+        cache = RenderCache(str(tmp_path))
+        cache.put('abcdef', 'text\r\nwith äöü')
+
+        assert cache.get('abcdef') == 'text\r\nwith äöü'
+        assert cache.hits == 1
+
+    def test_get_missing_returns_none(self, tmp_path):
+        cache = RenderCache(str(tmp_path))
+
+        assert cache.get('abcdef') is None
+        assert cache.misses == 1
+
+    def test_evict_removes_least_recently_used(self, tmp_path):
+        cache = RenderCache(str(tmp_path), max_size=20)
+        for index, key in enumerate(['aa1', 'bb2', 'cc3']):
+            cache.put(key, '0123456789')
+            path = os.path.join(str(tmp_path), key[:2], key)
+            os.utime(path, ns=(index * 10 ** 9, index * 10 ** 9))
+
+        cache.get('aa1')  # marks aa1 as recently used
+        cache.evict()
+
+        assert cache.get('aa1') is not None
+        assert cache.get('bb2') is None
+        assert cache.get('cc3') is not None
+
+    def test_evict_keeps_entries_within_max_size(self, tmp_path):
+        cache = RenderCache(str(tmp_path), max_size=100)
+        cache.put('aa1', '0123456789')
+        cache.evict()
+
+        assert cache.get('aa1') == '0123456789'
+
+    def test_without_directory_keeps_entries_in_memory(self, tmp_path):
+        cache = RenderCache(None, max_size=20)
+        for key in ['aa1', 'bb2', 'cc3']:
+            cache.put(key, '0123456789')
+
+        cache.get('aa1')  # marks aa1 as recently used
+        cache.evict()
+
+        assert cache.get('aa1') == '0123456789'
+        assert cache.get('bb2') is None
+        assert cache.get('cc3') == '0123456789'
+        assert (cache.hits, cache.misses) == (3, 1)
+        assert not os.listdir(str(tmp_path))
+
+
+class TestArtifactStore:
+    def test_get_puts_stored_file_at_path(self, tmp_path):
+        store = ArtifactStore(str(tmp_path / 'store'))
+        (tmp_path / 'book.epub').write_bytes(b'ebook')
+        store.put('abcdef', str(tmp_path / 'book.epub'))
+
+        assert store.get('abcdef', str(tmp_path / 'out' / 'copy.epub'))
+        assert (tmp_path / 'out' / 'copy.epub').read_bytes() == b'ebook'
+        assert store.hits == 1
+
+    def test_get_missing_returns_false(self, tmp_path):
+        store = ArtifactStore(str(tmp_path / 'store'))
+
+        assert not store.get('abcdef', str(tmp_path / 'copy.epub'))
+        assert not (tmp_path / 'copy.epub').exists()
+        assert store.misses == 1
+
+    def test_get_replaces_instead_of_overwriting_existing_file(self, tmp_path):
+        store = ArtifactStore(str(tmp_path / 'store'))
+        (tmp_path / 'first.epub').write_bytes(b'first')
+        (tmp_path / 'second.epub').write_bytes(b'second')
+        store.put('aa1', str(tmp_path / 'first.epub'))
+        store.put('bb2', str(tmp_path / 'second.epub'))
+
+        store.get('aa1', str(tmp_path / 'book.epub'))
+        store.get('bb2', str(tmp_path / 'book.epub'))
+
+        assert (tmp_path / 'book.epub').read_bytes() == b'second'
+        assert store.get('aa1', str(tmp_path / 'again.epub'))
+        assert (tmp_path / 'again.epub').read_bytes() == b'first'
+
+    def test_changing_files_in_place_keeps_stored_file(self, tmp_path):
+        store = ArtifactStore(str(tmp_path / 'store'))
+        (tmp_path / 'book.epub').write_bytes(b'ebook')
+        store.put('abcdef', str(tmp_path / 'book.epub'))
+        store.get('abcdef', str(tmp_path / 'copy.epub'))
+
+        with open(str(tmp_path / 'book.epub'), 'ab') as file:
+            file.write(b' changed')
+        with open(str(tmp_path / 'copy.epub'), 'ab') as file:
+            file.write(b' changed')
+
+        assert store.get('abcdef', str(tmp_path / 'again.epub'))
+        assert (tmp_path / 'again.epub').read_bytes() == b'ebook'
+
+    def test_evict_removes_least_recently_used(self, tmp_path):
+        store = ArtifactStore(str(tmp_path / 'store'), max_size=20)
+        for index, key in enumerate(['aa1', 'bb2', 'cc3']):
+            (tmp_path / f'{key}.epub').write_bytes(b'0123456789')
+            store.put(key, str(tmp_path / f'{key}.epub'))
+            path = os.path.join(str(tmp_path / 'store'), key[:2], key)
+            os.utime(path, ns=(index * 10 ** 9, index * 10 ** 9))
+
+        store.get('aa1', str(tmp_path / 'copy.epub'))  # marks aa1 as recently used
+        store.evict()
+
+        assert store.get('aa1', str(tmp_path / 'copy.epub'))
+        assert not store.get('bb2', str(tmp_path / 'copy.epub'))
+        assert store.get('cc3', str(tmp_path / 'copy.epub'))
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""Tests for `publish.changes` module.
+"""
+
+# pylint: disable=missing-docstring,no-self-use,invalid-name,protected-access
+
+import hashlib
+import os
+from unittest.mock import patch
+
+from publish.changes import ChangeDetector
+
+
+def write(path, text, age=10):
+    """Writes the file and backdates it, so its stat result is trusted."""
+    path.write_text(text)
+    mtime = path.stat().st_mtime - age
+    os.utime(str(path), (mtime, mtime))
+
+
+def sha256(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def test_get_hash(tmp_path):
+    write(tmp_path / 'a.md', 'a')
+    detector = ChangeDetector(str(tmp_path / 'index.json'))
+
+    assert detector.get_hash(str(tmp_path / 'a.md')) == sha256('a')
+    assert detector.get_hash(str(tmp_path / 'missing.md')) is None
+
+
+def test_get_hash_scans_only_once(tmp_path):
+    write(tmp_path / 'a.md', 'a')
+    detector = ChangeDetector(str(tmp_path / 'index.json'))
+    detector.scan([str(tmp_path / 'a.md')])
+
+    with patch('publish.changes._scan_directory') as mock_scan:
+        assert detector.get_hash(str(tmp_path / 'a.md')) == sha256('a')
+
+    assert mock_scan.call_count == 0
+
+
+def test_scan_lists_each_directory_once(tmp_path):
+    write(tmp_path / 'a.md', 'a')
+    write(tmp_path / 'b.md', 'b')
+    detector = ChangeDetector(str(tmp_path / 'index.json'))
+
+    with patch('os.scandir', wraps=os.scandir) as mock_scandir:
+        detector.scan([str(tmp_path / 'a.md'), str(tmp_path / 'b.md')])
+
+    assert mock_scandir.call_count == 1
+
+
+def test_scan_returns_changed_paths(tmp_path):
+    write(tmp_path / 'a.md', 'a')
+    write(tmp_path / 'b.md', 'b')
+    paths = [str(tmp_path / 'a.md'), str(tmp_path / 'b.md'), str(tmp_path / 'c.md')]
+    detector = ChangeDetector(str(tmp_path / 'index.json'))
+
+    assert detector.scan(paths) == paths[:2]
+    assert detector.scan(paths) == []
+
+    write(tmp_path / 'a.md', 'changed', age=5)
+    write(tmp_path / 'c.md', 'c')
+    os.remove(paths[1])
+
+    assert sorted(detector.scan(paths)) == sorted(paths)
+
+
+def test_hashes_only_files_whose_stat_changed(tmp_path):
+    write(tmp_path / 'a.md', 'a')
+    write(tmp_path / 'b.md', 'b')
+    paths = [str(tmp_path / 'a.md'), str(tmp_path / 'b.md')]
+    index = str(tmp_path / 'index.json')
+
+    detector = ChangeDetector(index)
+    detector.scan(paths)
+    detector.save()
+    assert detector.hashed == 2
+
+    write(tmp_path / 'b.md', 'bb', age=5)
+
+    detector = ChangeDetector(index)
+    assert detector.scan(paths) == [paths[1]]
+    assert detector.hashed == 1
+    assert detector.get_hash(paths[1]) == sha256('bb')
+
+
+def test_hashes_recently_modified_files_again(tmp_path):
+    (tmp_path / 'a.md').write_text('a')
+    index = str(tmp_path / 'index.json')
+
+    detector = ChangeDetector(index)
+    detector.scan([str(tmp_path / 'a.md')])
+    detector.save()
+
+    detector = ChangeDetector(index)
+    detector.scan([str(tmp_path / 'a.md')])
+
+    assert detector.hashed == 1
+
+
+def test_ignores_invalid_index(tmp_path):
+    write(tmp_path / 'a.md', 'a')
+    (tmp_path / 'index.json').write_text('{"version": 0}')
+    detector = ChangeDetector(str(tmp_path / 'index.json'))
+
+    assert detector.get_hash(str(tmp_path / 'a.md')) == sha256('a')
+    assert detector.hashed == 1
+
+
+def test_ignores_directories(tmp_path):
+    (tmp_path / 'a.md').mkdir()
+    detector = ChangeDetector(str(tmp_path / 'index.json'))
+
+    assert detector.get_hash(str(tmp_path / 'a.md')) is None
+
+
+def backdate(path, age=10):
+    mtime = path.stat().st_mtime - age
+    os.utime(str(path), (mtime, mtime))
+
+
+def test_list_directory_lists_until_directory_changes(tmp_path):
+    (tmp_path / 'chapters' / 'part').mkdir(parents=True)
+    write(tmp_path / 'chapters' / 'a.md', 'a')
+    backdate(tmp_path / 'chapters')
+    index = str(tmp_path / 'index.json')
+    detector = ChangeDetector(index)
+
+    assert detector.list_directory(str(tmp_path / 'chapters')) == (['a.md'], ['part'])
+    assert detector.list_directory(str(tmp_path / 'chapters')) == (['a.md'], ['part'])
+    assert detector.listed == 1
+
+    detector.save()
+    detector = ChangeDetector(index)
+
+    assert detector.list_directory(str(tmp_path / 'chapters')) == (['a.md'], ['part'])
+    assert detector.listed == 0
+
+    write(tmp_path / 'chapters' / 'b.md', 'b')
+    backdate(tmp_path / 'chapters', age=5)
+
+    assert sorted(detector.list_directory(str(tmp_path / 'chapters'))[0]) == ['a.md', 'b.md']
+    assert detector.listed == 1
+
+
+def test_list_directory_lists_recently_changed_directory_again(tmp_path):
+    write(tmp_path / 'a.md', 'a')
+    detector = ChangeDetector(None)
+
+    detector.list_directory(str(tmp_path))
+    detector.list_directory(str(tmp_path))
+
+    assert detector.listed == 2
+
+
+def test_list_directory_missing_directory(tmp_path):
+    write(tmp_path / 'a.md', 'a')
+    detector = ChangeDetector(None)
+
+    assert detector.list_directory(str(tmp_path / 'missing')) == ([], [])
+    assert detector.list_directory(str(tmp_path / 'a.md')) == ([], [])
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""Tests for `publish.cli` module.
+"""
+
+# pylint: disable=missing-docstring,no-self-use,invalid-name,redefined-outer-name
+
+import logging
+import subprocess  # nosec
+import sys
+
+import pytest
+
+from publish.cli import main, parse_args
+from publish.ebookconvert import get_version
+from publish.template import TemplateRegistry
+
+STARTUP_IMPORTS = 'import publish.cli, publish.build, publish.yaml, publish.output'
+"""The imports of `publish --help` and of a build with nothing to do."""
+
+HEAVY_MODULES = ('asyncio', 'jinja2', 'markdown', 'multiprocessing', 'pkg_resources',
+                 'publish.epub', 'ruamel.yaml')
+"""Modules only the commands actually rendering, converting or parsing may import."""
+
+
+PROJECT = """
+title: My book
+chapters:
+  - src: chapter.md
+outputs:
+  - path: book.html
+"""
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    (tmp_path / '.publish.yml').write_text(PROJECT)
+    (tmp_path / 'chapter.md').write_text('# Chapter\n\nText.\n')
+    monkeypatch.chdir(tmp_path)
+    # main enables the bytecode cache of the shared registry, relative to the project.
+    monkeypatch.setattr('publish.template.REGISTRY', TemplateRegistry())
+    return tmp_path
+
+
+def run_main(args, caplog):
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        main(args)
+    return [record.getMessage() for record in caplog.records]
+
+
+def get_imported_modules(statement):
+    """Runs the statement with `python -X importtime` and returns the names of all modules it
+    imported."""
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],  # nosec
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True, check=True)
+
+    return {line.split('|')[-1].strip() for line in process.stderr.splitlines()
+            if line.startswith('import time:') and 'cumulative' not in line}
+
+
+def test_parse_args_defaults():
+    arguments = parse_args([])
+
+    assert arguments.jobs is None
+    assert arguments.cache
+    assert not arguments.watch
+
+
+def test_parse_args_no_cache():
+    assert not parse_args(['--no-cache']).cache
+
+
+def test_parse_args_jobs():
+    assert parse_args(['--jobs', '4']).jobs == 4
+    assert parse_args(['-j', '2']).jobs == 2
+
+
+def test_parse_args_watch():
+    assert parse_args(['--watch']).watch
+
+
+def test_parse_args_profile_substitutions():
+    assert not parse_args([]).profile_substitutions
+    assert parse_args(['--profile-substitutions']).profile_substitutions
+
+
+def test_parse_args_explain_substitutions():
+    assert not parse_args([]).explain_substitutions
+    assert parse_args(['--explain-substitutions']).explain_substitutions
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason='-X importtime requires Python 3.7')
+def test_startup_does_not_import_heavy_modules():
+    imported = get_imported_modules(STARTUP_IMPORTS)
+
+    assert [name for name in HEAVY_MODULES if name in imported] == []
+
+
+def test_main_skips_up_to_date_outputs(project, caplog):
+    messages = run_main([], caplog)
+
+    assert '[book.html] Up to date, skipping' not in messages
+    assert '<h1>Chapter</h1>' in (project / 'book.html').read_text()
+    assert (project / '.publish-cache' / 'manifest.json').exists()
+
+    assert '[book.html] Up to date, skipping' in run_main([], caplog)
+
+    (project / 'chapter.md').write_text('# Changed\n')
+
+    assert '[book.html] Up to date, skipping' not in run_main([], caplog)
+    assert '<h1>Changed</h1>' in (project / 'book.html').read_text()
+
+
+def test_main_no_cache_makes_outputs_again(project, caplog):
+    run_main([], caplog)
+    (project / 'book.html').write_text('stale')
+
+    messages = run_main(['--no-cache'], caplog)
+
+    assert '[book.html] Up to date, skipping' not in messages
+    assert '<h1>Chapter</h1>' in (project / 'book.html').read_text()
+
+
+def test_main_exits_when_ebook_convert_is_missing(project, monkeypatch,
+                                                  caplog):
+    (project / '.publish.yml').write_text(PROJECT.replace('book.html', 'book.mobi'))
+    (project / 'bin').mkdir()
+    monkeypatch.setenv('PATH', str(project / 'bin'))
+    get_version.cache_clear()
+
+    try:
+        with pytest.raises(SystemExit) as exc_info:
+            run_main([], caplog)
+    finally:
+        get_version.cache_clear()
+
+    assert exc_info.value.code != 0
+    assert [record.levelno for record in caplog.records].count(logging.ERROR) == 1
+    assert not (project / 'book.mobi').exists()
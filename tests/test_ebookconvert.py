@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""Tests for `publish.ebookconvert` module.
+
+The tests run against a stub ebook-convert script put on the PATH instead of calibre.
+"""
+
+# pylint: disable=missing-docstring,no-self-use,invalid-name,redefined-outer-name
+
+import logging
+import os
+import sys
+import time
+
+import pytest
+
+from publish.book import Book, Chapter
+from publish.build import BuildContext, BuildManifest, build
+from publish.cache import ArtifactStore
+from publish.ebookconvert import (EbookConvertError, EbookConvertNotFoundError,
+                                  EbookConvertTimeoutError, convert, get_version)
+from publish.output import EbookConvertOutput
+
+pytestmark = pytest.mark.skipif(os.name != 'posix', reason='stub script requires posix')
+
+STUB = '''#!{python}
+import os, sys, time
+if sys.argv[1:] == ['--version']:
+    print('ebook-convert (calibre 7.0.0)')
+    sys.exit(0)
+if 'STUB_CALLS' in os.environ:
+    with open(os.environ['STUB_CALLS'], 'a') as calls:
+        calls.write(' '.join(sys.argv[3:]) + '\\n')
+print('converting', sys.argv[1], 'to', sys.argv[2], flush=True)
+print('a warning', file=sys.stderr, flush=True)
+mode = os.environ.get('STUB_MODE', '')
+if mode == 'fail':
+    sys.exit(3)
+if mode == 'hang':
+    if os.fork() == 0:
+        time.sleep(60)
+    time.sleep(60)
+if mode == 'memory':
+    data = bytearray(64 * 1024 * 1024)
+with open(sys.argv[2], 'w') as file:
+    file.write(open(sys.argv[1]).read())
+'''
+
+
+@pytest.fixture
+def stub_ebook_convert(tmp_path, monkeypatch):
+    bin_directory = tmp_path / 'bin'
+    bin_directory.mkdir()
+    stub = bin_directory / 'ebook-convert'
+    stub.write_text(STUB.format(python=sys.executable))
+    stub.chmod(0o755)
+    monkeypatch.setenv('PATH', str(bin_directory) + os.pathsep + os.environ['PATH'])
+    get_version.cache_clear()
+    yield stub
+    get_version.cache_clear()
+
+
+def test_convert_captures_output(stub_ebook_convert, tmp_path):
+    (tmp_path / 'in.html').write_text('<p>Hello</p>')
+
+    result = convert(['ebook-convert', str(tmp_path / 'in.html'), str(tmp_path / 'out.epub')])
+
+    assert result.returncode == 0
+    assert result.stdout.startswith('converting')
+    assert result.stderr == 'a warning\n'
+    assert (tmp_path / 'out.epub').read_text() == '<p>Hello</p>'
+    assert result.seconds > 0
+    assert result.cpu_seconds is None or result.cpu_seconds > 0
+
+
+def test_convert_records_peak_memory(stub_ebook_convert, tmp_path, monkeypatch):
+    (tmp_path / 'in.html').write_text('')
+    monkeypatch.setenv('STUB_MODE', 'memory')
+
+    result = convert(['ebook-convert', str(tmp_path / 'in.html'), str(tmp_path / 'out.epub')])
+
+    if not hasattr(os, 'wait4'):
+        pytest.skip('platform does not support os.wait4')
+    assert result.max_rss > 64 * 1024 * 1024
+
+
+def test_convert_streams_output(stub_ebook_convert, tmp_path, caplog):
+    (tmp_path / 'in.html').write_text('')
+
+    with caplog.at_level(logging.INFO):
+        convert(['ebook-convert', str(tmp_path / 'in.html'), str(tmp_path / 'out.epub')],
+                stream_output=True)
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert 'a warning' in messages
+    assert any(message.startswith('converting') for message in messages)
+
+
+def test_convert_raises_error_on_non_zero_exit_code(stub_ebook_convert, tmp_path, monkeypatch):
+    monkeypatch.setenv('STUB_MODE', 'fail')
+
+    with pytest.raises(EbookConvertError, match='exit code 3') as exc_info:
+        convert(['ebook-convert', str(tmp_path / 'in.html'), str(tmp_path / 'out.epub')])
+
+    assert exc_info.value.result.returncode == 3
+    assert exc_info.value.result.stderr == 'a warning\n'
+
+
+def test_convert_kills_process_group_on_timeout(stub_ebook_convert, tmp_path, monkeypatch):
+    monkeypatch.setenv('STUB_MODE', 'hang')
+    start = time.perf_counter()
+
+    with pytest.raises(EbookConvertTimeoutError) as exc_info:
+        convert(['ebook-convert', str(tmp_path / 'in.html'), str(tmp_path / 'out.epub')],
+                timeout=1)
+
+    assert time.perf_counter() - start < 10
+    assert exc_info.value.result.returncode < 0
+
+
+def test_convert_missing_executable_raises_file_not_found(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        convert([str(tmp_path / 'missing-ebook-convert')])
+
+
+def test_ebook_convert_output_make(stub_ebook_convert, tmp_path):
+    book = Book('title')
+    book.chapters.append(Chapter('tests/resources/1.md'))
+    output = EbookConvertOutput(str(tmp_path / 'book.epub'), timeout=30)
+
+    output.make(book)
+
+    assert '<h1>This is the first file</h1>' in (tmp_path / 'book.epub').read_text()
+    assert output.conversion_result.returncode == 0
+
+
+def test_ebook_convert_output_make_raises_error(stub_ebook_convert, tmp_path, monkeypatch):
+    monkeypatch.setenv('STUB_MODE', 'fail')
+    book = Book('title')
+    book.chapters.append(Chapter('tests/resources/1.md'))
+
+    with pytest.raises(EbookConvertError):
+        EbookConvertOutput(str(tmp_path / 'book.epub')).make(book)
+
+
+def test_ebook_convert_output_make_without_ebook_convert_raises_error(tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', str(tmp_path))
+    book = Book('title')
+    book.chapters.append(Chapter('tests/resources/1.md'))
+    manifest = BuildManifest(str(tmp_path / 'manifest.json'))
+    output = EbookConvertOutput(str(tmp_path / 'book.epub'))
+    (tmp_path / 'book.epub').write_text('previous')
+
+    with pytest.raises(EbookConvertNotFoundError):
+        build(book, [], [output], manifest=manifest)
+
+    assert not manifest.is_up_to_date(output.path, manifest.get_fingerprint(book, [], output))
+
+
+def test_get_version(stub_ebook_convert, tmp_path):
+    assert get_version() == 'ebook-convert (calibre 7.0.0)'
+    assert get_version(str(tmp_path / 'missing-ebook-convert')) is None
+
+
+def test_ebook_convert_output_make_uses_artifact_store(stub_ebook_convert, tmp_path,
+                                                       monkeypatch):
+    calls = tmp_path / 'calls.txt'
+    monkeypatch.setenv('STUB_CALLS', str(calls))
+    cover = tmp_path / 'cover.jpg'
+    cover.write_bytes(b'cover')
+    book = Book('title', cover=str(cover))
+    book.chapters.append(Chapter('tests/resources/1.md'))
+    context = BuildContext(artifacts=ArtifactStore(str(tmp_path / 'artifacts')))
+    first = EbookConvertOutput(str(tmp_path / 'first.epub'))
+    second = EbookConvertOutput(str(tmp_path / 'second.epub'))
+
+    first.make(book, context=context)
+    second.make(book, context=context)
+
+    assert len(calls.read_text().splitlines()) == 1
+    assert (tmp_path / 'second.epub').read_text() == (tmp_path / 'first.epub').read_text()
+    assert second.conversion_result is None
+    assert not list(tmp_path.glob('*.part.epub'))
+
+    cover.write_bytes(b'new cover')
+    second.make(book, context=context)
+    EbookConvertOutput(str(tmp_path / 'book.mobi')).make(book, context=context)
+
+    assert len(calls.read_text().splitlines()) == 3
+    assert context.artifacts.hits == 1
+
+
+def test_ebook_convert_output_make_keeps_output_on_error(stub_ebook_convert, tmp_path,
+                                                         monkeypatch):
+    book = Book('title')
+    book.chapters.append(Chapter('tests/resources/1.md'))
+    (tmp_path / 'book.epub').write_text('previous')
+    monkeypatch.setenv('STUB_MODE', 'fail')
+
+    with pytest.raises(EbookConvertError):
+        EbookConvertOutput(str(tmp_path / 'book.epub')).make(book)
+
+    assert (tmp_path / 'book.epub').read_text() == 'previous'
+    assert not (tmp_path / 'book.part.epub').exists()
+
+
+def test_ebook_convert_output_make_split_chapters(stub_ebook_convert, tmp_path, monkeypatch):
+    calls = tmp_path / 'calls.txt'
+    monkeypatch.setenv('STUB_CALLS', str(calls))
+    book = Book('title')
+    book.chapters.extend([Chapter('tests/resources/1.md'), Chapter('tests/resources/2.md')])
+    context = BuildContext(artifacts=ArtifactStore(str(tmp_path / 'artifacts')))
+    output = EbookConvertOutput(str(tmp_path / 'book.epub'), split_chapters=True)
+
+    output.make(book, context=context)
+
+    package = (tmp_path / 'book.epub').read_text()
+    assert '<itemref idref="chapter-0001"/>\n<itemref idref="chapter-0002"/>' in package
+    assert 'converting' in output.conversion_result.stdout
+    assert output.conversion_result.args[1].endswith('content.opf')
+
+    EbookConvertOutput(str(tmp_path / 'copy.epub'), split_chapters=True,
+                       streaming=True).make(book, context=context)
+
+    assert len(calls.read_text().splitlines()) == 1
+    assert (tmp_path / 'copy.epub').read_text() == package
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""Tests for `publish.epub` module.
+"""
+
+# pylint: disable=missing-docstring,no-self-use,invalid-name
+
+import pathlib
+import posixpath
+import zipfile
+from xml.etree import ElementTree
+
+import pytest
+
+from publish.book import Book, Chapter
+from publish.build import BuildContext, BuildManifest, build
+from publish.cache import RenderCache
+from publish.epub import EpubOutput, get_identifier, stage_book, to_xhtml
+from publish.output import NoChaptersFoundError
+from publish.substitution import SimpleSubstitution
+
+NAMESPACES = {'container': 'urn:oasis:names:tc:opendocument:xmlns:container',
+              'opf': 'http://www.idpf.org/2007/opf',
+              'dc': 'http://purl.org/dc/elements/1.1/',
+              'xhtml': 'http://www.w3.org/1999/xhtml',
+              'ncx': 'http://www.daisy.org/z3986/2005/ncx/'}
+
+PNG = (b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00'
+       b'\x00\x1f\x15\xc4\x89\x00\x00\x00\rIDATx\x9cc\xf8\x0f\x00\x00\x01\x01\x00\x05\x18\xd8N'
+       b'\x00\x00\x00\x00IEND\xaeB`\x82')
+
+
+def check_epub(path):
+    """Checks the structure of an EPUB3 file the way an EPUB checker does and returns its
+    package document."""
+    with zipfile.ZipFile(path) as epub:
+        infos = epub.infolist()
+
+        assert infos[0].filename == 'mimetype'
+        assert infos[0].compress_type == zipfile.ZIP_STORED
+        assert not infos[0].extra
+        assert epub.read('mimetype') == b'application/epub+zip'
+        assert epub.testzip() is None
+
+        container = ElementTree.fromstring(epub.read('META-INF/container.xml'))
+        rootfile = container.find('container:rootfiles/container:rootfile', NAMESPACES)
+        assert rootfile.get('media-type') == 'application/oebps-package+xml'
+        opf_path = rootfile.get('full-path')
+        base = posixpath.dirname(opf_path)
+
+        package = ElementTree.fromstring(epub.read(opf_path))
+        assert package.get('version') == '3.0'
+        identifier = package.find('opf:metadata/dc:identifier', NAMESPACES)
+        assert identifier.get('id') == package.get('unique-identifier')
+        assert identifier.text
+        assert package.find('opf:metadata/dc:title', NAMESPACES).text
+        assert package.find('opf:metadata/dc:language', NAMESPACES).text
+        assert package.find("opf:metadata/opf:meta[@property='dcterms:modified']",
+                            NAMESPACES) is not None
+
+        items = {item.get('id'): item for item in package.find('opf:manifest', NAMESPACES)}
+        hrefs = {posixpath.join(base, item.get('href')): item for item in items.values()}
+        assert set(hrefs) == {info.filename for info in infos} - {'mimetype', opf_path,
+                                                                  'META-INF/container.xml'}
+        assert [item.get('properties') for item in items.values()].count('nav') == 1
+
+        spine = package.find('opf:spine', NAMESPACES)
+        assert items[spine.get('toc')].get('media-type') == 'application/x-dtbncx+xml'
+        assert len(spine)
+        for itemref in spine:
+            assert items[itemref.get('idref')].get('media-type') == 'application/xhtml+xml'
+
+        for href, item in hrefs.items():
+            if item.get('media-type') in ('application/xhtml+xml', 'application/x-dtbncx+xml'):
+                document = ElementTree.fromstring(epub.read(href))
+
+                for element in document.iter():
+                    link = element.get('href') or element.get('src')
+                    if link and ':' not in link and not link.startswith('#'):
+                        assert posixpath.join(posixpath.dirname(href),
+                                              link.split('#')[0]) in hrefs, link
+
+        nav = next(item for item in items.values() if item.get('properties') == 'nav')
+        nav_document = ElementTree.fromstring(epub.read(posixpath.join(base, nav.get('href'))))
+        assert nav_document.find(".//xhtml:nav[@{http://www.idpf.org/2007/ops}type='toc']",
+                                 NAMESPACES) is not None
+
+    return package
+
+
+def get_book(tmp_path, *contents, **kwargs):
+    book = Book(title='Example & more', authors='Ann One & Bob Two', language='en', **kwargs)
+
+    for index, content in enumerate(contents):
+        path = tmp_path / f'chapter {index + 1}.md'
+        path.write_text(content, encoding='utf-8')
+        book.chapters.append(Chapter(src=str(path)))
+
+    return book
+
+
+def test_make_writes_valid_epub(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'cover.png').write_bytes(PNG)
+    (tmp_path / 'figure.png').write_bytes(PNG)
+    (tmp_path / 'style.css').write_text('p { margin: 0; }')
+    book = get_book(tmp_path,
+                    '# First\n\nSome *text* & Cows<br>\n\n![a figure](figure.png)',
+                    'No heading, just <b>unclosed bold and a stray </i>\n\n'
+                    '![again](figure.png) ![remote](https://example.com/x.png)',
+                    cover='cover.png', series='Series', series_index=2, tags='a, b',
+                    isbn='123')
+    output = EpubOutput(str(tmp_path / 'book.epub'), stylesheet='style.css')
+
+    output.make(book, [SimpleSubstitution('Cows', 'Substitutions')])
+
+    package = check_epub(output.path)
+    metadata = package.find('opf:metadata', NAMESPACES)
+    assert metadata.find('dc:identifier', NAMESPACES).text == 'urn:isbn:123'
+    assert metadata.find('dc:title', NAMESPACES).text == 'Example & more'
+    assert [creator.text for creator in metadata.findall('dc:creator', NAMESPACES)] == \
+        ['Ann One', 'Bob Two']
+    assert [subject.text for subject in metadata.findall('dc:subject', NAMESPACES)] == \
+        ['a', 'b']
+    assert metadata.find("opf:meta[@property='group-position']", NAMESPACES).text == '2'
+
+    with zipfile.ZipFile(output.path) as epub:
+        names = epub.namelist()
+        first = epub.read('OEBPS/chapter-0001.xhtml').decode('utf-8')
+        second = epub.read('OEBPS/chapter-0002.xhtml').decode('utf-8')
+        ncx = ElementTree.fromstring(epub.read('OEBPS/toc.ncx'))
+        assert epub.read('OEBPS/style.css') == b'p { margin: 0; }'
+
+    assert names.count('OEBPS/images/image-0002.png') == 1
+    assert 'OEBPS/cover.png' in names
+    assert 'Substitutions' in first
+    assert 'src="images/image-0002.png"' in first and 'src="images/image-0002.png"' in second
+    assert 'src="https://example.com/x.png"' in second
+    assert [text.text for text in ncx.iterfind('.//ncx:navLabel/ncx:text', NAMESPACES)] == \
+        ['First', 'chapter 2']
+    assert not (tmp_path / 'book.epub.part').exists()
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_make_streaming_and_cache_produce_same_chapters(tmp_path, streaming):
+    book = get_book(tmp_path, '# One\n\n[link][ref]', '# Two\n\n[ref]: http://example.com')
+    output = EpubOutput(str(tmp_path / 'book.epub'), streaming=streaming)
+    context = BuildContext(RenderCache(str(tmp_path / 'cache')))
+
+    output.make(book, context=context)
+    output.make(book, context=context)
+
+    check_epub(output.path)
+    with zipfile.ZipFile(output.path) as epub:
+        assert 'href="http://example.com"' in epub.read('OEBPS/chapter-0001.xhtml').decode()
+        assert 'OEBPS/chapter-0003.xhtml' not in epub.namelist()
+
+
+def test_build_makes_epub_again_when_image_changes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'img.png').write_bytes(PNG)
+    book = get_book(tmp_path, '![an image](img.png)')
+    manifest_path = str(tmp_path / 'manifest.json')
+
+    def build_epub():
+        output = EpubOutput(str(tmp_path / 'book.epub'))
+        return output, build(book, outputs=[output], manifest=BuildManifest(manifest_path))[0]
+
+    output, result = build_epub()
+    assert not result.skipped
+    assert output.images == ['img.png']
+
+    output, result = build_epub()
+    assert result.skipped
+    assert output.images == ['img.png']
+
+    (tmp_path / 'img.png').write_bytes(PNG + b'changed')
+    _, result = build_epub()
+
+    assert not result.skipped
+    with zipfile.ZipFile(str(tmp_path / 'book.epub')) as epub:
+        assert epub.read('OEBPS/images/image-0001.png') == PNG + b'changed'
+
+
+def test_make_without_chapters_raises_error(tmp_path):
+    with pytest.raises(NoChaptersFoundError):
+        EpubOutput(str(tmp_path / 'book.epub')).make(Book(title='title'))
+
+    assert not (tmp_path / 'book.epub').exists()
+
+
+def test_make_skips_missing_cover(tmp_path):
+    book = get_book(tmp_path, 'Text', cover='missing.jpg')
+    output = EpubOutput(str(tmp_path / 'book.epub'))
+
+    output.make(book)
+
+    package = check_epub(output.path)
+    assert package.find("opf:metadata/opf:meta[@name='cover']", NAMESPACES) is None
+
+
+def test_stage_book_writes_same_files_twice(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'cover.png').write_bytes(PNG)
+    book = get_book(tmp_path, '# One', '# Two', cover='cover.png')
+    staged = []
+
+    for name in ('first', 'second'):
+        directory = tmp_path / name
+        directory.mkdir()
+        package_path = stage_book(str(directory), book, book.chapters,
+                                  ['<h1>One</h1>', '<h1>Two</h1>'])
+        staged.append({path.relative_to(directory): path.read_bytes()
+                       for path in directory.rglob('*') if path.is_file()})
+
+    assert package_path == str(tmp_path / 'second' / 'content.opf')
+    assert staged[0] == staged[1]
+    assert {str(path) for path in staged[0]} == {'content.opf', 'nav.xhtml', 'toc.ncx',
+                                                 'style.css', 'cover.png',
+                                                 'chapter-0001.xhtml', 'chapter-0002.xhtml'}
+
+    package = ElementTree.fromstring(staged[0][pathlib.Path('content.opf')])
+    assert [itemref.get('idref') for itemref in package.find('opf:spine', NAMESPACES)] == \
+        ['chapter-0001', 'chapter-0002']
+
+
+def test_get_identifier_is_stable():
+    assert get_identifier(Book(title='a', authors='b')) == \
+        get_identifier(Book(title='a', authors='b'))
+    assert get_identifier(Book(title='a', authors='b')).startswith('urn:uuid:')
+    assert get_identifier(Book(title='a', authors='c')) != \
+        get_identifier(Book(title='a', authors='b'))
+
+
+def test_to_xhtml():
+    xhtml, heading = to_xhtml('<h2 id="x">A &amp; <em>B</em></h2><p>1 < 2<br><img src="a.png" '
+                              'alt="x" alt="y" hidden><!-- a -- b -->\x0c<ul><li>one<li>two'
+                              '</ul>',
+                              lambda src: f'images/{src}')
+
+    assert heading == 'A & B'
+    assert xhtml == ('<h2 id="x">A &amp; <em>B</em></h2><p>1 &lt; 2<br/>'
+                     '<img src="images/a.png" alt="x" hidden="hidden"/><!-- a - - b -->'
+                     '<ul><li>one<li>two</li></li></ul></p>')
+    ElementTree.fromstring(f'<div>{xhtml}</div>')
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""Tests for `publish.mapped` module.
+"""
+
+# pylint: disable=missing-docstring,no-self-use,invalid-name
+
+import random
+import re
+
+import pytest
+
+from publish.mapped import (get_bytes_substitution, map_file, read_substituted,
+                            split_bytes_substitutions, substitute_buffer)
+from publish.substitution import (SimpleSubstitution, RegexSubstitution, TranslateSubstitution,
+                                  FusedSubstitution, apply_substitutions, compile_substitutions)
+
+
+@pytest.mark.parametrize('pattern', [
+    r'"([^"]*)"',
+    r'\+\+(.*?)\+\+',
+    r'.*?"',
+    r'café',
+    r'(?a)\w+\b',
+    r'^#+ ',
+    r'[a-z]{2}',
+    r'(?<=é)a',
+])
+def test_get_bytes_substitution_safe_patterns(pattern):
+    assert get_bytes_substitution(RegexSubstitution(pattern, '')) is not None
+
+
+@pytest.mark.parametrize('pattern', [
+    r'a.b',
+    r'é+',
+    r'[éa]',
+    r'\w+',
+    r'\bword',
+    r'(?i)café',
+    r'\xe9',
+    r'.{2,}',
+    r'[^"]{3}',
+    r'.+?',
+    r'a*',
+    r'[^"]+[^a]',
+])
+def test_get_bytes_substitution_unsafe_patterns(pattern):
+    assert get_bytes_substitution(RegexSubstitution(pattern, '')) is None
+
+
+def test_get_bytes_substitution_other_types():
+    assert get_bytes_substitution(SimpleSubstitution('é', 'e')).old == 'é'.encode('utf-8')
+    assert get_bytes_substitution(SimpleSubstitution('', 'e')) is None
+    assert get_bytes_substitution(TranslateSubstitution({'a': 'b'})) is None
+
+
+def test_split_bytes_substitutions_stops_at_first_text_substitution():
+    substitutions = [RegexSubstitution('a', 'b'),
+                     TranslateSubstitution({'b': 'c'}),
+                     SimpleSubstitution('c', 'd')]
+
+    bytes_substitutions, remaining = split_bytes_substitutions(substitutions)
+
+    assert [substitution for substitution, _ in bytes_substitutions] == substitutions[:1]
+    assert remaining == substitutions[1:]
+
+
+def test_split_bytes_substitutions_unpacks_fused_substitutions():
+    substitutions = [RegexSubstitution('[0-9]+%', 'percent'),
+                     RegexSubstitution('[A-Z]{3,}', 'abbreviation')]
+    fused = FusedSubstitution(substitutions)
+
+    bytes_substitutions, remaining = split_bytes_substitutions([fused])
+
+    assert [substitution for substitution, _ in bytes_substitutions] == substitutions
+    assert not remaining
+    assert substitute_buffer(b'NASA 50%', [fused]) == 'abbreviation percent'
+
+
+def test_substitute_buffer_prefilters_literals():
+    substitution = RegexSubstitution(r'\+\+(.*?)\+\+', r'<b>\1</b>')
+
+    assert substitute_buffer(b'no markup', [substitution]) == 'no markup'
+    assert substitute_buffer(b'++bold++', [substitution]) == '<b>bold</b>'
+    assert (substitution.skipped, substitution.applied) == (1, 1)
+
+
+def test_substitute_buffer_translates_carriage_returns():
+    substitutions = [RegexSubstitution(r'(?m)a$', 'b')]
+
+    assert substitute_buffer(b'a\r\na\ra\n', substitutions) == 'b\nb\nb\n'
+
+
+def test_substitute_buffer_invalid_utf8_raises_error():
+    with pytest.raises(UnicodeDecodeError):
+        substitute_buffer(b'caf\xe9', [])
+
+
+def test_substitute_buffer_matches_text_substitutions():
+    patterns = [r'"([^"]*)"', r'.*é', r'a.*?b', r'[^a]*?b', r'(?a)\w+', r'a.b', r'é+',
+                r'[a-zé]+', r'.+', r'.+?', r'x{2}']
+    alphabet = 'aé"bcx\n€'
+    rng = random.Random(1)
+
+    for _ in range(500):
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 16)))
+        substitutions = [RegexSubstitution(pattern, r'[\g<0>]')
+                         for pattern in rng.sample(patterns, 2)]
+        substitutions.append(SimpleSubstitution('é', 'e€'))
+
+        expected = apply_substitutions(text, substitutions)
+        actual = substitute_buffer(text.encode('utf-8'), compile_substitutions(substitutions))
+
+        assert actual == expected, (text, [s.regular_expression.pattern
+                                           for s in substitutions[:2]])
+
+
+def test_read_substituted(tmp_path):
+    path = tmp_path / 'chapter.md'
+    path.write_bytes('# Café\n\n"quoted"'.encode('utf-8'))
+
+    actual = read_substituted(str(path), [RegexSubstitution(r'"([^"]*)"', r'“\1”')])
+
+    assert actual == '# Café\n\n“quoted”'
+
+
+def test_map_file_empty_file(tmp_path):
+    path = tmp_path / 'empty.md'
+    path.write_bytes(b'')
+
+    with map_file(str(path)) as buffer:
+        assert buffer == b''
+
+    assert read_substituted(str(path), [SimpleSubstitution('a', 'b')]) == ''
+
+
+def test_map_file_closes_mapping(tmp_path):
+    path = tmp_path / 'chapter.md'
+    path.write_bytes(b'content')
+
+    with map_file(str(path)) as buffer:
+        assert re.search(b'tent', buffer)
+
+    assert buffer.closed
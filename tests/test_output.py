@@ -21,7 +21,7 @@ import os
 import pytest
 
 from publish import __version__ as package_version
-from publish.book import Book, Chapter
+from publish.book import Book, Chapter, ChapterSelector
 # noinspection PyProtectedMember
 from publish.output import (SUPPORTED_EBOOKCONVERT_ATTRIBUTES,
                             _apply_template,
@@ -30,7 +30,10 @@ from publish.output import (SUPPORTED_EBOOKCONVERT_ATTRIBUTES,
                             HtmlOutput,
                             NoChaptersFoundError,
                             EbookConvertOutput)
-from publish.substitution import Substitution, SimpleSubstitution
+from publish.cache import RenderCache
+from publish.changes import ChangeDetector
+from publish.render import render_chapters
+from publish.substitution import Substitution, SimpleSubstitution, RegexSubstitution
 from tests import get_test_book
 
 
@@ -96,6 +99,9 @@ class TestHtmlOutput:
         assert output.path == 'a'
         assert output.stylesheet is None
         assert output.force_publish is not True
+        assert output.jobs == 1
+        assert output.streaming is False
+        assert output.memory_map is False
 
     def test_get_chapters_to_be_published(self):
         output = HtmlOutputStub('a')
@@ -181,6 +187,47 @@ class TestHtmlOutput:
         mock_file_handle = mock_file()
         mock_file_handle.write.assert_called_once_with('document')
 
+    def test_make_streaming_matches_make(self, tmp_path):
+        book = Book('title', language='en')
+        book.chapters.extend([Chapter('tests/resources/1.md'),
+                              Chapter('tests/resources/2.md')])
+        substitutions = [SimpleSubstitution('text', 'content')]
+
+        HtmlOutput(str(tmp_path / 'expected.html'),
+                   stylesheet='tests/resources/test.css').make(book, substitutions)
+        HtmlOutput(str(tmp_path / 'actual.html'),
+                   stylesheet='tests/resources/test.css',
+                   streaming=True).make(book, substitutions)
+
+        assert (tmp_path / 'actual.html').read_text() == (tmp_path / 'expected.html').read_text()
+        assert not (tmp_path / 'actual.html.part').exists()
+
+    @pytest.mark.parametrize('streaming', [False, True])
+    def test_make_with_template_printing_content(self, tmp_path, streaming):
+        (tmp_path / 'template.jinja').write_text('<main>{{ content }}</main>')
+        book = Book('title', language='en')
+        book.chapters.extend([Chapter('tests/resources/1.md'),
+                              Chapter('tests/resources/2.md')])
+        output = HtmlOutput(str(tmp_path / 'out.html'),
+                            template=str(tmp_path / 'template.jinja'),
+                            streaming=streaming)
+
+        output.make(book)
+
+        assert (tmp_path / 'out.html').read_text() == \
+            f'<main>{output._get_html_content(book.chapters, [])}</main>'
+
+    def test_make_streaming_keeps_existing_file_on_error(self, tmp_path):
+        (tmp_path / 'out.html').write_text('previous')
+        book = Book('title')
+        book.chapters.append(Chapter(str(tmp_path / 'missing.md')))
+
+        with pytest.raises(FileNotFoundError):
+            HtmlOutput(str(tmp_path / 'out.html'), streaming=True).make(book)
+
+        assert (tmp_path / 'out.html').read_text() == 'previous'
+        assert not (tmp_path / 'out.html.part').exists()
+
 
 class TestEbookConvertOutput:
     def test_constructor(self):
@@ -322,6 +369,186 @@ def test_get_html_content():
     assert actual == expected
 
 
+def test_get_html_content_by_chapter_matches_single_document():
+    chapters = [Chapter('tests/resources/1.md'),
+                Chapter('tests/resources/2.md')]
+    substitutions = [SimpleSubstitution('text', 'content')]
+
+    expected = HtmlOutput('')._get_html_content(chapters, substitutions)
+    actual = HtmlOutput('', jobs=2)._get_html_content(chapters, substitutions)
+
+    assert actual == expected
+
+
+def test_get_html_content_accepts_substitution_generator():
+    chapters = [Chapter('tests/resources/1.md')]
+    substitutions = (s for s in [SimpleSubstitution('text', 'content')])
+
+    actual = HtmlOutput('')._get_html_content(chapters, substitutions)
+
+    assert '<p>With some content.</p>' in actual
+
+
+@pytest.mark.parametrize('jobs, cached', [(1, False), (2, False), (1, True)])
+def test_get_html_content_applies_selected_substitutions_only(tmp_path, jobs, cached):
+    chapters = [Chapter('tests/resources/1.md'),
+                Chapter('tests/resources/2.md', tags=['appendix'])]
+    substitutions = [SimpleSubstitution('With', 'Without',
+                                        ChapterSelector(paths='tests/resources/1.md')),
+                     SimpleSubstitution('text', 'content', ChapterSelector(tags='appendix'))]
+    cache = RenderCache(str(tmp_path)) if cached else None
+
+    actual = HtmlOutput('', jobs=jobs)._get_html_content(chapters, substitutions, cache)
+
+    assert '<p>Without some text.</p>' in actual
+    assert '<p>With some more content.</p>' in actual
+
+
+@pytest.mark.parametrize('jobs, cached', [(1, False), (2, False), (1, True)])
+def test_get_html_content_applies_substitutions_to_each_chapter(tmp_path, jobs, cached):
+    chapters = [Chapter('tests/resources/1.md'),
+                Chapter('tests/resources/2.md')]
+    substitutions = [RegexSubstitution(r'text\.\s+#', 'joined'),
+                     RegexSubstitution(r'\A# This is', '## This is')]
+    cache = RenderCache(str(tmp_path)) if cached else None
+
+    actual = HtmlOutput('', jobs=jobs)._get_html_content(chapters, substitutions, cache)
+
+    assert 'joined' not in actual
+    assert '<h2>This is the first file</h2>' in actual
+    assert '<h2>This is the second file</h2>' in actual
+
+
+def test_get_html_content_with_cache_matches_uncached(tmp_path):
+    chapters = [Chapter('tests/resources/1.md'),
+                Chapter('tests/resources/2.md')]
+    substitutions = [SimpleSubstitution('text', 'content')]
+    cache = RenderCache(str(tmp_path))
+
+    expected = HtmlOutput('')._get_html_content(chapters, substitutions)
+    first = HtmlOutput('')._get_html_content(chapters, substitutions, cache)
+    second = HtmlOutput('')._get_html_content(chapters, substitutions, cache)
+
+    assert first == expected
+    assert second == expected
+    assert cache.hits == 3
+
+
+def test_get_html_content_with_cache_renders_document_as_a_whole(tmp_path):
+    (tmp_path / 'a.md').write_text('- item one\n- item two')
+    (tmp_path / 'b.md').write_text('    continued item two')
+    chapters = [Chapter(str(tmp_path / 'a.md')),
+                Chapter(str(tmp_path / 'b.md'))]
+    cache = RenderCache(str(tmp_path / 'cache'))
+
+    expected = HtmlOutput('')._get_html_content(chapters, [])
+    first = HtmlOutput('')._get_html_content(chapters, [], cache)
+
+    with patch('publish.output.render_markdown') as mock_render:
+        second = HtmlOutput('')._get_html_content(chapters, [], cache)
+
+    mock_render.assert_not_called()
+    assert '<pre>' not in expected
+    assert first == expected
+    assert second == expected
+
+
+def test_get_html_content_with_cache_renders_changed_chapters_only(tmp_path):
+    (tmp_path / '1.md').write_text('# One\n\n[Link][two]')
+    (tmp_path / '2.md').write_text('# Two\n\n[two]: #two')
+    chapters = [Chapter(str(tmp_path / '1.md')),
+                Chapter(str(tmp_path / '2.md'))]
+    cache = RenderCache(str(tmp_path / 'cache'))
+
+    HtmlOutput('', jobs=2)._get_html_content(chapters, [], cache)
+    (tmp_path / '1.md').write_text('# Uno\n\n[Link][two]')
+
+    with patch('publish.output.render_chapters', wraps=render_chapters) as mock_render:
+        actual = HtmlOutput('', jobs=2)._get_html_content(chapters, [], cache)
+
+    assert mock_render.call_args[0][0] == ['# Uno\n\n[Link][two]']
+    assert actual == '<h1>Uno</h1>\n<p><a href="#two">Link</a></p>\n<h1>Two</h1>'
+
+
+def test_get_html_content_with_cache_invalidated_by_substitutions(tmp_path):
+    chapters = [Chapter('tests/resources/1.md')]
+    cache = RenderCache(str(tmp_path))
+
+    HtmlOutput('')._get_html_content(chapters, [SimpleSubstitution('text', 'content')], cache)
+    actual = HtmlOutput('')._get_html_content(chapters, [SimpleSubstitution('text', 'stuff')],
+                                              cache)
+
+    assert '<p>With some stuff.</p>' in actual
+
+
+@pytest.mark.parametrize('jobs, cached', [(1, False), (2, False), (1, True)])
+def test_get_html_content_memory_mapped_matches_read(tmp_path, jobs, cached):
+    (tmp_path / '1.md').write_bytes('# Café\n\n"Some" text.'.encode('utf-8'))
+    (tmp_path / '2.md').write_bytes(b'')
+    chapters = [Chapter(str(tmp_path / '1.md')),
+                Chapter(str(tmp_path / '2.md'))]
+    substitutions = [RegexSubstitution('"([^"]*)"', '“\\1”'),
+                     SimpleSubstitution('text', 'content'),
+                     SimpleSubstitution('é', 'e')]
+    cache = RenderCache(str(tmp_path / 'cache')) if cached else None
+    reference_cache = RenderCache(str(tmp_path / 'reference')) if cached else None
+
+    expected = HtmlOutput('', jobs=jobs)._get_html_content(chapters, substitutions,
+                                                           reference_cache)
+    actual = HtmlOutput('', jobs=jobs, memory_map=True)._get_html_content(chapters,
+                                                                          substitutions,
+                                                                          cache)
+    expected_streamed = ''.join(HtmlOutput('')._iter_html_content(chapters, substitutions))
+    streamed = ''.join(HtmlOutput('', memory_map=True)._iter_html_content(chapters,
+                                                                          substitutions,
+                                                                          cache))
+
+    assert actual == expected
+    assert streamed == expected_streamed
+    assert '<p>“Some” content.</p>' in expected
+
+
+def test_get_html_content_with_detector_reads_only_changed_chapters(tmp_path):
+    (tmp_path / '1.md').write_text('# One')
+    (tmp_path / '2.md').write_text('# Two')
+    chapters = [Chapter(str(tmp_path / '1.md')),
+                Chapter(str(tmp_path / '2.md'))]
+    HtmlOutput('')._get_html_content(chapters, [], RenderCache(str(tmp_path / 'cache')))
+    (tmp_path / '2.md').write_text('# Zwei')
+    cache = RenderCache(str(tmp_path / 'cache'),
+                        detector=ChangeDetector(str(tmp_path / 'index.json')))
+    cache.detector.scan([chapter.src for chapter in chapters])
+
+    with patch('publish.output.open', side_effect=open, create=True) as mock_open_:
+        actual = HtmlOutput('')._get_html_content(chapters, [], cache)
+
+    assert [call[0][0] for call in mock_open_.call_args_list] == [chapters[1].src]
+    assert actual == '<h1>One</h1>\n<h1>Zwei</h1>'
+
+
+def test_iter_html_content_matches_html_content(tmp_path):
+    (tmp_path / '1.md').write_text('# One\n\n[Link][two]')
+    (tmp_path / '2.md').write_text('# Two\n\n[two]: #two "Two"')
+    chapters = [Chapter(str(tmp_path / '1.md')),
+                Chapter(str(tmp_path / '2.md'))]
+    cache = RenderCache(str(tmp_path / 'cache'))
+
+    expected = HtmlOutput('', jobs=2)._get_html_content(chapters, [])
+    uncached = ''.join(HtmlOutput('')._iter_html_content(chapters, []))
+    cached = ''.join(HtmlOutput('')._iter_html_content(chapters, [], cache))
+    from_cache = ''.join(HtmlOutput('')._iter_html_content(chapters, [], cache))
+
+    assert uncached == expected
+    assert cached == expected
+    assert from_cache == expected
+    assert cache.hits == 4
+
+
+def test_iter_html_content_no_chapters_raises_error_eagerly():
+    with pytest.raises(NoChaptersFoundError):
+        HtmlOutput('')._iter_html_content([], [])
+
+
 def test_get_markdown_content_no_chapters_raises_error():
     output = HtmlOutput('')
     with pytest.raises(NoChaptersFoundError):
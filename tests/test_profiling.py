@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""Tests for `publish.profiling` module.
+"""
+
+# pylint: disable=missing-docstring,no-self-use,invalid-name
+
+import multiprocessing
+import re
+import time
+from unittest.mock import patch
+
+import pytest
+
+from publish.book import Book, Chapter
+from publish.output import HtmlOutput
+from publish.profiling import (ProbeWorker, explain_plan, format_profile, measure_substitution,
+                               probe_regular_expression, profile_substitutions)
+from publish.substitution import (Substitution, SimpleSubstitution, RegexSubstitution,
+                                  TranslateSubstitution)
+
+
+class UpperSubstitution(Substitution):
+    def apply_to(self, text: str) -> str:
+        return text.upper()
+
+
+def make_book(tmp_path, *texts):
+    book = Book(title='title')
+
+    for index, text in enumerate(texts):
+        path = tmp_path / f'{index}.md'
+        path.write_text(text, encoding='utf-8')
+        book.chapters.append(Chapter(src=str(path)))
+
+    return book
+
+
+def test_measure_simple_substitution():
+    text, seconds, matches, bytes_changed = measure_substitution(
+        SimpleSubstitution('ä', 'ae'), 'äbä')
+
+    assert text == 'aebae'
+    assert seconds >= 0
+    assert matches == 2
+    assert bytes_changed == 4
+
+
+def test_measure_simple_substitution_without_change():
+    _, _, matches, bytes_changed = measure_substitution(SimpleSubstitution('a', 'a'), 'aa')
+
+    assert matches == 2
+    assert bytes_changed == 0
+
+
+def test_measure_regex_substitution():
+    text, _, matches, bytes_changed = measure_substitution(
+        RegexSubstitution(r'(\w)(\w)', r'\2\1'), 'ab aa cd')
+
+    assert text == 'ba aa dc'
+    assert matches == 3
+    assert bytes_changed == 4
+
+
+def test_measure_unknown_substitution():
+    text, _, matches, bytes_changed = measure_substitution(UpperSubstitution(), 'a')
+
+    assert text == 'A'
+    assert matches is None
+    assert bytes_changed is None
+
+
+def test_profile_substitutions(tmp_path):
+    book = make_book(tmp_path, 'a b a', 'b')
+    substitutions = [SimpleSubstitution('a', 'b'), SimpleSubstitution('b', 'cc')]
+
+    profiles = profile_substitutions(book, substitutions, probe_timeout=None)
+
+    assert [profile.index for profile in profiles] == [1, 2]
+    assert profiles[0].total.matches == 2
+    assert profiles[1].total.matches == 4
+    assert profiles[1].total.bytes_changed == 4
+    assert profiles[1].chapters[book.chapters[0].src].matches == 3
+    assert profiles[1].chapters[book.chapters[1].src].matches == 1
+    assert all(profile.warning is None for profile in profiles)
+
+
+def test_profile_substitutions_keeps_unknown_counts(tmp_path):
+    book = make_book(tmp_path, 'a')
+
+    profiles = profile_substitutions(book, [UpperSubstitution(), SimpleSubstitution('A', 'b')],
+                                     probe_timeout=None)
+
+    assert profiles[0].total.matches is None
+    assert profiles[1].total.matches == 1
+
+
+def test_profile_substitutions_flags_catastrophic_backtracking(tmp_path):
+    book = make_book(tmp_path, 'text')
+
+    profiles = profile_substitutions(book,
+                                     [RegexSubstitution(r'\+\+(.*?)\+\+', r'<em>\1</em>'),
+                                      RegexSubstitution(r'(a+)+b', 'b')],
+                                     probe_timeout=1)
+
+    assert profiles[0].warning is None
+    assert 'did not finish' in profiles[1].warning
+
+
+def test_profile_substitutions_only_profiles_published_chapters(tmp_path):
+    book = make_book(tmp_path, 'a', 'aa')
+    book.chapters[1].publish = False
+    substitution = SimpleSubstitution('a', 'b')
+
+    profile, = profile_substitutions(book, [substitution], probe_timeout=None)
+    forced, = profile_substitutions(book, [substitution], probe_timeout=None,
+                                    outputs=[HtmlOutput('a.html'),
+                                             HtmlOutput('b.html', force_publish=True)])
+
+    assert list(profile.chapters) == [book.chapters[0].src]
+    assert profile.total.matches == 1
+    assert forced.total.matches == 3
+
+
+def test_profile_substitutions_reuses_probe_worker(tmp_path):
+    book = make_book(tmp_path, 'text')
+
+    with patch('publish.profiling.multiprocessing.Pool',
+               side_effect=multiprocessing.Pool) as mock_pool:
+        profiles = profile_substitutions(book,
+                                         [RegexSubstitution('a', 'b'),
+                                          RegexSubstitution('(a+)+b', 'b'),
+                                          RegexSubstitution('c', 'd'),
+                                          RegexSubstitution('e', 'f')],
+                                         probe_timeout=1)
+
+    assert 'did not finish' in profiles[1].warning
+    assert mock_pool.call_count == 2
+
+
+def test_probe_worker_replaces_process_after_timeout():
+    worker = ProbeWorker()
+
+    try:
+        assert worker.run(pow, (2, 3), timeout=5) == 8
+        with pytest.raises(multiprocessing.TimeoutError):
+            worker.run(time.sleep, (5,), timeout=0.1)
+        assert worker.run(pow, (2, 4), timeout=5) == 16
+    finally:
+        worker.close()
+
+
+def test_probe_regular_expression_quadratic():
+    warning = probe_regular_expression(re.compile(r'\s+$'), '', [(' ', 'x')], timeout=30)
+
+    assert 'grows with length^' in warning
+
+
+def test_format_profile(tmp_path):
+    book = make_book(tmp_path, 'a')
+    profiles = profile_substitutions(book,
+                                     [SimpleSubstitution('a', 'b'), UpperSubstitution()],
+                                     probe_timeout=None)
+    profiles[0].warning = 'too slow'
+
+    lines = format_profile(profiles)
+
+    assert any(line.endswith("'a' -> 'b'") for line in lines)
+    assert any(line.endswith('UpperSubstitution') and '?' in line for line in lines)
+    assert f'{book.chapters[0].src}:' in lines
+    assert lines[-1].endswith("'a' -> 'b': too slow")
+
+
+def test_measure_translate_substitution():
+    text, _, matches, bytes_changed = measure_substitution(
+        TranslateSubstitution({'a': 'ä', 'b': 'b'}), 'aab')
+
+    assert text == 'ääb'
+    assert matches == 3
+    assert bytes_changed == 2
+
+
+def test_explain_plan():
+    substitutions = [RegexSubstitution('[0-9]+%', 'percent'),
+                     RegexSubstitution('<<', '«'),
+                     RegexSubstitution('[A-Z]{3,}', 'ABBR'),
+                     SimpleSubstitution('a', 'b'),
+                     SimpleSubstitution('c', 'd')]
+
+    lines = explain_plan(substitutions)
+
+    assert lines[1] == '  pass 1: fused alternation of 2 substitutions'
+    assert lines[2].endswith("1  /[0-9]+%/ -> 'percent'")
+    assert lines[3].endswith("3  /[A-Z]{3,}/ -> 'ABBR'")
+    assert lines[4] == '  pass 2:'
+    assert lines[6] == '  pass 3: simple substitution set of 2 substitutions'
+    assert lines[-1] == '5 substitutions in 3 passes, 2 passes saved'
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""Tests for `publish.render` module.
+"""
+
+# pylint: disable=missing-docstring,no-self-use,invalid-name
+
+import pytest
+
+from publish.render import (HTML_CHAPTER_SEP, MD_PARAGRAPH_SEP,
+                            collect_reference_definitions, render_chapters, render_markdown)
+
+CHAPTERS = [
+    '\n'.join(('# First',
+               '',
+               'See [the docs][docs] and [the second chapter][second].',
+               '',
+               '[docs]: http://example.com/docs "Docs"')),
+    '\n'.join(('# Second',
+               '',
+               'Back to [the docs][docs], or [the third chapter][third].',
+               '',
+               '[second]: #second',
+               '[third]: #third')),
+    '\n'.join(('# Third',
+               '',
+               'The docs [moved][docs].',
+               '',
+               '[docs]: http://example.com/moved')),
+]
+
+
+def test_collect_reference_definitions():
+    expected = '\n'.join(('[docs]: http://example.com/docs "Docs"',
+                          '[second]: #second',
+                          '[third]: #third',
+                          '[docs]: http://example.com/moved'))
+
+    actual = collect_reference_definitions(CHAPTERS)
+
+    assert actual == expected
+
+
+def test_collect_reference_definitions_no_definitions():
+    assert collect_reference_definitions(['# Foo', 'bar']) == ''
+
+
+def test_collect_reference_definitions_ignores_abbreviations_and_footnotes():
+    assert collect_reference_definitions(['*[HTML]: Hyper Text Markup Language',
+                                          '[^1]: A footnote with a few words.']) == ''
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_render_chapters_matches_single_document(jobs):
+    expected = render_markdown(MD_PARAGRAPH_SEP.join(CHAPTERS))
+
+    actual = HTML_CHAPTER_SEP.join(render_chapters(CHAPTERS, jobs=jobs))
+
+    assert actual == expected
+
+
+def test_render_chapters_preserves_order():
+    actual = render_chapters(['# 1', '# 2', '# 3'], jobs=2)
+
+    assert actual == ['<h1>1</h1>', '<h1>2</h1>', '<h1>3</h1>']
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""Tests for `publish.sources` module.
+"""
+
+# pylint: disable=missing-docstring,no-self-use,invalid-name
+
+import os
+from unittest.mock import patch
+
+import pytest
+
+from publish.changes import ChangeDetector
+from publish.sources import find_directories, find_files, is_pattern, natural_sort_key
+
+
+@pytest.fixture
+def book(tmp_path, monkeypatch):
+    for path in ['chapters/chapter 10.md', 'chapters/chapter 2.md', 'chapters/Chapter 1.md',
+                 'chapters/notes.txt', 'chapters/.draft.md', 'chapters/part 2/b.md',
+                 'chapters/part 2/a.md', 'chapters/part 10/a.md', 'chapters/.hidden/a.md',
+                 'intro.md']:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(path)
+
+    monkeypatch.chdir(tmp_path)
+
+    return tmp_path
+
+
+def paths(*paths_):
+    return [os.path.join(*path.split('/')) for path in paths_]
+
+
+@pytest.mark.parametrize('path, expected', [
+    ('chapters/*.md', True),
+    ('chapter?.md', True),
+    ('chapter[12].md', True),
+    ('chapters/chapter 1.md', False),
+])
+def test_is_pattern(path, expected):
+    assert is_pattern(path) is expected
+
+
+def test_natural_sort_key():
+    names = ['chapter 10.md', 'chapter 2.md', 'Chapter 1.md', 'chapter 1b.md', 'appendix.md',
+             'part 2/z.md', 'part 10/a.md', 'part 2.md']
+
+    assert sorted(names, key=natural_sort_key) == ['appendix.md', 'Chapter 1.md',
+                                                   'chapter 1b.md', 'chapter 2.md',
+                                                   'chapter 10.md', 'part 2/z.md', 'part 2.md',
+                                                   'part 10/a.md']
+
+
+def test_find_files(book):  # pylint: disable=unused-argument
+    assert find_files('chapters/*.md') == paths('chapters/Chapter 1.md', 'chapters/chapter 2.md',
+                                                'chapters/chapter 10.md')
+
+
+def test_find_files_recursive(book):  # pylint: disable=unused-argument
+    assert find_files('chapters/**/a.md') == paths('chapters/part 2/a.md',
+                                                   'chapters/part 10/a.md')
+    assert find_files('chapters/part */*.md') == paths('chapters/part 2/a.md',
+                                                       'chapters/part 2/b.md',
+                                                       'chapters/part 10/a.md')
+    assert find_files('**/*.md') == paths('chapters/Chapter 1.md', 'chapters/chapter 2.md',
+                                          'chapters/chapter 10.md', 'chapters/part 2/a.md',
+                                          'chapters/part 2/b.md', 'chapters/part 10/a.md',
+                                          'intro.md')
+    assert find_files('chapters/part 2/**') == paths('chapters/part 2/a.md',
+                                                     'chapters/part 2/b.md')
+
+
+def test_find_files_hidden(book):  # pylint: disable=unused-argument
+    assert find_files('chapters/.*.md') == paths('chapters/.draft.md')
+    assert find_files('chapters/.hidden/*.md') == paths('chapters/.hidden/a.md')
+
+
+def test_find_files_exclude(book):  # pylint: disable=unused-argument
+    assert find_files('chapters/**/*.md', ['chapters/part*', '*10*']) == \
+        paths('chapters/Chapter 1.md', 'chapters/chapter 2.md')
+
+
+def test_find_files_absolute(book):
+    assert find_files(str(book / 'chapters' / 'part 2' / '*.md')) == \
+        [str(book / 'chapters' / 'part 2' / 'a.md'), str(book / 'chapters' / 'part 2' / 'b.md')]
+
+
+def test_find_files_without_wildcards(book):  # pylint: disable=unused-argument
+    assert find_files('intro.md') == ['intro.md']
+    assert find_files('missing.md') == []
+    assert find_files('missing/*.md') == []
+
+
+def test_find_files_uses_detector_listings(book):
+    for directory in [book / 'chapters', book / 'chapters' / 'part 2',
+                      book / 'chapters' / 'part 10']:
+        mtime = directory.stat().st_mtime - 10
+        os.utime(str(directory), (mtime, mtime))
+
+    detector = ChangeDetector(None)
+    expected = find_files('chapters/**/*.md', detector=detector)
+
+    with patch('os.scandir') as mock_scandir:
+        assert find_files('chapters/**/*.md', detector=detector) == expected
+
+    mock_scandir.assert_not_called()
+
+
+@pytest.mark.parametrize('pattern, expected', [
+    ('chapters/*.md', ['chapters']),
+    ('chapters/**/*.md', ['chapters', 'chapters/part 2', 'chapters/part 10']),
+    ('chapters/part */a.md', ['chapters', 'chapters/part 2', 'chapters/part 10']),
+    ('*.md', ['.']),
+    ('missing/part 1/*.md', ['.']),
+    ('chapters/missing/*.md', ['chapters']),
+    ('chapters/chapter 2.md', []),
+])
+def test_find_directories(book, pattern, expected):
+    assert sorted(find_directories(pattern)) == sorted(paths(*expected))
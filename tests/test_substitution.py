@@ -12,11 +12,35 @@
 
 # pylint: disable=missing-docstring,no-self-use,invalid-name
 
+import random
+import re
 from abc import ABCMeta
 
-from publish.substitution import (Substitution,
+import pytest
+
+from publish.book import Chapter, ChapterSelector
+from publish.substitution import (ChapterSubstitutions,
+                                  Substitution,
                                   SimpleSubstitution,
-                                  apply_substitutions, RegexSubstitution)
+                                  SimpleSubstitutionSet, FusedSubstitution,
+                                  apply_substitutions, compile_substitutions, substitute_texts,
+                                  fuse_substitutions,
+                                  collapse_translations, get_required_literals,
+                                  RegexSubstitution, TranslateSubstitution)
+
+
+class ReplaceCountingStr(str):
+    replaced = []
+
+    def replace(self, old, new, count=-1):
+        ReplaceCountingStr.replaced.append(old)
+        return ReplaceCountingStr(super().replace(old, new, count))
+
+
+def apply_sequentially(text, substitutions):
+    for substitution in substitutions:
+        text = substitution.apply_to(text)
+    return text
 
 
 class TestSubstitution:
@@ -106,6 +130,346 @@ class TestRegexSubstitution:
 
         assert actual == ''
 
+    def test_apply_to_skips_text_without_literal(self):
+        substitution = RegexSubstitution(pattern=r'\+\+(.*?)\+\+', replace_with=r'<b>\1</b>')
+
+        assert substitution.apply_to('no markup') == 'no markup'
+        assert substitution.apply_to('++a++') == '<b>a</b>'
+        assert substitution.apply_to('+ only one') == '+ only one'
+        assert substitution.skipped == 2
+        assert substitution.applied == 1
+
+    @pytest.mark.parametrize('pattern, expected', [
+        (r'\+\+(?P<text>.*?)\+\+', {'++'}),
+        (r'(foo|bar)baz?', {'foo', 'bar'}),
+        (r'x{0,3}yy', {'yy'}),
+        (r'[äö]x*', {'ä', 'ö'}),
+        (r'(?i:ab)cd', {'cd'}),
+        (r'\bthe\b', {'the'}),
+        (r'(?i)abc', None),
+        (r'\d+', None),
+        (r'a?|b', None),
+        (r'[^a]b?', None),
+        ('', None),
+    ])
+    def test_get_required_literals(self, pattern, expected):
+        literals = get_required_literals(re.compile(pattern))
+
+        assert literals == (None if expected is None else frozenset(expected))
+
+    def test_apply_to_matches_re_sub(self):
+        rng = random.Random(14)
+        pieces = ['a', 'b', 'ab', '.', 'a*', 'b+', '(a|bc)', '[ab]', '(?:ba)?', r'\b', 'c{2}']
+
+        for _ in range(500):
+            pattern = ''.join(rng.choice(pieces) for _ in range(rng.randint(1, 4)))
+            text = ''.join(rng.choice('abc ') for _ in range(rng.randint(0, 12)))
+            substitution = RegexSubstitution(pattern, '<>')
+
+            assert substitution.apply_to(text) == re.sub(pattern, '<>', text), pattern
+
+
+class TestTranslateSubstitution:
+    def test_apply_to(self):
+        substitution = TranslateSubstitution({"'": '’', '"': '”', '-': '', 'f': 'ff'})
+
+        assert substitution.apply_to('"It\'s-fun"') == '”It’sffun”'
+
+    def test_apply_to_replaces_all_characters_at_once(self):
+        substitution = TranslateSubstitution({'a': 'b', 'b': 'a'})
+
+        assert substitution.apply_to('abba') == 'baab'
+
+    @pytest.mark.parametrize('mapping', [{'ab': 'c'}, {'': 'c'}, {1: 'c'}, {'a': None}])
+    def test_init_raises_type_error_for_invalid_mapping(self, mapping):
+        with pytest.raises(TypeError):
+            TranslateSubstitution(mapping)
+
+
+class TestCollapseTranslations:
+    def test_collapses_consecutive_single_characters(self):
+        regex = RegexSubstitution('a+', 'a')
+
+        collapsed = collapse_translations([SimpleSubstitution("'", '’'),
+                                           SimpleSubstitution('"', '”'),
+                                           SimpleSubstitution('-', ''),
+                                           regex,
+                                           SimpleSubstitution('x', 'y'),
+                                           SimpleSubstitution('--', '–')])
+
+        assert len(collapsed) == 4
+        assert collapsed[0].mapping == {"'": '’', '"': '”', '-': ''}
+        assert collapsed[1] is regex
+        assert collapsed[2].old == 'x'
+        assert collapsed[3].old == '--'
+
+    def test_chained_characters_start_a_new_translation(self):
+        collapsed = collapse_translations([SimpleSubstitution('a', 'b'),
+                                           SimpleSubstitution('c', 'd'),
+                                           SimpleSubstitution('b', 'c'),
+                                           SimpleSubstitution('e', 'f')])
+
+        assert [item.mapping for item in collapsed] == [{'a': 'b', 'c': 'd'},
+                                                        {'b': 'c', 'e': 'f'}]
+        assert apply_substitutions('abce', collapsed) == 'ccdf'
+
+    def test_matches_sequential_application(self):
+        rng = random.Random(15)
+
+        for _ in range(500):
+            substitutions = [SimpleSubstitution(rng.choice('abcd'),
+                                                rng.choice(['', 'a', 'b', 'c', 'd', 'ab']))
+                             for _ in range(rng.randint(1, 8))]
+            text = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 20)))
+            expected = text
+
+            for substitution in substitutions:
+                expected = substitution.apply_to(expected)
+
+            actual = text
+
+            for substitution in collapse_translations(substitutions):
+                actual = substitution.apply_to(actual)
+
+            assert actual == expected
+
+    def test_collapse_keeps_selectors_apart(self):
+        selector = ChapterSelector(tags='appendix')
+
+        collapsed = collapse_translations([SimpleSubstitution('a', 'b'),
+                                           SimpleSubstitution('c', 'd', selector),
+                                           SimpleSubstitution('e', 'f', ChapterSelector(
+                                               tags='appendix'))])
+
+        assert len(collapsed) == 2
+        assert collapsed[0].old == 'a'
+        assert collapsed[1].mapping == {'c': 'd', 'e': 'f'}
+        assert collapsed[1].selector == selector
+
+
+class TestChapterSubstitutions:
+    def test_get_selects_substitutions(self):
+        everywhere = SimpleSubstitution('a', 'b')
+        appendix = SimpleSubstitution('b', 'c', ChapterSelector(tags='appendix'))
+        substitutions = ChapterSubstitutions([everywhere, appendix])
+
+        assert substitutions.get(Chapter('1.md')) == [everywhere]
+        assert substitutions.get(Chapter('2.md', tags='appendix')) == [everywhere, appendix]
+
+    def test_get_compiled_compiles_each_selection_once(self):
+        substitutions = ChapterSubstitutions([
+            SimpleSubstitution('a', 'b'),
+            SimpleSubstitution('b', 'c'),
+            SimpleSubstitution('c', 'd', ChapterSelector(paths='appendix/*.md'))])
+
+        first = substitutions.get_compiled(Chapter('1.md'))
+
+        assert substitutions.get_compiled(Chapter('2.md')) is first
+        assert substitutions.get_compiled(Chapter('appendix/a.md')) is not first
+        assert len(first) == 1
+
+    def test_substitute_texts_with_chapters(self):
+        chapters = [Chapter('1.md'), Chapter('2.md', tags='appendix')]
+        substitutions = [SimpleSubstitution('a', 'b'),
+                         RegexSubstitution('b+', 'c', ChapterSelector(tags='appendix'))]
+
+        assert list(substitute_texts(['ab', 'ab'], substitutions, chapters)) == ['bb', 'c']
+        assert list(substitute_texts(['ab', 'ab'], substitutions)) == ['c', 'c']
+
+
+class TestCompileSubstitutions:
+    def test_merges_consecutive_simple_substitutions(self):
+        substitutions = [SimpleSubstitution('cat', 'dog'),
+                         SimpleSubstitution('sun', 'moon'),
+                         SimpleSubstitution('big', 'small')]
+
+        compiled = compile_substitutions(substitutions)
+
+        assert len(compiled) == 1
+        assert isinstance(compiled[0], SimpleSubstitutionSet)
+        assert compiled[0].apply_to('big sun, big cat') == 'small moon, small dog'
+
+    def test_applies_only_substitutions_occurring_in_text(self):
+        substitutions = [SimpleSubstitution(old, old.upper()) for old in ['cat', 'sun', 'big']]
+        compiled = compile_substitutions(substitutions)
+
+        assert compiled[0].apply_to(ReplaceCountingStr('a cat')) == 'a CAT'
+        assert ReplaceCountingStr.replaced == ['cat']
+
+    def test_applies_substitutions_formed_by_new_strings(self):
+        substitutions = [SimpleSubstitution('a', 'b'),
+                         SimpleSubstitution('b', 'c')]
+
+        assert compile_substitutions(substitutions)[0].apply_to('ab') == 'cc'
+        assert compile_substitutions(substitutions)[0].apply_to('a') == 'c'
+
+    def test_applies_substitutions_formed_by_new_strings_and_text(self):
+        substitutions = [SimpleSubstitution('colour', 'color'),
+                         SimpleSubstitution('red', 'blue')]
+
+        assert compile_substitutions(substitutions)[0].apply_to('coloured') == 'coloblue'
+
+    def test_applies_overlapping_substitutions_in_order(self):
+        substitutions = [SimpleSubstitution('bc', 'y'),
+                         SimpleSubstitution('ab', 'x'),
+                         SimpleSubstitution('abc', 'z')]
+
+        assert compile_substitutions(substitutions)[0].apply_to('abc abcd') == 'ay ayd'
+
+    def test_ends_set_after_removal(self):
+        substitutions = [SimpleSubstitution('-', ''),
+                         SimpleSubstitution('ab', 'x'),
+                         SimpleSubstitution('cd', 'y')]
+
+        compiled = compile_substitutions(substitutions)
+
+        assert compiled[0] is substitutions[0]
+        assert isinstance(compiled[1], SimpleSubstitutionSet)
+        assert apply_substitutions('a-b c-d', substitutions) == 'x y'
+
+    def test_keeps_other_substitutions_in_order(self):
+        regex = RegexSubstitution('c+', 'c')
+        substitutions = [SimpleSubstitution('a', 'b'),
+                         SimpleSubstitution('x', 'y'),
+                         regex,
+                         SimpleSubstitution('', 'z')]
+
+        compiled = compile_substitutions(substitutions)
+
+        assert compiled[1:] == substitutions[2:]
+        assert isinstance(compiled[0], SimpleSubstitutionSet)
+
+    def test_accepts_generator(self):
+        compiled = compile_substitutions(SimpleSubstitution(old, 'x') for old in 'ab')
+
+        assert compiled[0].apply_to('abc') == 'xxc'
+
+    def test_matches_sequential_semantics(self):
+        rng = random.Random(4)
+        alphabet = 'abcd'
+
+        def word(minimum, maximum):
+            return ''.join(rng.choice(alphabet)
+                           for _ in range(rng.randint(minimum, maximum)))
+
+        for _ in range(500):
+            substitutions = [SimpleSubstitution(word(1, 4), word(0, 4))
+                             for _ in range(rng.randint(1, 40))]
+            text = word(0, 30)
+
+            expected = apply_sequentially(text, substitutions)
+
+            assert apply_sequentially(text, compile_substitutions(substitutions)) == expected
+
+
+class TestFuseSubstitutions:
+    def test_fuses_independent_substitutions(self):
+        substitutions = [RegexSubstitution('[0-9]+%', 'N percent'),
+                         RegexSubstitution('[!?]+', '!'),
+                         RegexSubstitution('[-]{2}', '–')]
+
+        fused = fuse_substitutions(substitutions)
+
+        assert len(fused) == 1
+        assert isinstance(fused[0], FusedSubstitution)
+        assert fused[0].substitutions == substitutions
+        assert fused[0].apply_to('50% -- now?!') == 'N percent – now!'
+
+    @pytest.mark.parametrize('first, second', [
+        (RegexSubstitution('[ab]+', 'c'), RegexSubstitution('[bc]+', 'd')),
+        (RegexSubstitution('[ab]+', 'c'), RegexSubstitution('[cd]+', 'e')),
+        (RegexSubstitution('[ab]+', ''), RegexSubstitution('[cd]+', 'e')),
+        (RegexSubstitution('[ab]+', r'\g<0>'), RegexSubstitution('[cd]+', 'e')),
+        (RegexSubstitution('[ab]+', 'x'), RegexSubstitution('(?i)[.]+', 'e')),
+        (RegexSubstitution('[ab]+', 'x'), RegexSubstitution('[cd]+(?=.)', 'e')),
+        (RegexSubstitution('[ab]+', 'x'), RegexSubstitution('[cd]+', r'\d')),
+        (RegexSubstitution('[ab]$', 'x'), RegexSubstitution('[\n]+', 'e')),
+    ])
+    def test_keeps_dependent_substitutions_apart(self, first, second):
+        assert fuse_substitutions([first, second]) == [first, second]
+
+    def test_keeps_substitutions_starting_with_literal_apart(self):
+        substitutions = [RegexSubstitution('[0-9]+', '#'),
+                         RegexSubstitution('x[yz]+', 'w'),
+                         SimpleSubstitution('a', 'b')]
+
+        assert fuse_substitutions(substitutions) == substitutions
+
+    def test_moves_substitution_ahead_of_commuting_substitutions(self):
+        substitutions = [RegexSubstitution('[0-9]+', '#'),
+                         SimpleSubstitution('colour', 'color'),
+                         RegexSubstitution('[!]+', '.')]
+
+        fused = fuse_substitutions(substitutions)
+
+        assert len(fused) == 2
+        assert fused[0].substitutions == [substitutions[0], substitutions[2]]
+        assert fused[1] is substitutions[1]
+        assert apply_sequentially('colour 42!!', fused) == 'color #.'
+
+    def test_does_not_move_ahead_of_dependent_substitutions(self):
+        substitutions = [RegexSubstitution('[0-9]+', '#'),
+                         SimpleSubstitution('!', 'x'),
+                         RegexSubstitution('[!]+', '.')]
+
+        assert fuse_substitutions(substitutions) == substitutions
+
+    def test_replaces_group_references(self):
+        substitutions = [RegexSubstitution('[+]{2}(?P<text>[a-z]+)[+]{2}', r'<b>\g<text></b>'),
+                         RegexSubstitution('[_*]([a-z])([0-9])[_*]', r'<i>\2\1\g<0></i>'),
+                         RegexSubstitution('[~]+', r'\t')]
+
+        fused = FusedSubstitution(substitutions)
+
+        assert fused.apply_to('++ab++ _x1_ ~~~') == '<b>ab</b> <i>1x_x1_</i> \t'
+
+    def test_counts_skipped_substitutions(self):
+        substitutions = [RegexSubstitution('[0-9]+ab', '#'),
+                         RegexSubstitution('[!]+cd', '.')]
+
+        assert FusedSubstitution(substitutions).apply_to('1ab 2ab') == '# #'
+        assert [s.applied for s in substitutions] == [1, 0]
+        assert [s.skipped for s in substitutions] == [0, 1]
+
+    @pytest.mark.parametrize('substitution', [
+        SimpleSubstitution('a', 'b'),
+        RegexSubstitution('ab+', 'b'),
+        RegexSubstitution('(?i)[a]+', 'b'),
+        TranslateSubstitution({'a': 'b'}),
+    ])
+    def test_raises_value_error_for_other_substitutions(self, substitution):
+        with pytest.raises(ValueError):
+            FusedSubstitution([RegexSubstitution('[0-9]+', '#'), substitution])
+
+    def test_matches_sequential_semantics(self):
+        rng = random.Random(19)
+        alphabet = 'abcdef!\n'
+        patterns = ['[{0}]+', '[{0}]', '[{0}]{{2}}', '[{0}][{1}]*', '(?:[{0}]|[{1}])+', '[{0}]$',
+                    '[{0}](?=[{1}])', '[{0}](?![{1}])', '^[{0}]+', '([{0}])([{1}])']
+        replacements = ['', '{0}', '{0}{1}', r'<\g<0>>', r'\1', '{0}{0}{0}']
+
+        def characters():
+            return re.escape(rng.choice(alphabet))
+
+        for _ in range(2000):
+            substitutions = []
+
+            for _ in range(rng.randint(2, 8)):
+                pattern = rng.choice(patterns).format(characters(), characters())
+                replacement = rng.choice(replacements).format(rng.choice(alphabet),
+                                                              rng.choice(alphabet))
+
+                if r'\1' in replacement and '(' not in pattern.replace('(?', ''):
+                    replacement = ''
+
+                substitutions.append(RegexSubstitution(pattern, replacement))
+
+            text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+
+            expected = apply_sequentially(text, substitutions)
+
+            assert apply_sequentially(text, fuse_substitutions(substitutions)) == expected
+
 
 def test_apply_substitutions():
     substitution1 = SimpleSubstitution(old='foo', new='bar')
@@ -135,3 +499,39 @@ def test_apply_substitutions():
     actual = apply_substitutions(text, [substitution1, substitution2, substitution3])
 
     assert actual == expected
+
+
+def test_apply_substitutions_accepts_generator():
+    substitutions = (SimpleSubstitution(old, new) for old, new in [('a', 'b'), ('c', 'd')])
+
+    assert apply_substitutions('ac', substitutions) == 'bd'
+
+
+def test_substitute_texts():
+    substitutions = (s for s in [SimpleSubstitution('a', 'b'), RegexSubstitution('b+', 'c')])
+
+    assert list(substitute_texts(['ab', 'xa', ''], substitutions)) == ['c', 'xc', '']
+
+
+def test_substitute_texts_applies_substitutions_to_each_text_on_its_own():
+    substitutions = [RegexSubstitution(r'end\s+start', 'joined'),
+                     RegexSubstitution(r'\A', '<'),
+                     RegexSubstitution(r'\Z', '>')]
+
+    assert list(substitute_texts(['the end\n', 'start over'], substitutions)) == \
+        ['<the end\n>', '<start over>']
+
+
+def test_substitute_texts_consumes_one_text_at_a_time():
+    read = []
+
+    def texts():
+        for text in ['a', 'b', 'c']:
+            read.append(text)
+            yield text
+
+    substituted = substitute_texts(texts(), [SimpleSubstitution('b', 'x')])
+
+    assert next(substituted) == 'a'
+    assert read == ['a']
+    assert list(substituted) == ['x', 'c']
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""Tests for `publish.table` module.
+"""
+
+# pylint: disable=missing-docstring,no-self-use,invalid-name
+
+import json
+import re
+from unittest.mock import patch
+
+import pytest
+
+from publish.changes import ChangeDetector
+from publish.substitution import (SimpleSubstitution, RegexSubstitution, TranslateSubstitution,
+                                  apply_substitutions)
+from publish.table import load_substitutions_file, read_substitutions_file
+
+
+def test_read_tsv(tmp_path):
+    path = tmp_path / 'terms.tsv'
+    path.write_text('old\tnew\nColour\tColor\n"quoted"\t“quoted”\n\nremove me\t\n',
+                    encoding='utf-8')
+
+    substitutions = read_substitutions_file(str(path))
+
+    assert [(s.old, s.new) for s in substitutions] == [('Colour', 'Color'),
+                                                       ('"quoted"', '“quoted”'),
+                                                       ('remove me', '')]
+
+
+def test_read_csv(tmp_path):
+    path = tmp_path / 'rules.csv'
+    path.write_text('\ufeffpattern,replace_with\n"\\+\\+(.*?)\\+\\+","<b>\\1</b>"\n'
+                    '"a, b",c\n', encoding='utf-8')
+
+    substitutions = read_substitutions_file(str(path))
+
+    assert all(isinstance(s, RegexSubstitution) for s in substitutions)
+    assert substitutions[0].regular_expression.pattern == r'\+\+(.*?)\+\+'
+    assert substitutions[1].regular_expression.pattern == 'a, b'
+    assert apply_substitutions('++x++ a, b', substitutions) == '<b>x</b> c'
+
+
+def test_read_mixed_table_collapses_single_characters(tmp_path):
+    path = tmp_path / 'mixed.tsv'
+    path.write_text("old\tnew\tpattern\treplace_with\n'\t’\t\t\n-\t–\t\t\n\t\tx+\tx\n",
+                    encoding='utf-8')
+
+    substitutions = read_substitutions_file(str(path))
+
+    assert isinstance(substitutions[0], TranslateSubstitution)
+    assert substitutions[0].mapping == {"'": '’', '-': '–'}
+    assert isinstance(substitutions[1], RegexSubstitution)
+
+
+def test_read_invalid_columns_raises_type_error(tmp_path):
+    path = tmp_path / 'terms.tsv'
+    path.write_text('find\treplace\n', encoding='utf-8')
+
+    with pytest.raises(TypeError):
+        read_substitutions_file(str(path))
+
+
+def test_read_invalid_row_raises_value_error(tmp_path):
+    path = tmp_path / 'terms.tsv'
+    path.write_text('old\tnew\na\tb\n\tb\n', encoding='utf-8')
+
+    with pytest.raises(ValueError) as exc_info:
+        read_substitutions_file(str(path))
+
+    assert 'line 3' in str(exc_info.value)
+
+
+def test_load_uses_cache_until_file_changes(tmp_path):
+    path = tmp_path / 'terms.tsv'
+    path.write_text('old\tnew\nab\tcd\n', encoding='utf-8')
+    cache = str(tmp_path / 'cache')
+
+    first = load_substitutions_file(str(path), cache)
+
+    with patch('publish.table._iter_rows') as mock_read:
+        second = load_substitutions_file(str(path), cache)
+
+    mock_read.assert_not_called()
+    assert [(s.old, s.new) for s in second] == [(s.old, s.new) for s in first]
+
+    path.write_text('old\tnew\nab\tef\n', encoding='utf-8')
+
+    assert load_substitutions_file(str(path), cache)[0].new == 'ef'
+
+
+def test_load_with_detector(tmp_path):
+    path = tmp_path / 'terms.tsv'
+    path.write_text('old\tnew\nab\tcd\n', encoding='utf-8')
+    cache = str(tmp_path / 'cache')
+    detector = ChangeDetector(None)
+
+    load_substitutions_file(str(path), cache, detector)
+
+    with patch('publish.table._iter_rows') as mock_read:
+        substitutions = load_substitutions_file(str(path), cache, ChangeDetector(None))
+
+    mock_read.assert_not_called()
+    assert isinstance(substitutions[0], SimpleSubstitution)
+
+
+def test_load_ignores_invalid_cache_entry(tmp_path):
+    path = tmp_path / 'terms.tsv'
+    path.write_text('old\tnew\nab\tcd\n', encoding='utf-8')
+    cache = tmp_path / 'cache'
+    load_substitutions_file(str(path), str(cache))
+
+    for entry in cache.iterdir():
+        entry.write_bytes(b'garbage')
+
+    assert load_substitutions_file(str(path), str(cache))[0].new == 'cd'
+
+
+def test_load_caches_analysed_substitutions_as_json(tmp_path):
+    path = tmp_path / 'terms.csv'
+    path.write_text('pattern,replace_with\na+,b\n', encoding='utf-8')
+    cache = tmp_path / 'cache'
+
+    load_substitutions_file(str(path), str(cache))
+
+    entry, = cache.iterdir()
+    assert json.loads(entry.read_text(encoding='utf-8'))['substitutions'] == [
+        ['regex', 'a+', re.UNICODE, 'b', ['a'], [['a'], ['b'], True, ['a']]]]
+    substitution, = load_substitutions_file(str(path), str(cache))
+    assert isinstance(substitution, RegexSubstitution)
+    assert substitution.replace_with == 'b'
+
+
+def test_warm_load_skips_analysis(tmp_path):
+    path = tmp_path / 'terms.tsv'
+    path.write_text('old\tnew\tpattern\treplace_with\n'
+                    'a\tb\t\t\n'
+                    'c\td\t\t\n'
+                    '\t\t[0-9]+%\t\\g<0> percent\n'
+                    '\t\tfoo(bar)?\tbaz\n', encoding='utf-8')
+    cache = str(tmp_path / 'cache')
+    first = load_substitutions_file(str(path), cache)
+
+    with patch('publish.table.collapse_translations') as mock_collapse, \
+            patch('publish.substitution.get_required_literals') as mock_literals, \
+            patch('publish.substitution._get_fusion_analysis') as mock_fusion, \
+            patch('publish.substitution.re.compile', wraps=re.compile) as mock_compile:
+        second = load_substitutions_file(str(path), cache)
+
+    mock_collapse.assert_not_called()
+    mock_literals.assert_not_called()
+    mock_fusion.assert_not_called()
+    mock_compile.assert_not_called()
+    assert [type(s) for s in second] == [type(s) for s in first] == \
+        [TranslateSubstitution, RegexSubstitution, RegexSubstitution]
+    assert [(s.literals, s.fusion) for s in second[1:]] == \
+        [(s.literals, s.fusion) for s in first[1:]]
+    assert apply_substitutions('ac 5% foo', second) == \
+        apply_substitutions('ac 5% foo', first) == 'bd 5% percent baz'
+
+
+def test_load_missing_file_raises_error(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        load_substitutions_file(str(tmp_path / 'missing.tsv'), str(tmp_path / 'cache'))
+
+    with pytest.raises(FileNotFoundError):
+        load_substitutions_file(str(tmp_path / 'missing.tsv'))
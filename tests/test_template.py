@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""Tests for `publish.template` module.
+"""
+
+# pylint: disable=missing-docstring,no-self-use,invalid-name
+
+import os
+
+from publish.template import TemplateRegistry
+
+USER_TEMPLATE = '''{% extends "publish/template.jinja" %}
+{% block head %}<link rel="icon" href="icon.png">
+{% endblock %}'''
+
+
+def render(template, content='<p>Bar</p>'):
+    return template.render(content=[content], title='Foo', css='', language='en',
+                           package_version='1')
+
+
+class TestTemplateRegistry:
+    def test_get_template_compiles_bundled_template_once(self):
+        registry = TemplateRegistry()
+
+        template = registry.get_template()
+
+        assert template is registry.get_template()
+        assert '<title>Foo</title>' in render(template)
+        assert '<body>\n<p>Bar</p>\n</body>' in render(template)
+
+    def test_get_template_user_template_extends_bundled_template(self, tmp_path):
+        (tmp_path / 'book.jinja').write_text(USER_TEMPLATE)
+        registry = TemplateRegistry()
+
+        template = registry.get_template(str(tmp_path / 'book.jinja'))
+        actual = render(template)
+
+        assert template is registry.get_template(str(tmp_path / 'book.jinja'))
+        assert '</style>\n<link rel="icon" href="icon.png">\n</head>' in actual
+        assert '<body>\n<p>Bar</p>\n</body>' in actual
+
+    def test_get_template_recompiles_changed_user_template(self, tmp_path):
+        path = tmp_path / 'book.jinja'
+        path.write_text('{{ title }}')
+        registry = TemplateRegistry()
+
+        assert render(registry.get_template(str(path))) == 'Foo'
+
+        path.write_text('{{ language }}')
+        os.utime(str(path), (1, 1))
+
+        assert render(registry.get_template(str(path))) == 'en'
+
+    def test_enable_bytecode_cache_writes_compiled_templates(self, tmp_path):
+        registry = TemplateRegistry()
+        registry.enable_bytecode_cache(str(tmp_path / 'templates'))
+
+        registry.get_template()
+
+        assert os.listdir(str(tmp_path / 'templates'))
+        assert '<title>Foo</title>' in render(TemplateRegistry(str(tmp_path / 'templates'))
+                                              .get_template())
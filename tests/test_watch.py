@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# anited. publish - Python package with cli to turn markdown files into ebooks
+# Copyright (c) 2014 Christopher Knörndel
+#
+# Distributed under the MIT License
+# (license terms are at http://opensource.org/licenses/MIT).
+
+"""Tests for `publish.watch` module.
+"""
+
+# pylint: disable=missing-docstring,no-self-use,invalid-name,protected-access
+
+import os
+import sys
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from publish.build import build
+from publish.cache import RenderCache
+from publish.watch import InotifyWatcher, PollingWatcher, watch
+
+PROJECT = """
+title: My book
+chapters:
+  - src: 1.md
+  - src: 2.md
+    publish: False
+outputs:
+  - path: one.html
+  - path: all.html
+    force_publish: True
+"""
+
+
+class ScriptedWatcher:
+    """Watcher stub returning the scripted changes, one set per wait."""
+
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.watched = None
+        self.directories = None
+        self.closed = False
+
+    def watch(self, paths, directories=()):
+        self.watched = set(paths)
+        self.directories = set(directories)
+
+    def wait(self, debounce=0):
+        if not self.changes:
+            raise KeyboardInterrupt
+        change = self.changes.pop(0)
+        if callable(change):
+            return change()
+        return change
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def project(tmp_path):
+    (tmp_path / '.publish.yml').write_text(PROJECT)
+    (tmp_path / '1.md').write_text('# One')
+    (tmp_path / '2.md').write_text('# Two')
+    cwd = os.getcwd()
+    os.chdir(str(tmp_path))
+    yield tmp_path
+    os.chdir(cwd)
+
+
+def write_later(path, text):
+    def write():
+        path.write_text(text)
+        return {str(path)}
+    return write
+
+
+def get_made_outputs(mock_build):
+    return [[output.path for output in call[0][2]] for call in mock_build.call_args_list]
+
+
+def test_watch_rebuilds_only_affected_outputs(project):
+    watcher = ScriptedWatcher([write_later(project / '2.md', '# Zwei'),
+                               write_later(project / '1.md', '# Eins')])
+
+    with patch('publish.watch.build') as mock_build:
+        watch('.publish.yml', cache=False, watcher=watcher)
+
+    assert get_made_outputs(mock_build) == [['one.html', 'all.html'],
+                                            ['all.html'],
+                                            ['one.html', 'all.html']]
+    assert str(project / '2.md') in watcher.watched
+    assert str(project / '.publish.yml') in watcher.watched
+    assert watcher.closed
+
+
+def test_watch_ignores_changes_without_new_content(project):
+    watcher = ScriptedWatcher([write_later(project / '1.md', '# One')])
+
+    with patch('publish.watch.build') as mock_build:
+        watch('.publish.yml', cache=False, watcher=watcher)
+
+    assert len(mock_build.call_args_list) == 1
+
+
+def test_watch_reloads_project(project):
+    watcher = ScriptedWatcher([write_later(project / '.publish.yml',
+                                           PROJECT.replace('all.html', 'every.html'))])
+
+    with patch('publish.watch.build') as mock_build:
+        watch('.publish.yml', cache=False, watcher=watcher)
+
+    assert get_made_outputs(mock_build)[-1] == ['one.html', 'every.html']
+
+
+def test_watch_reloads_substitutions_file(project):
+    (project / 'terms.tsv').write_text('old\tnew\nOne\tUno\n')
+    (project / '.publish.yml').write_text(PROJECT + 'substitutions_file: terms.tsv\n')
+    watcher = ScriptedWatcher([write_later(project / 'terms.tsv', 'old\tnew\nOne\tEins\n')])
+
+    with patch('publish.watch.build') as mock_build:
+        watch('.publish.yml', watcher=watcher)
+
+    assert str(project / 'terms.tsv') in watcher.watched
+    assert [s.new for s in mock_build.call_args_list[-1][0][1]] == ['Eins']
+
+
+def test_watch_finds_new_chapter_files(project):
+    (project / 'part').mkdir()
+    (project / 'part' / 'a.md').write_text('# A')
+    (project / '.publish.yml').write_text(PROJECT.replace('  - src: 2.md\n',
+                                                          '  - src: part/*.md\n'
+                                                          '  - src: 2.md\n'))
+
+    def add_chapter():
+        (project / 'part' / 'b.md').write_text('# B')
+        return {str(project / 'part')}
+
+    watcher = ScriptedWatcher([add_chapter, write_later(project / 'part' / 'b.md', '# Bee')])
+
+    with patch('publish.watch.build') as mock_build:
+        watch('.publish.yml', cache=False, watcher=watcher)
+
+    assert watcher.directories == {str(project / 'part')}
+    assert str(project / 'part' / 'b.md') in watcher.watched
+    assert len(mock_build.call_args_list) == 3
+    assert [chapter.src for chapter in mock_build.call_args_list[1][0][0].chapters] == \
+        ['1.md', os.path.join('part', 'a.md'), os.path.join('part', 'b.md'), '2.md']
+    assert get_made_outputs(mock_build)[2] == ['one.html', 'all.html']
+
+
+def test_watch_ignores_directory_changes_without_new_chapters(project):
+    (project / 'part').mkdir()
+    (project / 'part' / 'a.md').write_text('# A')
+    (project / '.publish.yml').write_text(PROJECT.replace('  - src: 2.md\n',
+                                                          '  - dir: part\n'
+                                                          '  - src: 2.md\n'))
+
+    def add_other_file():
+        (project / 'part' / 'notes.txt').write_text('notes')
+        return {str(project / 'part')}
+
+    watcher = ScriptedWatcher([add_other_file])
+
+    with patch('publish.watch.build') as mock_build:
+        watch('.publish.yml', cache=False, watcher=watcher)
+
+    assert len(mock_build.call_args_list) == 1
+
+
+@pytest.mark.parametrize('cache', [True, False])
+def test_watch_rebuilds_epub_when_image_changes(project, cache):
+    (project / 'img.png').write_bytes(b'image')
+    (project / '1.md').write_text('# One\n\n![an image](img.png)')
+    (project / '.publish.yml').write_text(PROJECT.replace('outputs:\n',
+                                                          'outputs:\n  - path: book.epub\n')
+                                          + 'epub_writer: native\n')
+    watcher = ScriptedWatcher([write_later(project / 'img.png', 'changed image')])
+
+    with patch('publish.watch.build', wraps=build) as mock_build:
+        watch('.publish.yml', cache=cache, watcher=watcher)
+
+    assert str(project / 'img.png') in watcher.watched
+    assert get_made_outputs(mock_build)[-1] == ['book.epub']
+
+
+def test_watch_keeps_watching_after_errors(project):
+    watcher = ScriptedWatcher([write_later(project / '.publish.yml', 'outputs: ['),
+                               write_later(project / '1.md', '# Eins')])
+
+    with patch('publish.watch.build', side_effect=[RuntimeError, None, None]) as mock_build:
+        watch('.publish.yml', cache=False, watcher=watcher)
+
+    assert mock_build.call_count == 2
+
+
+def test_watch_skips_up_to_date_outputs_with_cache(project):
+    watcher = ScriptedWatcher([write_later(project / '2.md', '# Zwei')])
+
+    watch('.publish.yml', watcher=watcher)
+
+    assert (project / 'all.html').exists()
+    assert 'Zwei' in (project / 'all.html').read_text()
+    assert (project / '.publish-cache' / 'manifest.json').exists()
+
+
+def test_watch_keeps_render_cache_in_memory_without_cache(project):
+    watcher = ScriptedWatcher([write_later(project / '2.md', '# Zwei')])
+    caches = []
+
+    def create_cache(*args, **kwargs):
+        caches.append(RenderCache(*args, **kwargs))
+        return caches[-1]
+
+    with patch('publish.watch.RenderCache', side_effect=create_cache):
+        watch('.publish.yml', cache=False, watcher=watcher)
+
+    render_cache, = caches
+    assert render_cache.directory is None
+    assert render_cache.hits > 0
+    assert 'Zwei' in (project / 'all.html').read_text()
+    assert not (project / '.publish-cache').exists()
+
+
+def change_later(path, text, delay=0.1):
+    def change():
+        time.sleep(delay)
+        path.write_text(text)
+    thread = threading.Thread(target=change)
+    thread.start()
+    return thread
+
+
+def test_polling_watcher(tmp_path):
+    (tmp_path / 'a.md').write_text('a')
+    (tmp_path / 'b.md').write_text('b')
+    watcher = PollingWatcher(interval=0.01)
+    watcher.watch([str(tmp_path / 'a.md'), str(tmp_path / 'b.md')])
+
+    thread = change_later(tmp_path / 'b.md', 'changed')
+    changed = watcher.wait(debounce=0.05)
+    thread.join()
+
+    assert changed == {str(tmp_path / 'b.md')}
+
+
+def test_polling_watcher_directories(tmp_path):
+    (tmp_path / 'a.md').write_text('a')
+    watcher = PollingWatcher(interval=0.01)
+    watcher.watch([], [str(tmp_path)])
+
+    thread = change_later(tmp_path / 'b.md', 'new')
+    changed = watcher.wait(debounce=0.05)
+    thread.join()
+
+    assert changed == {str(tmp_path)}
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify requires linux')
+def test_inotify_watcher(tmp_path):
+    (tmp_path / 'a.md').write_text('a')
+    (tmp_path / 'b.md').write_text('b')
+    watcher = InotifyWatcher()
+    watcher.watch([str(tmp_path / 'a.md')])
+
+    try:
+        (tmp_path / 'b.md').write_text('ignored')
+        thread = change_later(tmp_path / 'a.md', 'changed')
+        changed = watcher.wait(debounce=0.05)
+        thread.join()
+
+        assert changed == {str(tmp_path / 'a.md')}
+
+        (tmp_path / 'a.tmp').write_text('replaced')
+        os.replace(str(tmp_path / 'a.tmp'), str(tmp_path / 'a.md'))
+
+        assert watcher.wait(debounce=0.05) == {str(tmp_path / 'a.md')}
+    finally:
+        watcher.close()
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify requires linux')
+def test_inotify_watcher_directories(tmp_path):
+    (tmp_path / 'part').mkdir()
+    (tmp_path / 'part' / 'a.md').write_text('a')
+    watcher = InotifyWatcher()
+    watcher.watch([str(tmp_path / 'part' / 'a.md')], [str(tmp_path / 'part')])
+
+    try:
+        (tmp_path / 'part' / 'a.md').write_text('changed')
+
+        assert watcher.wait(debounce=0.05) == {str(tmp_path / 'part' / 'a.md')}
+
+        (tmp_path / 'part' / 'b.md').write_text('new')
+
+        assert watcher.wait(debounce=0.05) == {str(tmp_path / 'part')}
+    finally:
+        watcher.close()
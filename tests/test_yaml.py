@@ -12,14 +12,23 @@
 
 # pylint: disable=missing-docstring,no-self-use,invalid-name,protected-access
 # pylint: disable=too-few-public-methods
+import json
+import os
+from datetime import date
+from unittest.mock import patch
+
 import pytest
 
+from publish.epub import EpubOutput
 from publish.output import HtmlOutput, EbookConvertOutput
 from publish.book import Book, Chapter
+from publish.changes import ChangeDetector
 # noinspection PyProtectedMember
 from publish.yaml import (load_yaml, _load_book, _load_chapters, _load_ebookconvert_params,
-                          _load_outputs, _load_substitutions, load_project)
-from publish.substitution import SimpleSubstitution, RegexSubstitution
+                          _load_outputs, _load_substitutions, get_chapter_patterns,
+                          get_substitutions_files, load_project)
+import publish.yaml
+from publish.substitution import SimpleSubstitution, RegexSubstitution, TranslateSubstitution
 
 
 def test_load_book():
@@ -84,6 +93,45 @@ chapters:
     assert actual[2].__dict__ == expected[2].__dict__
 
 
+def test_load_chapters_from_patterns_and_directories(tmp_path, monkeypatch):
+    for path in ['intro.md', 'part 1/chapter 10.md', 'part 1/chapter 9.md', 'part 1/draft.md',
+                 'appendix/b.md', 'appendix/a/a.md']:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(path)
+    monkeypatch.chdir(tmp_path)
+    yaml = r"""
+chapters:
+  - src: intro.md
+  - src: part 1/*.md
+    exclude: '*draft*'
+    tags: [main]
+  - dir: appendix
+    publish: False
+"""
+
+    actual = list(_load_chapters(load_yaml(yaml)))
+
+    assert [(chapter.src.replace('\\', '/'), chapter.publish, chapter.tags)
+            for chapter in actual] == [('intro.md', True, []),
+                                       ('part 1/chapter 9.md', True, ['main']),
+                                       ('part 1/chapter 10.md', True, ['main']),
+                                       ('appendix/a/a.md', False, []),
+                                       ('appendix/b.md', False, [])]
+
+
+def test_load_chapters_from_directory_with_pattern(tmp_path, monkeypatch):
+    for path in ['appendix/b.md', 'appendix/a/a.md', 'appendix/c.txt']:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(path)
+    monkeypatch.chdir(tmp_path)
+
+    actual = list(_load_chapters({'chapters': [{'dir': 'appendix', 'pattern': '*.*'}]}))
+
+    assert [chapter.src for chapter in actual] == [os.path.join('appendix', 'b.md'),
+                                                   os.path.join('appendix', 'c.txt')]
+    assert list(_load_chapters({'chapters': [{'dir': 'missing'}]})) == []
+
+
 def test_load_ebookconvert_params():
     yaml = r"""
 ebookconvert_params:
@@ -210,6 +258,34 @@ outputs:
     assert actual[2].__dict__ == expected[2].__dict__
 
 
+def test_load_outputs_uses_epub_output_for_native_epub_writer():
+    yaml = """
+epub_writer: native
+stylesheet: style.css
+outputs:
+  - path: example.epub
+  - path: example.mobi
+  - path: other.epub
+    epub_writer: ebook-convert"""
+
+    actual = list(_load_outputs(load_yaml(yaml)))
+
+    assert [type(output) for output in actual] == [EpubOutput, EbookConvertOutput,
+                                                   EbookConvertOutput]
+    assert actual[0].__dict__ == EpubOutput(path='example.epub', stylesheet='style.css').__dict__
+    assert not hasattr(actual[1], 'epub_writer')
+
+
+def test_load_outputs_unknown_epub_writer_raises_value_error():
+    yaml = """
+outputs:
+  - path: example.epub
+    epub_writer: calibre"""
+
+    with pytest.raises(ValueError):
+        list(_load_outputs(load_yaml(yaml)))
+
+
 def test_load_outputs_loads_mixed_outputs():
     yaml = """
 outputs:
@@ -279,6 +355,26 @@ outputs:
     assert actual[0].__dict__ == expected[0].__dict__
 
 
+def test_load_outputs_uses_global_template_unless_local_present():
+    yaml = """
+template: global.jinja
+
+outputs:
+  - path: global.html
+  - path: local.epub
+    template: local.jinja"""
+
+    expected = [
+        HtmlOutput(path='global.html', template='global.jinja'),
+        EbookConvertOutput(path='local.epub', template='local.jinja'),
+    ]
+
+    actual = list(_load_outputs(load_yaml(yaml)))
+
+    assert actual[0].__dict__ == expected[0].__dict__
+    assert actual[1].__dict__ == expected[1].__dict__
+
+
 def test_load_outputs_uses_global_ebookconvert_params_when_no_local_present():
     yaml = """
 ebookconvert_params:
@@ -357,6 +453,50 @@ substitutions:
     assert actual[1].__dict__ == expected[1].__dict__
 
 
+def test_load_substitutions_translate():
+    yaml = r"""
+substitutions:
+  - translate:
+      "'": ’
+      '"': ”
+  - old: '-'
+    new: –
+  - old: '~'
+    new: ''
+"""
+
+    actual = list(_load_substitutions(load_yaml(yaml)))
+
+    assert len(actual) == 2
+    assert isinstance(actual[0], TranslateSubstitution)
+    assert actual[0].mapping == {"'": '’', '"': '”'}
+    assert isinstance(actual[1], TranslateSubstitution)
+    assert actual[1].mapping == {'-': '–', '~': ''}
+
+
+def test_load_substitutions_with_selector():
+    yaml = r"""
+substitutions:
+  - old: a
+    new: b
+    chapters: appendix/*.md
+    tags: [appendix, glossary]
+  - pattern: c+
+    replace_with: c
+    tags: appendix
+  - old: d
+    new: e
+"""
+
+    actual = list(_load_substitutions(load_yaml(yaml)))
+
+    assert actual[0].selector.paths == ['appendix/*.md']
+    assert actual[0].selector.tags == ['appendix', 'glossary']
+    assert actual[1].selector.paths == []
+    assert actual[1].selector.tags == ['appendix']
+    assert actual[2].selector is None
+
+
 def test_load_substitutions_raises_type_error_when_keys_dont_match_any_substitution():
     yaml = r"""
     substitutions:
@@ -422,3 +562,151 @@ outputs:
     assert list(actual_substitutions)[0].__dict__ == expected_substitutions[0].__dict__
     assert len(list(actual_outputs)) == len(expected_outputs)
     assert list(actual_outputs)[0].__dict__ == expected_outputs[0].__dict__
+
+
+def test_load_project_scans_dependencies(tmp_path):
+    (tmp_path / 'chapter.md').write_text('# Chapter')
+    yaml = f"""
+title: My book
+cover: {tmp_path / 'cover.jpg'}
+chapters:
+  - src: {tmp_path / 'chapter.md'}
+outputs:
+  - path: example.html
+"""
+    detector = ChangeDetector(str(tmp_path / 'index.json'))
+
+    with patch.object(detector, 'scan', wraps=detector.scan) as mock_scan:
+        load_project(yaml, detector)
+
+    assert mock_scan.call_count == 1
+    assert sorted(mock_scan.call_args[0][0]) == sorted([str(tmp_path / 'chapter.md'),
+                                                        str(tmp_path / 'cover.jpg')])
+    assert detector.get_hash(str(tmp_path / 'chapter.md')) is not None
+
+
+def test_load_project_appends_substitutions_files(tmp_path):
+    (tmp_path / 'terms.tsv').write_text('old\tnew\nColour\tColor\n')
+    (tmp_path / 'rules.csv').write_text('pattern,replace_with\nx+,x\n')
+    yaml = f"""
+title: My book
+substitutions:
+  - old: a
+    new: b
+substitutions_file:
+  - {tmp_path / 'terms.tsv'}
+  - {tmp_path / 'rules.csv'}
+outputs:
+  - path: example.html
+"""
+
+    _, substitutions, _ = load_project(yaml, table_cache=str(tmp_path / 'cache'))
+
+    assert [type(s).__name__ for s in substitutions] == ['SimpleSubstitution',
+                                                         'SimpleSubstitution',
+                                                         'RegexSubstitution']
+    assert substitutions[1].old == 'Colour'
+    assert list((tmp_path / 'cache').iterdir())
+
+
+def test_load_project_uses_project_cache_until_yaml_changes(tmp_path):
+    yaml = """
+title: My book
+chapters:
+  - src: chapter.md
+substitutions:
+  - pattern: '[+]{2}(.*?)[+]{2}'
+    replace_with: <b>\\1</b>
+outputs:
+  - path: example.html
+"""
+    cache = str(tmp_path / 'project.json')
+
+    load_project(yaml, project_cache=cache)
+
+    with patch('publish.yaml.load_yaml') as mock_load:
+        book, substitutions, outputs = load_project(yaml, project_cache=cache)
+
+    mock_load.assert_not_called()
+    assert book.title == 'My book'
+    assert book.chapters[0].src == 'chapter.md'
+    assert substitutions[0].apply_to('++a++') == '<b>a</b>'
+    assert substitutions[0].literals == frozenset(['+'])
+    assert outputs[0].path == 'example.html'
+
+    assert load_project(yaml.replace('My book', 'Other'), project_cache=cache)[0].title == \
+        'Other'
+
+    with patch.object(publish.yaml, '__version__', '0.0.0'), \
+            patch('publish.yaml.load_yaml', wraps=load_yaml) as mock_load:
+        load_project(yaml, project_cache=cache)
+
+    mock_load.assert_called_once()
+
+
+def test_load_project_cache_keeps_dates(tmp_path):
+    yaml = 'title: My book\npubdate: 2020-01-02\ncomments: "2020-01-03"\noutputs: []\n'
+    cache = str(tmp_path / 'project.json')
+
+    expected, _, _ = load_project(yaml, project_cache=cache)
+    actual, _, _ = load_project(yaml, project_cache=cache)
+
+    assert actual.pubdate == expected.pubdate == date(2020, 1, 2)
+    assert actual.comments == '2020-01-03'
+
+
+def test_load_project_does_not_cache_values_json_cannot_represent(tmp_path):
+    cache = tmp_path / 'project.json'
+
+    load_project('title: My book\nseries: !!set {a}\noutputs: []\n', project_cache=str(cache))
+
+    assert not cache.exists()
+
+
+def test_load_project_cache_is_json(tmp_path):
+    cache = tmp_path / 'project.json'
+
+    load_project('title: My book\noutputs: []\n', project_cache=str(cache))
+
+    assert json.loads(cache.read_text())['project'] == {'title': 'My book', 'outputs': []}
+
+
+def test_load_project_ignores_invalid_project_cache(tmp_path):
+    cache = tmp_path / 'project.json'
+    cache.write_bytes(b'garbage')
+
+    book, _, _ = load_project('title: My book\noutputs: []\n', project_cache=str(cache))
+
+    assert book.title == 'My book'
+    assert cache.read_bytes() != b'garbage'
+
+
+def test_load_project_with_project_cache_finds_new_chapter_files(tmp_path, monkeypatch):
+    (tmp_path / 'chapters').mkdir()
+    (tmp_path / 'chapters' / '1.md').write_text('1')
+    monkeypatch.chdir(tmp_path)
+    yaml = 'title: My book\nchapters:\n  - dir: chapters\noutputs: []\n'
+    cache = str(tmp_path / 'project.json')
+
+    load_project(yaml, project_cache=cache)
+    (tmp_path / 'chapters' / '2.md').write_text('2')
+    book, _, _ = load_project(yaml, ChangeDetector(None), project_cache=cache)
+
+    assert [chapter.src for chapter in book.chapters] == [os.path.join('chapters', '1.md'),
+                                                          os.path.join('chapters', '2.md')]
+
+
+def test_get_substitutions_files():
+    assert get_substitutions_files({}) == []
+    assert get_substitutions_files({'substitutions_file': 'terms.tsv'}) == ['terms.tsv']
+    assert get_substitutions_files({'substitutions_file': ['a.tsv', 'b.csv']}) == ['a.tsv',
+                                                                                   'b.csv']
+
+
+def test_get_chapter_patterns():
+    assert get_chapter_patterns({}) == []
+    assert get_chapter_patterns({'chapters': [{'src': 'intro.md'},
+                                              {'src': 'part_1/*.md', 'exclude': '*draft*'},
+                                              {'dir': 'appendix', 'pattern': '*.txt'},
+                                              {'dir': 'notes'}]}) == \
+        ['part_1/*.md', os.path.join('appendix', '*.txt'), os.path.join('notes', '**/*.md')]